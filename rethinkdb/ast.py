@@ -34,8 +34,11 @@ import base64
 import binascii
 from collections import abc
 import datetime
-import threading
-from typing import Any, Callable, Iterable, List, Mapping, Optional
+import hashlib
+import json
+import math
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, Iterator, List, Mapping, Optional, Tuple
 from typing import Union as TUnion
 
 from rethinkdb import ql2_pb2
@@ -46,20 +49,107 @@ from rethinkdb.utilities import EnhancedTuple
 P_TERM = ql2_pb2.Term.TermType  # pylint: disable=invalid-name
 
 
+def _get_memo(term: "RqlQuery") -> Optional[tuple]:
+    """
+    Return the memoized serialization of the term, or None if it was not serialized
+    yet or a serialized term was mutated since.
+    """
+
+    memo = getattr(term, "_fragment", None)
+
+    # pylint: disable=protected-access
+    if memo is None or memo[0] != RqlQuery._fragment_generation:
+        return None
+
+    return memo
+
+
 class RqlQuery:  # pylint: disable=too-many-public-methods
     """
     The RethinkDB Query object which determines the operations we can request
     from the server.
     """
 
+    # The terms are created in large numbers, so they have no instance dictionary.
+    # The subclasses declare their own attributes in `__slots__` too, while the term
+    # type and the statement are class attributes.
+    #
+    # The `_fragment` memoizes the serialization of the term: a tuple of the
+    # generation it was memoized in, the JSON of the term, and its digests without
+    # and with the literal values normalized, any of which may be None. The
+    # generation is incremented whenever a serialized term is mutated, which
+    # invalidates the memoized serialization of every term, as the parents of the
+    # mutated term are not known.
+    __slots__ = ("_args", "kwargs", "_fragment")
+
+    term_type: Optional[int] = None
+    statement: str = ""
+
+    _fragment_generation: int = 0
+
     def __init__(self, *args, **kwargs: dict):
-        self._args = [expr(e) for e in args]
-        self.kwargs = {k: expr(v) for k, v in kwargs.items()}
-        self.term_type: Optional[int] = None
+        _set_args(self, [expr(e) for e in args] if args else [])
+        _set_kwargs(self, {k: expr(v) for k, v in kwargs.items()} if kwargs else {})
+
+    # Assigning an attribute of a serialized term drops its memoized JSON. The
+    # constructors of the most common terms assign their attributes through the slot
+    # descriptors instead, as a new term has nothing to drop.
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name != "_fragment" and getattr(self, "_fragment", None) is not None:
+            self.invalidate_fragment()
+
+        object.__setattr__(self, name, value)
+
+    def get_fragment(self) -> Optional[bytes]:
+        """
+        Return the memoized JSON of the term, or None if the term was not serialized
+        yet or a serialized term was mutated since.
+        """
+
+        memo = _get_memo(self)
+        return None if memo is None else memo[1]
+
+    def invalidate_fragment(self) -> None:
+        """
+        Drop the memoized JSON and fingerprint of the term and its parents. It is
+        called when an attribute of a serialized term is assigned, and must be called
+        by the code mutating the arguments of a serialized term in place.
+        """
+
+        if getattr(self, "_fragment", None) is not None:
+            RqlQuery._fragment_generation += 1
+            self._fragment = None
+
+    def set_fragment(self, fragment: bytes) -> None:
+        """
+        Memoize the JSON of the term, which is reused until a serialized term is
+        mutated.
+        """
 
-        # TODO: when doing a refactor, make this parameter required and use
-        # proper `super` call everywhere we reuse this class.
-        self.statement: str = ""
+        memo = _get_memo(self)
+
+        if memo is None:
+            self._fragment = (RqlQuery._fragment_generation, fragment, None, None)
+        else:
+            self._fragment = (memo[0], fragment, memo[2], memo[3])
+
+    def fingerprint(self, normalize_literals: bool = False) -> str:
+        """
+        Return the fingerprint of the query, a hash of the query tree which is stable
+        across processes. The queries with the same fingerprint are serialized to the
+        same query, so the fingerprint can key the results of the query.
+
+        With `normalize_literals`, the literal values are hashed as placeholders, so
+        the queries which differ only in their values have the same fingerprint.
+        The names of the databases and tables, the keys of the objects, the field
+        names of `pluck`, `without`, `has_fields`, `get_field`, `order_by` and the
+        brackets, the variables and the optional arguments, like the `index` of
+        `get_all` and `order_by`, are kept.
+
+        The hash of every term is memoized on the term, like its JSON.
+        """
+
+        return _get_digest(self, normalize_literals).hex()
 
     # TODO: add Connection type to connection when net module is migrated
     # TODO: add return value when net module is migrated
@@ -735,8 +825,10 @@ class RqlQuery:  # pylint: disable=too-many-public-methods
 
 
 class RqlBoolOperQuery(RqlQuery):
+    __slots__ = ("infix",)
+
     def __init__(self, *args, **kwargs):
-        super().__init__(self, *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.infix = False
 
     def set_infix(self):
@@ -751,7 +843,7 @@ class RqlBoolOperQuery(RqlQuery):
         ]
 
         if self.infix:
-            infix = EnhancedTuple(*term_args, int_separator=[" ", self.infix, " "])
+            infix = EnhancedTuple(*term_args, int_separator=[" ", self.st_infix, " "])
             return EnhancedTuple("(", infix, ")")
 
         return EnhancedTuple(
@@ -768,6 +860,8 @@ class RqlBiOperQuery(RqlQuery):
     RethinkDB binary query operation.
     """
 
+    __slots__ = ()
+
     def compose(self, args, kwargs):  # pylint: disable=unused-argument
         term_args = [
             EnhancedTuple("r.expr(", args[i], ")")
@@ -788,8 +882,10 @@ class RqlBiCompareOperQuery(RqlBiOperQuery):
     RethinkDB comparison operator query.
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
-        super().__init__(self, *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         for arg in args:
             if hasattr(arg, "infix"):
@@ -805,6 +901,8 @@ class RqlBiCompareOperQuery(RqlBiOperQuery):
 
 
 class RqlTopLevelQuery(RqlQuery):
+    __slots__ = ()
+
     def compose(self, args, kwargs):
         args.extend([EnhancedTuple(key, "=", value) for key, value in kwargs.items()])
         return EnhancedTuple(
@@ -813,6 +911,8 @@ class RqlTopLevelQuery(RqlQuery):
 
 
 class RqlMethodQuery(RqlQuery):
+    __slots__ = ()
+
     def compose(self, args, kwargs):
         if len(args) == 0:
             return EnhancedTuple("r.", self.statement, "()")
@@ -828,6 +928,8 @@ class RqlMethodQuery(RqlQuery):
 
 
 class RqlBracketQuery(RqlMethodQuery):
+    __slots__ = ("bracket_operator",)
+
     def __init__(self, *args, **kwargs):
         self.bracket_operator = False
 
@@ -835,7 +937,7 @@ class RqlBracketQuery(RqlMethodQuery):
             self.bracket_operator = kwargs["bracket_operator"]
             del kwargs["bracket_operator"]
 
-        super().__init__(self, *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
     def compose(self, args, kwargs):
         if self.bracket_operator:
@@ -894,9 +996,15 @@ class Datum(RqlQuery):
     our arrays and objects are composed only of basic types.
     """
 
-    def __init__(self, val):
-        super().__init__()
-        self.data = val
+    __slots__ = ("data",)
+
+    # The datums are the most common terms and have no arguments, so they share
+    # read-only empty arguments instead of allocating their own
+    _args = ()
+    kwargs = MappingProxyType({})
+
+    def __init__(self, val):  # pylint: disable=super-init-not-called
+        _set_data(self, val)
 
     def build(self):
         return self.data
@@ -905,11 +1013,18 @@ class Datum(RqlQuery):
         return repr(self.data)
 
 
+_set_args = RqlQuery._args.__set__  # pylint: disable=no-member
+_set_kwargs = RqlQuery.kwargs.__set__  # pylint: disable=no-member
+_set_data = Datum.data.__set__  # pylint: disable=no-member
+
+
 class MakeArray(RqlQuery):
     """
     RethinkDB array composer query.
     """
 
+    __slots__ = ()
+
     term_type = P_TERM.MAKE_ARRAY
 
     # pylint: disable=unused-argument,no-self-use
@@ -918,6 +1033,7 @@ class MakeArray(RqlQuery):
 
 
 class MakeObj(RqlQuery):
+    __slots__ = ()
     term_type = P_TERM.MAKE_OBJ
 
     def __init__(self, obj_dict):
@@ -947,7 +1063,28 @@ class MakeObj(RqlQuery):
         )
 
 
+class JsonDatum(Datum):
+    """
+    RethinkDB datum of a document or an array made of JSON values only.
+
+    The value was verified to contain no query, so unlike `MakeObj` and `MakeArray`
+    the nested values are not wrapped in terms. The built value is a snapshot of the
+    value taken when the datum is created, like the terms `expr` converts it to, with
+    the arrays still sent as MAKE_ARRAY terms.
+    """
+
+    __slots__ = ("built",)
+
+    def __init__(self, val, built):
+        super().__init__(val)
+        self.built = built
+
+    def build(self):
+        return self.built
+
+
 class Var(RqlQuery):
+    __slots__ = ()
     term_type = P_TERM.VAR
 
     # pylint: disable=unused-argument,no-self-use
@@ -956,36 +1093,43 @@ class Var(RqlQuery):
 
 
 class JavaScript(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.JAVASCRIPT
     statement = "js"
 
 
 class Http(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.HTTP
     statement = "http"
 
 
 class UserError(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.ERROR
     statement = "error"
 
 
 class Random(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.RANDOM
     statement = "random"
 
 
 class Changes(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CHANGES
     statement = "changes"
 
 
 class Default(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DEFAULT
     statement = "default"
 
 
 class ImplicitVar(RqlQuery):
+    __slots__ = ()
     term_type = P_TERM.IMPLICIT_VAR
 
     def __call__(self, *args, **kwargs):
@@ -997,36 +1141,43 @@ class ImplicitVar(RqlQuery):
 
 
 class Eq(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.EQ
     statement = "=="
 
 
 class Ne(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.NE
     statement = "!="
 
 
 class Lt(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.LT
     statement = "<"
 
 
 class Le(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.LE
     statement = "<="
 
 
 class Gt(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.GT
     statement = ">"
 
 
 class Ge(RqlBiCompareOperQuery):
+    __slots__ = ()
     term_type = P_TERM.GE
     statement = ">="
 
 
 class Not(RqlQuery):
+    __slots__ = ()
     term_type = P_TERM.NOT
 
     def compose(self, args, kwargs):  # pylint: disable=unused-argument
@@ -1037,111 +1188,133 @@ class Not(RqlQuery):
 
 
 class Add(RqlBiOperQuery):
+    __slots__ = ()
     term_type = P_TERM.ADD
     statement = "+"
 
 
 class Sub(RqlBiOperQuery):
+    __slots__ = ()
     term_type = P_TERM.SUB
     statement = "-"
 
 
 class Mul(RqlBiOperQuery):
+    __slots__ = ()
     term_type = P_TERM.MUL
     statement = "*"
 
 
 class Div(RqlBiOperQuery):
+    __slots__ = ()
     term_type = P_TERM.DIV
     statement = "/"
 
 
 class Mod(RqlBiOperQuery):
+    __slots__ = ()
     term_type = P_TERM.MOD
     statement = "%"
 
 
 class BitAnd(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_AND
     statement = "bit_and"
 
 
 class BitOr(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_OR
     statement = "bit_or"
 
 
 class BitXor(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_XOR
     statement = "bit_xor"
 
 
 class BitNot(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_NOT
     statement = "bit_not"
 
 
 class BitSal(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_SAL
     statement = "bit_sal"
 
 
 class BitSar(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.BIT_SAR
     statement = "bit_sar"
 
 
 class Floor(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.FLOOR
     statement = "floor"
 
 
 class Ceil(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CEIL
     statement = "ceil"
 
 
 class Round(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.ROUND
     statement = "round"
 
 
 class Append(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.APPEND
     statement = "append"
 
 
 class Prepend(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.PREPEND
     statement = "prepend"
 
 
 class Difference(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DIFFERENCE
     statement = "difference"
 
 
 class SetInsert(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SET_INSERT
     statement = "set_insert"
 
 
 class SetUnion(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SET_UNION
     statement = "set_union"
 
 
 class SetIntersection(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SET_INTERSECTION
     statement = "set_intersection"
 
 
 class SetDifference(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SET_DIFFERENCE
     statement = "set_difference"
 
 
 class Slice(RqlBracketQuery):
+    __slots__ = ()
     term_type = P_TERM.SLICE
     statement = "slice"
 
@@ -1157,76 +1330,91 @@ class Slice(RqlBracketQuery):
 
 
 class Skip(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SKIP
     statement = "skip"
 
 
 class Limit(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.LIMIT
     statement = "limit"
 
 
 class GetField(RqlBracketQuery):
+    __slots__ = ()
     term_type = P_TERM.GET_FIELD
     statement = "get_field"
 
 
 class Bracket(RqlBracketQuery):
+    __slots__ = ()
     term_type = P_TERM.BRACKET
     statement = "bracket"
 
 
 class Contains(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CONTAINS
     statement = "contains"
 
 
 class HasFields(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.HAS_FIELDS
     statement = "has_fields"
 
 
 class WithFields(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.WITH_FIELDS
     statement = "with_fields"
 
 
 class Keys(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.KEYS
     statement = "keys"
 
 
 class Values(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.VALUES
     statement = "values"
 
 
 class Object(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.OBJECT
     statement = "object"
 
 
 class Pluck(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.PLUCK
     statement = "pluck"
 
 
 class Without(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.WITHOUT
     statement = "without"
 
 
 class Merge(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MERGE
     statement = "merge"
 
 
 class Between(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.BETWEEN
     statement = "between"
 
 
 class DB(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.DB
     statement = "db"
 
@@ -1259,6 +1447,7 @@ class DB(RqlTopLevelQuery):
 
 
 class FunCall(RqlQuery):
+    __slots__ = ()
     term_type = P_TERM.FUNCALL
 
     # This object should be constructed with arguments first, and the
@@ -1271,7 +1460,7 @@ class FunCall(RqlQuery):
             raise ReqlDriverCompileError("Expected 1 or more arguments but found 0.")
 
         args = [func_wrap(args[-1])] + list(args[:-1])
-        super().__init__(self, *args)
+        super().__init__(*args)
 
     def compose(self, args, kwargs):  # pylint: disable=unused-argument
         if len(args) != 2:
@@ -1292,11 +1481,12 @@ class FunCall(RqlQuery):
 
 
 class Table(RqlQuery):  # pylint: disable=too-many-public-methods
+    __slots__ = ()
     term_type = P_TERM.TABLE
     statement = "table"
 
     def insert(self, *args, **kwargs):
-        return Insert(self, *[expr(arg) for arg in args], **kwargs)
+        return Insert(self, *[json_expr(arg) for arg in args], **kwargs)
 
     def get(self, *args):
         return Get(self, *args)
@@ -1375,378 +1565,453 @@ class Table(RqlQuery):  # pylint: disable=too-many-public-methods
 
 
 class Get(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GET
     statement = "get"
 
 
 class GetAll(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GET_ALL
     statement = "get_all"
 
 
 class GetIntersecting(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GET_INTERSECTING
     statement = "get_intersecting"
 
 
 class GetNearest(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GET_NEAREST
     statement = "get_nearest"
 
 
 class UUID(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.UUID
     statement = "uuid"
 
 
 class Reduce(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.REDUCE
     statement = "reduce"
 
 
 class Sum(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SUM
     statement = "sum"
 
 
 class Avg(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.AVG
     statement = "avg"
 
 
 class Min(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MIN
     statement = "min"
 
 
 class Max(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MAX
     statement = "max"
 
 
 class Map(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MAP
     statement = "map"
 
 
 class Fold(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.FOLD
     statement = "fold"
 
 
 class Filter(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.FILTER
     statement = "filter"
 
 
 class ConcatMap(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CONCAT_MAP
     statement = "concat_map"
 
 
 class OrderBy(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.ORDER_BY
     statement = "order_by"
 
 
 class Distinct(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DISTINCT
     statement = "distinct"
 
 
 class Count(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.COUNT
     statement = "count"
 
 
 class Union(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.UNION
     statement = "union"
 
 
 class Nth(RqlBracketQuery):
+    __slots__ = ()
     term_type = P_TERM.NTH
     statement = "nth"
 
 
 class Match(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MATCH
     statement = "match"
 
 
 class ToJsonString(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TO_JSON_STRING
     statement = "to_json_string"
 
 
 class Split(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SPLIT
     statement = "split"
 
 
 class Upcase(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.UPCASE
     statement = "upcase"
 
 
 class Downcase(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DOWNCASE
     statement = "downcase"
 
 
 class OffsetsOf(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.OFFSETS_OF
     statement = "offsets_of"
 
 
 class IsEmpty(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.IS_EMPTY
     statement = "is_empty"
 
 
 class Group(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GROUP
     statement = "group"
 
 
 class InnerJoin(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INNER_JOIN
     statement = "inner_join"
 
 
 class OuterJoin(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.OUTER_JOIN
     statement = "outer_join"
 
 
 class EqJoin(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.EQ_JOIN
     statement = "eq_join"
 
 
 class Zip(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.ZIP
     statement = "zip"
 
 
 class CoerceTo(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.COERCE_TO
     statement = "coerce_to"
 
 
 class Ungroup(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.UNGROUP
     statement = "ungroup"
 
 
 class TypeOf(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TYPE_OF
     statement = "type_of"
 
 
 class Update(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.UPDATE
     statement = "update"
 
 
 class Delete(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DELETE
     statement = "delete"
 
 
 class Replace(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.REPLACE
     statement = "replace"
 
 
 class Insert(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INSERT
     statement = "insert"
 
 
 class DbCreate(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.DB_CREATE
     statement = "db_create"
 
 
 class DbDrop(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.DB_DROP
     statement = "db_drop"
 
 
 class DbList(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.DB_LIST
     statement = "db_list"
 
 
 class TableCreate(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_CREATE
     statement = "table_create"
 
 
 class TableCreateTL(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_CREATE
     statement = "table_create"
 
 
 class TableDrop(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_DROP
     statement = "table_drop"
 
 
 class TableDropTL(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_DROP
     statement = "table_drop"
 
 
 class TableList(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_LIST
     statement = "table_list"
 
 
 class TableListTL(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.TABLE_LIST
     statement = "table_list"
 
 
 class SetWriteHook(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SET_WRITE_HOOK
     statement = "set_write_hook"
 
 
 class GetWriteHook(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GET_WRITE_HOOK
     statement = "get_write_hook"
 
 
 class IndexCreate(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_CREATE
     statement = "index_create"
 
 
 class IndexDrop(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_DROP
     statement = "index_drop"
 
 
 class IndexRename(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_RENAME
     statement = "index_rename"
 
 
 class IndexList(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_LIST
     statement = "index_list"
 
 
 class IndexStatus(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_STATUS
     statement = "index_status"
 
 
 class IndexWait(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INDEX_WAIT
     statement = "index_wait"
 
 
 class Config(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CONFIG
     statement = "config"
 
 
 class Status(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.STATUS
     statement = "status"
 
 
 class Wait(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.WAIT
     statement = "wait"
 
 
 class Reconfigure(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.RECONFIGURE
     statement = "reconfigure"
 
 
 class Rebalance(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.REBALANCE
     statement = "rebalance"
 
 
 class Sync(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SYNC
     statement = "sync"
 
 
 class Grant(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.GRANT
     statement = "grant"
 
 
 class GrantTL(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.GRANT
     statement = "grant"
 
 
 class Branch(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.BRANCH
     statement = "branch"
 
 
 class Or(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.OR
     statement = "or_"
     st_infix = "|"
 
 
 class And(RqlBoolOperQuery):
+    __slots__ = ()
     term_type = P_TERM.AND
     statement = "and_"
     st_infix = "&"
 
 
 class ForEach(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.FOR_EACH
     statement = "for_each"
 
 
 class Info(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INFO
     statement = "info"
 
 
 class InsertAt(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INSERT_AT
     statement = "insert_at"
 
 
 class SpliceAt(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SPLICE_AT
     statement = "splice_at"
 
 
 class DeleteAt(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DELETE_AT
     statement = "delete_at"
 
 
 class ChangeAt(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.CHANGE_AT
     statement = "change_at"
 
 
 class Sample(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SAMPLE
     statement = "sample"
 
 
 class Json(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.JSON
     statement = "json"
 
 
 class Args(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.ARGS
     statement = "args"
 
@@ -1770,6 +2035,7 @@ class RqlBinary(bytes):
 class Binary(RqlTopLevelQuery):
     # Note: this term isn't actually serialized, it should exist only
     # in the client
+    __slots__ = ("base64_data",)
     term_type = P_TERM.BINARY
     statement = "binary"
 
@@ -1814,188 +2080,218 @@ class Binary(RqlTopLevelQuery):
 
 
 class Range(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.RANGE
     statement = "range"
 
 
 class ToISO8601(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TO_ISO8601
     statement = "to_iso8601"
 
 
 class During(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DURING
     statement = "during"
 
 
 class Date(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DATE
     statement = "date"
 
 
 class TimeOfDay(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TIME_OF_DAY
     statement = "time_of_day"
 
 
 class Timezone(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TIMEZONE
     statement = "timezone"
 
 
 class Year(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.YEAR
     statement = "year"
 
 
 class Month(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MONTH
     statement = "month"
 
 
 class Day(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DAY
     statement = "day"
 
 
 class DayOfWeek(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DAY_OF_WEEK
     statement = "day_of_week"
 
 
 class DayOfYear(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DAY_OF_YEAR
     statement = "day_of_year"
 
 
 class Hours(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.HOURS
     statement = "hours"
 
 
 class Minutes(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.MINUTES
     statement = "minutes"
 
 
 class Seconds(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.SECONDS
     statement = "seconds"
 
 
 class Time(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.TIME
     statement = "time"
 
 
 class ISO8601(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.ISO8601
     statement = "iso8601"
 
 
 class EpochTime(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.EPOCH_TIME
     statement = "epoch_time"
 
 
 class Now(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.NOW
     statement = "now"
 
 
 class InTimezone(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.IN_TIMEZONE
     statement = "in_timezone"
 
 
 class ToEpochTime(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TO_EPOCH_TIME
     statement = "to_epoch_time"
 
 
 class GeoJson(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.GEOJSON
     statement = "geojson"
 
 
 class ToGeoJson(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.TO_GEOJSON
     statement = "to_geojson"
 
 
 class Point(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.POINT
     statement = "point"
 
 
 class Line(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.LINE
     statement = "line"
 
 
 class Polygon(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.POLYGON
     statement = "polygon"
 
 
 class Distance(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.DISTANCE
     statement = "distance"
 
 
 class Intersects(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INTERSECTS
     statement = "intersects"
 
 
 class Includes(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.INCLUDES
     statement = "includes"
 
 
 class Circle(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.CIRCLE
     statement = "circle"
 
 
 class Fill(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.FILL
     statement = "fill"
 
 
 class PolygonSub(RqlMethodQuery):
+    __slots__ = ()
     term_type = P_TERM.POLYGON_SUB
     statement = "polygon_sub"
 
 
 class Func(RqlQuery):
+    # The variables are numbered when the function is built, after the highest
+    # variable ID of the functions nested in its body. So the IDs of nested scopes
+    # never collide, the IDs depend only on the function itself, and structurally
+    # identical functions are serialized identically, without a global counter.
+    __slots__ = ("vrs", "max_var_id")
     term_type = P_TERM.FUNC
-    lock = threading.Lock()
-    nextVarId = 1
 
     def __init__(self, lmbd):
         super().__init__()
-        vrs = []
-        vrids = []
 
         try:
             code = lmbd.func_code
         except AttributeError:
             code = lmbd.__code__
 
-        for _ in range(code.co_argcount):
-            Func.lock.acquire()
-
-            var_id = Func.nextVarId
+        vrs = [Var() for _ in range(code.co_argcount)]
+        body = expr(lmbd(*vrs))
+        first_var_id = _get_max_var_id(body) + 1
+        vrids = list(range(first_var_id, first_var_id + len(vrs)))
 
-            Func.nextVarId += 1
-            Func.lock.release()
-
-            vrs.append(Var(var_id))
-            vrids.append(var_id)
+        for var, var_id in zip(vrs, vrids):
+            var._args.append(Datum(var_id))  # pylint: disable=protected-access
 
         self.vrs = vrs
-        self._args.extend([MakeArray(*vrids), expr(lmbd(*vrs))])
+        self.max_var_id = first_var_id + len(vrs) - 1
+        self._args.extend([MakeArray(*vrids), body])
 
     def compose(self, args, kwargs):  # pylint: disable=unused-argument
         return EnhancedTuple(
@@ -2016,17 +2312,42 @@ class Func(RqlQuery):
         )
 
 
+def _get_max_var_id(term: RqlQuery) -> int:
+    """
+    Return the highest variable ID of the functions in the term, or 0 if the term
+    has no functions. The functions are not walked, as they know their highest ID.
+    """
+
+    max_var_id = 0
+    pending = [term]
+
+    while pending:
+        current = pending.pop()
+
+        if isinstance(current, Func):
+            max_var_id = max(max_var_id, current.max_var_id)
+        else:
+            # pylint: disable=protected-access
+            pending.extend(current._args)
+            pending.extend(current.kwargs.values())
+
+    return max_var_id
+
+
 class Asc(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.ASC
     statement = "asc"
 
 
 class Desc(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.DESC
     statement = "desc"
 
 
 class Literal(RqlTopLevelQuery):
+    __slots__ = ()
     term_type = P_TERM.LITERAL
     statement = "literal"
 
@@ -2060,6 +2381,155 @@ def needs_wrap(arg):
 
 
 # pylint: disable=too-many-return-statements
+def _expr_datetime(val: TUnion[datetime.date, datetime.datetime]) -> RqlQuery:
+    if not getattr(val, "tzinfo", None):
+        raise ReqlDriverCompileError(
+            f"""
+        Cannot convert {type(val).__name__} to ReQL time object
+        without timezone information. You can add timezone information with
+        the third party module \"pytz\" or by constructing ReQL compatible
+        timezone values with r.make_timezone(\"[+-]HH:MM\"). Alternatively,
+        use one of ReQL's bultin time constructors, r.now, r.time,
+        or r.iso8601.
+        """
+        )
+
+    return ISO8601(val.isoformat())
+
+
+def _expr_query(val: RqlQuery) -> RqlQuery:
+    return val
+
+
+# The converted values which contain other values to convert
+_EXPR_MAPPING = object()
+_EXPR_ITERABLE = object()
+
+# The types of the values converted to a datum, whose lists and dictionaries are
+# converted in bulk
+_EXPR_DATUM_TYPES = frozenset((str, int, float, bool, type(None)))
+_EXPR_KEY_TYPES = frozenset((str,))
+
+# The conversion of the values by their type, which is filled for other types on
+# their first conversion
+_EXPR_CONVERTERS: dict = {
+    str: Datum,
+    int: Datum,
+    float: Datum,
+    bool: Datum,
+    type(None): Datum,
+    bytes: Binary,
+    dict: _EXPR_MAPPING,
+    list: _EXPR_ITERABLE,
+    tuple: _EXPR_ITERABLE,
+}
+
+
+def _get_expr_converter(val: Any) -> Any:
+    """
+    Return the conversion of the value, which is a function returning the term of
+    the value, or a marker for the values containing other values.
+    """
+
+    cls = type(val)
+
+    try:
+        return _EXPR_CONVERTERS[cls]
+    except KeyError:
+        pass
+
+    if isinstance(val, RqlQuery):
+        converter: Any = _expr_query
+    elif callable(val):
+        converter = Func
+    elif isinstance(val, str):
+        converter = Datum
+    elif isinstance(val, (bytes, RqlBinary)):
+        converter = Binary
+    elif isinstance(val, abc.Mapping):
+        converter = _EXPR_MAPPING
+    elif isinstance(val, abc.Iterable):
+        converter = _EXPR_ITERABLE
+    elif isinstance(val, (datetime.datetime, datetime.date)):
+        converter = _expr_datetime
+    else:
+        converter = Datum
+
+    _EXPR_CONVERTERS[cls] = converter
+    return converter
+
+
+class _ExprFrame:
+    """
+    A mapping or an iterable being converted by `expr`, with the terms of the values
+    converted so far.
+    """
+
+    __slots__ = ("keys", "values", "terms", "nesting_depth")
+
+    def __init__(self, val: Any, converter: Any, nesting_depth: int) -> None:
+        self.keys: Optional[List[Any]] = None
+
+        if converter is _EXPR_MAPPING:
+            self.keys = list(val.keys())
+            self.values: List[Any] = list(val.values())
+        else:
+            self.values = list(val)
+
+        self.terms: List[RqlQuery] = []
+        self.nesting_depth: int = nesting_depth
+
+    def make_term(self) -> RqlQuery:
+        """
+        Return the term of the converted mapping or iterable.
+        """
+
+        if self.keys is None:
+            return _make_array(self.terms)
+
+        for key in self.keys:
+            if not isinstance(key, str):
+                raise ReqlDriverCompileError("Object keys must be strings.")
+
+        return _make_obj(dict(zip(self.keys, self.terms)))
+
+
+def _make_array(terms: List[RqlQuery]) -> RqlQuery:
+    term = MakeArray.__new__(MakeArray)
+    _set_args(term, terms)
+    _set_kwargs(term, {})
+    return term
+
+
+def _make_obj(kwargs: dict) -> RqlQuery:
+    term = MakeObj.__new__(MakeObj)
+    _set_args(term, [])
+    _set_kwargs(term, kwargs)
+    return term
+
+
+def _expr_datums(val: Any) -> Optional[RqlQuery]:
+    """
+    Return the term of a list, a tuple or a dictionary made of datums only, whose
+    values are converted in bulk without looking up their conversion one by one, or
+    None for any other value.
+    """
+
+    cls = type(val)
+
+    if cls is list or cls is tuple:
+        if _EXPR_DATUM_TYPES.issuperset(map(type, val)):
+            return _make_array(list(map(Datum, val)))
+    elif (
+        cls is dict
+        and _EXPR_DATUM_TYPES.issuperset(map(type, val.values()))
+        and _EXPR_KEY_TYPES.issuperset(map(type, val))
+    ):
+        return _make_obj(dict(zip(val, map(Datum, val.values()))))
+
+    return None
+
+
 def expr(
     val: TUnion[
         str,
@@ -2076,6 +2546,9 @@ def expr(
 ):
     """
     Convert a Python primitive into a RQL primitive value.
+
+    The nested values are converted with an explicit stack instead of recursion,
+    and the conversion is looked up by the type of the value.
     """
 
     if not isinstance(nesting_depth, int):
@@ -2084,40 +2557,335 @@ def expr(
     if nesting_depth <= 0:
         raise ReqlDriverCompileError("Nesting depth limit exceeded.")
 
-    if isinstance(val, RqlQuery):
+    converter = _get_expr_converter(val)
+
+    if converter is not _EXPR_MAPPING and converter is not _EXPR_ITERABLE:
+        return converter(val)
+
+    term = _expr_datums(val) if nesting_depth > 1 else None
+
+    if term is not None:
+        return term
+
+    converters = _EXPR_CONVERTERS
+    frames = [_ExprFrame(val, converter, nesting_depth)]
+
+    while True:
+        frame = frames[-1]
+        values = frame.values
+        terms = frame.terms
+        nested = None
+
+        if len(terms) < len(values) and frame.nesting_depth <= 1:
+            raise ReqlDriverCompileError("Nesting depth limit exceeded.")
+
+        # Convert the values up to the next one containing other values
+        for index in range(len(terms), len(values)):
+            value = values[index]
+            converter = converters.get(type(value)) or _get_expr_converter(value)
+
+            if converter is _EXPR_MAPPING or converter is _EXPR_ITERABLE:
+                nesting_depth = frame.nesting_depth - 1
+                term = _expr_datums(value) if nesting_depth > 1 else None
+
+                if term is None:
+                    nested = _ExprFrame(value, converter, nesting_depth)
+                    break
+
+                terms.append(term)
+                continue
+
+            terms.append(converter(value))
+
+        if nested is not None:
+            frames.append(nested)
+            continue
+
+        term = frame.make_term()
+        frames.pop()
+
+        if not frames:
+            return term
+
+        frames[-1].terms.append(term)
+
+
+# The types of the values which are valid JSON values on their own. The floats are
+# valid only if they are finite, as JSON has no NaN or infinity.
+JSON_SCALAR_TYPES = frozenset((str, int, bool, type(None)))
+
+# Returned by `build_json` for values which are not made of JSON values only
+NOT_JSON = object()
+
+
+def build_json(val: Any, nesting_depth: int = 20) -> Any:
+    """
+    Return the built datum of a value made of dictionaries with string keys, lists,
+    tuples and JSON scalars only, or `NOT_JSON` for any other value. The nesting
+    depth is limited the same way as by `expr`.
+
+    The dictionaries and lists of the value are copied, so the built datum is a
+    snapshot of the value which is not changed by mutating the value afterwards.
+    """
+
+    if nesting_depth <= 0:
+        return NOT_JSON
+
+    cls = type(val)
+
+    if cls in JSON_SCALAR_TYPES:
         return val
 
-    if callable(val):
-        return Func(val)
+    if cls is float:
+        return val if math.isfinite(val) else NOT_JSON
 
-    if isinstance(val, str):  # TODO: Default is to return Datum - Remove?
-        return Datum(val)
+    child_depth = nesting_depth - 1
 
-    if isinstance(val, (bytes, RqlBinary)):
-        return Binary(val)
+    if cls is dict:
+        built_dict = dict(val)
 
-    if isinstance(val, abc.Mapping):
-        return MakeObj({k: expr(v, nesting_depth - 1) for k, v in val.items()})
+        for key, value in val.items():
+            if type(key) is not str:  # pylint: disable=unidiomatic-typecheck
+                return NOT_JSON
 
-    if isinstance(val, abc.Iterable):
-        return MakeArray(*[expr(v, nesting_depth - 1) for v in val])  # type: ignore
+            value_cls = type(value)
 
-    if isinstance(val, (datetime.datetime, datetime.date)):
-        if isinstance(val, datetime.date) or not val.tzinfo:
-            raise ReqlDriverCompileError(
-                f"""
-            Cannot convert {type(val).__name__} to ReQL time object
-            without timezone information. You can add timezone information with
-            the third party module \"pytz\" or by constructing ReQL compatible
-            timezone values with r.make_timezone(\"[+-]HH:MM\"). Alternatively,
-            use one of ReQL's bultin time constructors, r.now, r.time,
-            or r.iso8601.
-            """
-            )
+            if child_depth > 0 and (
+                value_cls in JSON_SCALAR_TYPES
+                or (value_cls is float and math.isfinite(value))
+            ):
+                continue
+
+            built_value = build_json(value, child_depth)
+
+            if built_value is NOT_JSON:
+                return NOT_JSON
+
+            built_dict[key] = built_value
+
+        return built_dict
+
+    if cls in (list, tuple):
+        items = []
+
+        for value in val:
+            value_cls = type(value)
+
+            if child_depth > 0 and (
+                value_cls in JSON_SCALAR_TYPES
+                or (value_cls is float and math.isfinite(value))
+            ):
+                items.append(value)
+                continue
+
+            built_value = build_json(value, child_depth)
+
+            if built_value is NOT_JSON:
+                return NOT_JSON
+
+            items.append(built_value)
+
+        return [P_TERM.MAKE_ARRAY, items]
+
+    return NOT_JSON
+
+
+def json_expr(val: Any) -> RqlQuery:
+    """
+    Convert a value like `expr` does, but return the documents and arrays made of
+    JSON values only as a single `JsonDatum` instead of a term for every value.
+    """
+
+    if type(val) in (dict, list, tuple):
+        built = build_json(val)
+
+        if built is not NOT_JSON:
+            return JsonDatum(val, built)
+
+    return expr(val)
+
+
+# The hash of a literal value when the literal values are normalized
+_LITERAL_DIGEST = hashlib.blake2b(b"literal", digest_size=16).digest()
+
+# The terms whose arguments are names or variable IDs rather than literal values
+_STRUCTURAL_TERM_TYPES = frozenset((P_TERM.DB, P_TERM.TABLE, P_TERM.VAR))
+
+# The terms whose arguments after the first, the sequence or object they apply to,
+# are field names rather than literal values
+_FIELD_TERM_TYPES = frozenset(
+    (
+        P_TERM.BRACKET,
+        P_TERM.GET_FIELD,
+        P_TERM.HAS_FIELDS,
+        P_TERM.ORDER_BY,
+        P_TERM.PLUCK,
+        P_TERM.WITHOUT,
+    )
+)
+
+
+def _get_cached_digest(term: RqlQuery, normalize_literals: bool) -> Optional[bytes]:
+    """
+    Return the memoized digest of the term, or None if it was not hashed yet or a
+    hashed term was mutated since.
+    """
+
+    memo = _get_memo(term)
+
+    if memo is None:
+        return None
+
+    return memo[3] if normalize_literals else memo[2]
+
+
+def _set_cached_digest(term: RqlQuery, normalize_literals: bool, digest: bytes) -> None:
+    """
+    Memoize the digest of the term, keeping its JSON and the digest of the other
+    mode.
+    """
+
+    memo = _get_memo(term)
+
+    if memo is None:
+        memo = (RqlQuery._fragment_generation, None, None, None)
+
+    # pylint: disable=protected-access
+    if normalize_literals:
+        term._fragment = (memo[0], memo[1], memo[2], digest)
+    else:
+        term._fragment = (memo[0], memo[1], digest, memo[3])
+
+
+def _get_hashed_children(term: RqlQuery, normalize_literals: bool) -> list:
+    """
+    Return the arguments of the term with the mode they are hashed in. The names,
+    the variable IDs, the field names and the optional arguments, except the values
+    of the objects, are never normalized.
+    """
+
+    # pylint: disable=protected-access
+    args = term._args
+    kwargs = term.kwargs
+
+    if not normalize_literals or term.term_type in _STRUCTURAL_TERM_TYPES:
+        return [(arg, False) for arg in args] + [(v, False) for v in kwargs.values()]
+
+    children = [(arg, True) for arg in args]
+
+    if term.term_type == P_TERM.FUNC:
+        # The first argument is the array of the variable IDs
+        children[0] = (args[0], False)
+    elif term.term_type in _FIELD_TERM_TYPES:
+        children[1:] = [(arg, False) for arg in args[1:]]
+
+    normalize_kwargs = term.term_type == P_TERM.MAKE_OBJ
+    children.extend((value, normalize_kwargs) for value in kwargs.values())
+
+    return children
+
+
+def _hash_leaf(term: RqlQuery, normalize_literals: bool) -> bytes:
+    """
+    Return the digest of a term without arguments, hashing its JSON with the keys of
+    the objects sorted.
+    """
+
+    if normalize_literals and (term.term_type is None or isinstance(term, Binary)):
+        return _LITERAL_DIGEST
+
+    built = term.build()
+    built_type = type(built)
+
+    # The scalar datums are the most common leaves, and are hashed by their type
+    # and their value without encoding the JSON
+    if built_type is str:
+        data = b"str:" + built.encode("utf-8")
+    elif built_type in (int, float, bool, type(None)):
+        data = f"{built_type.__name__}:{built!r}".encode("utf-8")
+    else:
+        data = b"json:" + json.dumps(
+            built, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _hash_term(term: RqlQuery, children: list) -> bytes:
+    """
+    Return the digest of a term with arguments, hashing the memoized digests of its
+    arguments and its optional arguments sorted by their name.
+    """
+
+    # pylint: disable=protected-access
+    arg_count = len(term._args)
+    hashed = hashlib.blake2b(
+        f"term:{term.term_type}:{arg_count}:{len(term.kwargs)}:".encode("utf-8"),
+        digest_size=16,
+    )
+
+    for child, child_normalize_literals in children[:arg_count]:
+        hashed.update(_get_cached_digest(child, child_normalize_literals))
+
+    for key, (child, child_normalize_literals) in sorted(
+        zip(term.kwargs, children[arg_count:]), key=lambda item: item[0]
+    ):
+        encoded_key = key.encode("utf-8")
+        hashed.update(b"%d:%s" % (len(encoded_key), encoded_key))
+        hashed.update(_get_cached_digest(child, child_normalize_literals))
+
+    return hashed.digest()
+
+
+def _get_digest(term: RqlQuery, normalize_literals: bool) -> bytes:
+    """
+    Return the digest of the term, hashing the terms not hashed yet from the leaves
+    to the root with an explicit stack.
+    """
+
+    # The pending terms are visited with no children first, and hashed once the
+    # children listed on the visit are hashed
+    pending: list = [(term, normalize_literals, None)]
+
+    while pending:
+        current, current_normalize_literals, children = pending.pop()
+
+        if children is None:
+            if _get_cached_digest(current, current_normalize_literals) is not None:
+                continue
+
+            # pylint: disable=protected-access
+            if not current._args and not current.kwargs:
+                digest = _hash_leaf(current, current_normalize_literals)
+                _set_cached_digest(current, current_normalize_literals, digest)
+                continue
+
+            children = _get_hashed_children(current, current_normalize_literals)
+            pending.append((current, current_normalize_literals, children))
+            pending.extend((child, mode, None) for child, mode in children)
+            continue
+
+        digest = _hash_term(current, children)
+        _set_cached_digest(current, current_normalize_literals, digest)
+
+    return _get_cached_digest(term, normalize_literals)
+
+
+def iter_hashed_terms(
+    term: RqlQuery, normalize_literals: bool
+) -> Iterator[Tuple[RqlQuery, bool]]:
+    """
+    Yield the terms of the query tree with the mode they are hashed in by the
+    fingerprint of the query, which tells the terms hashed as literal values from
+    the names.
+    """
 
-        return ISO8601(val.isoformat())
+    pending = [(term, normalize_literals)]
 
-    return Datum(val)
+    while pending:
+        current, current_normalize_literals = pending.pop()
+        yield current, current_normalize_literals
+        pending.extend(_get_hashed_children(current, current_normalize_literals))
 
 
 # Called on arguments that should be functions
@@ -0,0 +1,502 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The batching module contains the batchers of the asyncio connections, which collect
+the independent queries of many tasks started within a short window, and send them
+to the server as one query.
+
+The point reads of a table are batched into one `get_all` query, whose documents are
+handed back to the tasks by their primary key. The inserted documents of a table are
+buffered and written by one `insert` query, whose write result is split into the
+write result of every document.
+"""
+
+__all__ = ["AsyncioGetBatcher", "AsyncioInsertBuffer"]
+
+import asyncio
+import copy
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Union
+
+from rethinkdb import ql2_pb2
+from rethinkdb.ast import Datum, MakeArray, RqlQuery, expr
+from rethinkdb.encoder import make_hashable
+from rethinkdb.errors import ReqlDriverError, ReqlQueryLogicError
+from rethinkdb.net import split_client_optargs
+
+P_TERM = ql2_pb2.Term.TermType  # pylint: disable=invalid-name
+
+DEFAULT_MAX_BATCH_SIZE: int = 100
+DEFAULT_MAX_DELAY: float = 0.001
+DEFAULT_MAX_INSERT_BATCH_SIZE: int = 1000
+DEFAULT_MAX_INSERT_DELAY: float = 0.01
+DEFAULT_MAX_PENDING: int = 10000
+
+# The write result of an inserted document, before the outcome is known
+WRITE_RESULT: Dict[str, int] = {
+    "deleted": 0,
+    "errors": 0,
+    "inserted": 0,
+    "replaced": 0,
+    "skipped": 0,
+    "unchanged": 0,
+}
+
+# Returned by `literal_value` for the terms which are not literal values
+NOT_LITERAL = object()
+
+
+def literal_value(term: RqlQuery) -> Any:
+    """
+    Return the value of a literal term, or `NOT_LITERAL` if the term is evaluated by
+    the server.
+    """
+
+    if isinstance(term, Datum):
+        return term.data
+
+    if isinstance(term, MakeArray) and not term.kwargs:
+        # pylint: disable=protected-access
+        items = [literal_value(item) for item in term._args]
+
+        if all(item is not NOT_LITERAL for item in items):
+            return items
+
+    return NOT_LITERAL
+
+
+class GetBatch:
+    """
+    The point reads of a table collected during a window, and the futures of the
+    tasks waiting for the documents, by their primary key.
+    """
+
+    __slots__ = ("table", "global_optargs", "keys", "futures", "handle")
+
+    def __init__(self, table: RqlQuery, global_optargs: Dict[str, Any]) -> None:
+        self.table: RqlQuery = table
+        self.global_optargs: Dict[str, Any] = global_optargs
+        self.keys: List[Any] = []
+        self.futures: Dict[Any, List[asyncio.Future]] = {}
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: Any) -> asyncio.Future:
+        """
+        Return the future of the document with the primary key.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        hashable_key = make_hashable(key)
+        futures = self.futures.get(hashable_key)
+
+        if futures is None:
+            self.keys.append(key)
+            futures = self.futures[hashable_key] = []
+
+        futures.append(future)
+        return future
+
+    def resolve(self, documents: List[Any], primary_key: str) -> None:
+        """
+        Hand the documents to the futures of their primary key. The futures of the
+        keys without a document receive `None`, like `get` returns.
+        """
+
+        by_key = {
+            make_hashable(document[primary_key]): document for document in documents
+        }
+
+        for hashable_key, futures in self.futures.items():
+            resolve_futures(futures, by_key.get(hashable_key))
+
+    def fail(self, error: BaseException) -> None:
+        """
+        Raise the error in every task waiting for a document of the batch.
+        """
+
+        for futures in self.futures.values():
+            fail_futures(futures, error)
+
+
+class InsertBatch:
+    """
+    The documents inserted into a table during a window, and the futures of the
+    tasks waiting for their write results, in insertion order.
+    """
+
+    __slots__ = ("table", "documents", "futures", "handle")
+
+    def __init__(self, table: RqlQuery) -> None:
+        self.table: RqlQuery = table
+        self.documents: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, document: Any) -> asyncio.Future:
+        """
+        Return the future of the write result of the document.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self.documents.append(document)
+        self.futures.append(future)
+        return future
+
+    def resolve(
+        self,
+        result: Dict[str, Any],
+        primary_key: str,
+        return_changes: Union[bool, str],
+    ) -> None:
+        """
+        Split the write result of the batch into the write result of every document.
+
+        The generated keys are handed to the documents without primary key in order,
+        and the changes to the documents by their primary key. When the server
+        reports errors and the changes do not tell which documents failed, every
+        task receives the write result of the whole batch.
+        """
+
+        if result.get("errors") and return_changes != "always":
+            for future in self.futures:
+                if not future.done():
+                    future.set_result(copy.deepcopy(result))
+
+            return
+
+        generated_keys = iter(result.get("generated_keys", []))
+        changes: Dict[Hashable, List[Dict[str, Any]]] = {}
+
+        for change in result.get("changes", []):
+            value = change.get("new_val") or change.get("old_val")
+
+            if isinstance(value, dict) and primary_key in value:
+                key = make_hashable(value[primary_key])
+                changes.setdefault(key, []).append(change)
+
+        for document, future in zip(self.documents, self.futures):
+            write_result: Dict[str, Any] = {**WRITE_RESULT, "inserted": 1}
+            key = document.get(primary_key) if isinstance(document, dict) else None
+
+            if key is None:
+                key = next(generated_keys, None)
+                write_result["generated_keys"] = [] if key is None else [key]
+
+            if return_changes:
+                document_changes = changes.get(make_hashable(key)) or []
+                change = document_changes.pop(0) if document_changes else None
+                write_result["changes"] = [] if change is None else [change]
+
+                if change is not None and "error" in change:
+                    write_result.update(
+                        inserted=0, errors=1, first_error=change["error"]
+                    )
+
+            if not future.done():
+                future.set_result(write_result)
+
+    def fail(self, error: BaseException) -> None:
+        """
+        Raise the error in every task waiting for a write result of the batch.
+        """
+
+        fail_futures(self.futures, error)
+
+
+def resolve_futures(futures: List[asyncio.Future], document: Any) -> None:
+    """
+    Hand the document to the futures not done yet. Every task receives its own copy
+    of the document.
+    """
+
+    for index, future in enumerate(futures):
+        if not future.done():
+            future.set_result(document if index == 0 else copy.deepcopy(document))
+
+
+def fail_futures(futures: List[asyncio.Future], error: BaseException) -> None:
+    """
+    Raise the error in the futures not done yet, without logging the errors no task
+    retrieved.
+    """
+
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
+            future.exception()
+
+
+class BaseBatcher:
+    """
+    Base of the batchers, collecting the batches by key until `max_delay` seconds
+    passed since the first query of the batch, or until the batch has
+    `max_batch_size` queries, and running every batch in its own task.
+    """
+
+    def __init__(self, connection: Any, max_batch_size: int, max_delay: float) -> None:
+        if max_batch_size < 1 or max_delay < 0:
+            raise ReqlDriverError(
+                f"Invalid batch window: max_batch_size={max_batch_size}, "
+                f"max_delay={max_delay}"
+            )
+
+        self.connection: Any = connection
+        self.max_batch_size: int = max_batch_size
+        self.max_delay: float = max_delay
+
+        self.__batches: Dict[Hashable, Any] = {}
+        self.__tasks: Set[asyncio.Task] = set()
+
+    def _add(
+        self, batch_key: Hashable, make_batch: Callable[[], Any], item: Any
+    ) -> asyncio.Future:
+        """
+        Add the item to the open batch of the key, opening a new batch if needed,
+        and return the future of its result.
+        """
+
+        batch = self.__batches.get(batch_key)
+
+        if batch is None:
+            batch = self.__batches[batch_key] = make_batch()
+            batch.handle = asyncio.get_running_loop().call_later(
+                self.max_delay, self.__schedule, batch_key
+            )
+
+        future = batch.add(item)
+
+        if len(batch) >= self.max_batch_size:
+            self.__schedule(batch_key)
+
+        return future
+
+    def __schedule(self, batch_key: Hashable) -> None:
+        """
+        Close the batch of the key, and send its query in a new task.
+        """
+
+        batch = self.__batches.pop(batch_key, None)
+
+        if batch is None:
+            return
+
+        if batch.handle is not None:
+            batch.handle.cancel()
+
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def _run_batch(self, batch: Any) -> None:
+        """
+        Run the query of the batch, and hand its result to the waiting tasks.
+        """
+
+        raise NotImplementedError()
+
+    async def flush(self) -> None:
+        """
+        Send the collected queries without waiting for the end of the window, and
+        wait for the batches in flight to complete.
+        """
+
+        for batch_key in list(self.__batches):
+            self.__schedule(batch_key)
+
+        if self.__tasks:
+            await asyncio.gather(*self.__tasks)
+
+
+class AsyncioGetBatcher(BaseBatcher):
+    """
+    DataLoader-style batcher of the point reads of an asyncio connection or pool.
+
+    The `get` queries passed to `load` are collected by table and global optional
+    arguments, and sent as one `get_all` query once `max_delay` seconds passed since
+    the first query of the batch, or once the batch has `max_batch_size` keys. The
+    documents are handed back to the tasks by the `primary_key` of the table. The
+    other queries, and the `get` queries with a key evaluated by the server, are run
+    as usual, like the queries returning raw JSON.
+
+    If the `get_all` query fails with a `ReqlQueryLogicError`, like for a key which
+    is not a valid primary key, the keys of the batch are read one by one, so every
+    task receives only the error of its own key.
+    """
+
+    def __init__(
+        self,
+        connection: Any,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        primary_key: str = "id",
+    ) -> None:
+        super().__init__(connection, max_batch_size, max_delay)
+        self.primary_key: str = primary_key
+
+    async def load(self, query: RqlQuery, **global_optargs: Any) -> Any:
+        """
+        Return the result of the query, batching the point reads with the other
+        point reads of the same table.
+
+        :raises: ReqlError
+        """
+
+        # pylint: disable=protected-access
+        key = NOT_LITERAL
+
+        if (
+            query.term_type == P_TERM.GET
+            and len(query._args) == 2
+            and global_optargs.get("response_format") != "raw"
+        ):
+            key = literal_value(query._args[1])
+
+        if key is NOT_LITERAL:
+            return await query.run(self.connection, **global_optargs)
+
+        table = query._args[0]
+        server_optargs, client_optargs = split_client_optargs(global_optargs)
+        batch_key = (
+            table.fingerprint(),
+            expr(server_optargs).fingerprint(),
+            tuple(sorted(client_optargs.items())),
+        )
+
+        return await self._add(batch_key, lambda: GetBatch(table, global_optargs), key)
+
+    async def _run_batch(self, batch: GetBatch) -> None:
+        query = batch.table.get_all(*batch.keys).coerce_to("array")
+
+        try:
+            documents = await query.run(self.connection, **batch.global_optargs)
+        except ReqlQueryLogicError as exc:
+            if len(batch) == 1:
+                batch.fail(exc)
+            else:
+                await self.__run_separately(batch)
+        except Exception as exc:  # pylint: disable=broad-except
+            batch.fail(exc)
+        else:
+            batch.resolve(documents, self.primary_key)
+
+    async def __run_separately(self, batch: GetBatch) -> None:
+        """
+        Run the point read of every key of the batch on its own, so an invalid key
+        raises its error only in the tasks which read it.
+        """
+
+        results = await asyncio.gather(
+            *(
+                batch.table.get(key).run(self.connection, **batch.global_optargs)
+                for key in batch.keys
+            ),
+            return_exceptions=True,
+        )
+
+        for futures, result in zip(batch.futures.values(), results):
+            if isinstance(result, BaseException):
+                fail_futures(futures, result)
+            else:
+                resolve_futures(futures, result)
+
+
+class AsyncioInsertBuffer(BaseBatcher):
+    """
+    Write coalescing buffer of the inserts of an asyncio connection or pool.
+
+    The documents passed to `insert` are collected by table, and written by one
+    `insert` query once `max_delay` seconds passed since the first document of the
+    batch, or once the batch has `max_batch_size` documents. The `durability` and
+    `return_changes` options are passed to every `insert` query, and the global
+    optional arguments to every run.
+
+    Every task receives the write result of its own document. Once `max_pending`
+    documents are buffered or being written, `insert` waits for the batches in
+    flight to complete before buffering more documents.
+    """
+
+    def __init__(
+        self,
+        connection: Any,
+        max_batch_size: int = DEFAULT_MAX_INSERT_BATCH_SIZE,
+        max_delay: float = DEFAULT_MAX_INSERT_DELAY,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        durability: Optional[str] = None,
+        return_changes: Union[bool, str] = False,
+        primary_key: str = "id",
+        **global_optargs: Any,
+    ) -> None:
+        super().__init__(connection, max_batch_size, max_delay)
+
+        if max_pending < max_batch_size:
+            raise ReqlDriverError(
+                f"Invalid buffer size: max_pending={max_pending} is smaller than "
+                f"max_batch_size={max_batch_size}"
+            )
+
+        self.max_pending: int = max_pending
+        self.durability: Optional[str] = durability
+        self.return_changes: Union[bool, str] = return_changes
+        self.primary_key: str = primary_key
+        self.global_optargs: Dict[str, Any] = global_optargs
+
+        self.__pending: Optional[asyncio.Semaphore] = None
+
+    async def insert(self, table: RqlQuery, document: Any) -> Dict[str, Any]:
+        """
+        Buffer the document, and return its write result once its batch is written.
+
+        :raises: ReqlError
+        """
+
+        if self.__pending is None:
+            self.__pending = asyncio.Semaphore(self.max_pending)
+
+        await self.__pending.acquire()
+
+        try:
+            future = self._add(
+                table.fingerprint(), lambda: InsertBatch(table), document
+            )
+        except BaseException:
+            self.__pending.release()
+            raise
+
+        # The document stays pending until written, even if the task is cancelled
+        future.add_done_callback(lambda _: self.__pending.release())
+        return await asyncio.shield(future)
+
+    async def _run_batch(self, batch: InsertBatch) -> None:
+        options: Dict[str, Any] = {}
+
+        if self.durability is not None:
+            options["durability"] = self.durability
+
+        if self.return_changes:
+            options["return_changes"] = self.return_changes
+
+        query = batch.table.insert(batch.documents, **options)
+
+        try:
+            result = await query.run(self.connection, **self.global_optargs)
+        except Exception as exc:  # pylint: disable=broad-except
+            batch.fail(exc)
+        else:
+            batch.resolve(result, self.primary_key, self.return_changes)
@@ -0,0 +1,703 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The cache module contains the client-side cache of query results, which answers the
+read queries repeated within a short time without a round trip to the server.
+
+The cache is opt-in: it is passed to the connection, or to the pool, as the
+`result_cache` argument, or to `RqlQuery.run` as the client-only `result_cache` run
+option. The results are keyed by the fingerprint of the query and of its global
+optional arguments. The queries writing data or evaluating to a different result on
+every run are never cached.
+
+The module contains the table caches too, which load the documents of a rarely
+changing table once and keep them fresh by following the changefeed of the table,
+so the documents are read locally instead of being queried again and again.
+
+The single flights coalesce the identical read queries running at the same time, so
+a burst of queries for the same hot key shares one round trip to the server.
+"""
+
+__all__ = [
+    "AsyncioSingleFlight",
+    "AsyncioTableCache",
+    "Flight",
+    "MISSING",
+    "ResultCache",
+    "SingleFlight",
+    "TableCache",
+    "UNCACHEABLE_TERM_TYPES",
+    "is_cacheable",
+]
+
+import asyncio
+from collections import OrderedDict
+import contextlib
+import copy
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rethinkdb import ql2_pb2
+from rethinkdb.ast import RqlQuery, expr
+from rethinkdb.encoder import make_hashable
+from rethinkdb.errors import ReqlCursorEmpty, ReqlDriverError, ReqlTimeoutError
+from rethinkdb.prepared import BoundQuery
+
+P_TERM = ql2_pb2.Term.TermType  # pylint: disable=invalid-name
+
+DEFAULT_MAX_SIZE: int = 1024
+DEFAULT_TTL: float = 60
+DEFAULT_POLL_INTERVAL: float = 0.1
+
+# The terms writing data, changing the cluster, or evaluating to a different result
+# on every run. The queries containing any of them bypass the cache.
+UNCACHEABLE_TERM_TYPES = frozenset(
+    (
+        P_TERM.INSERT,
+        P_TERM.UPDATE,
+        P_TERM.REPLACE,
+        P_TERM.DELETE,
+        P_TERM.FOR_EACH,
+        P_TERM.SYNC,
+        P_TERM.DB_CREATE,
+        P_TERM.DB_DROP,
+        P_TERM.TABLE_CREATE,
+        P_TERM.TABLE_DROP,
+        P_TERM.INDEX_CREATE,
+        P_TERM.INDEX_DROP,
+        P_TERM.INDEX_RENAME,
+        P_TERM.INDEX_WAIT,
+        P_TERM.RECONFIGURE,
+        P_TERM.REBALANCE,
+        P_TERM.WAIT,
+        P_TERM.GRANT,
+        P_TERM.SET_WRITE_HOOK,
+        P_TERM.RANDOM,
+        P_TERM.SAMPLE,
+        P_TERM.NOW,
+        P_TERM.UUID,
+        P_TERM.HTTP,
+        P_TERM.JAVASCRIPT,
+        P_TERM.CHANGES,
+    )
+)
+
+# Returned by `ResultCache.get` by default when the key is not cached, as `None` is
+# a valid result
+MISSING = object()
+
+
+def is_cacheable(term: RqlQuery) -> bool:
+    """
+    Return whether the result of the query can be cached, which is the case if the
+    query contains no term writing data or evaluating to a different result on every
+    run.
+    """
+
+    pending = [term]
+
+    while pending:
+        current = pending.pop()
+
+        if isinstance(current, BoundQuery):
+            current = current.query
+
+        if current.term_type in UNCACHEABLE_TERM_TYPES:
+            return False
+
+        # pylint: disable=protected-access
+        pending.extend(current._args)
+        pending.extend(current.kwargs.values())
+
+    return True
+
+
+class ResultCache:
+    """
+    Thread-safe cache of query results, evicting the results once their time to live
+    expired, and the least recently used results once the cache is full.
+
+    The results are stored as they are returned by the connection, so the connection
+    copies the mutable results before storing and returning them. The sequences
+    completed by their first response, like the result of `get_all`, are stored as
+    their rows, and every caller receives a new cursor over them. The sequences sent
+    in several batches are not cached, run the query with `coerce_to("array")` to
+    cache them.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: Optional[float] = DEFAULT_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if max_size < 1:
+            raise ReqlDriverError(f"Invalid cache size: max_size={max_size}")
+
+        if ttl is not None and ttl <= 0:
+            raise ReqlDriverError(f"Invalid cache time to live: ttl={ttl}")
+
+        self.max_size: int = max_size
+        self.ttl: Optional[float] = ttl
+        self.clock: Callable[[], float] = clock
+
+        self.__lock: threading.Lock = threading.Lock()
+        self.__entries: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self.__hits: int = 0
+        self.__misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @property
+    def hits(self) -> int:
+        """
+        Return the number of lookups which found a cached result.
+        """
+
+        return self.__hits
+
+    @property
+    def misses(self) -> int:
+        """
+        Return the number of lookups which found no cached result.
+        """
+
+        return self.__misses
+
+    @staticmethod
+    def make_key(
+        term: RqlQuery,
+        global_optargs: Optional[Dict[str, Any]] = None,
+        response_format: str = "native",
+    ) -> Optional[str]:
+        """
+        Return the key of the query result, or `None` if the result must not be
+        cached. The results of the queries run with `noreply` or `profile`, and
+        the results returned in the "raw" format are not cached either.
+        """
+
+        global_optargs = global_optargs or {}
+
+        if (
+            global_optargs.get("noreply")
+            or global_optargs.get("profile")
+            or response_format == "raw"
+            or not is_cacheable(term)
+        ):
+            return None
+
+        return ":".join(
+            (term.fingerprint(), expr(global_optargs).fingerprint(), response_format)
+        )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Return the cached result of the key, or `default` if the key is not cached
+        or its result expired.
+        """
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is not None and entry[0] is not None and entry[0] <= self.clock():
+                del self.__entries[key]
+                entry = None
+
+            if entry is None:
+                self.__misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Cache the result of the key, evicting the least recently used result if the
+        cache is full.
+        """
+
+        expiry = None if self.ttl is None else self.clock() + self.ttl
+
+        with self.__lock:
+            self.__entries[key] = (expiry, value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop the cached result of the key.
+        """
+
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop every cached result, keeping the hit and miss counters.
+        """
+
+        with self.__lock:
+            self.__entries.clear()
+
+
+class Flight:
+    """
+    A query in flight, whose result is shared with the identical queries started
+    while it runs.
+    """
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event: threading.Event = threading.Event()
+        self.result: Any = MISSING
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        """
+        Wait for the query to land, and return its shared result, which is `MISSING`
+        if the result cannot be shared.
+
+        :raises: ReqlError
+        """
+
+        self.event.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+class BaseSingleFlight:
+    """
+    Common bookkeeping of the single flights, which keep the queries in flight by
+    the key of their result, as returned by `ResultCache.make_key`.
+
+    The first query of a key is the leader, which runs the query while the others
+    wait for its result. The connections pass a copy of the result to the followers,
+    or no result if it cannot be shared, like a cursor, in which case the followers
+    run the query themselves. The errors of the leader are raised by the followers
+    too. A single flight can be shared by many connections, like the connections of
+    a pool.
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Any] = {}
+        self._coalesced: int = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    @property
+    def coalesced(self) -> int:
+        """
+        Return the number of queries which waited for the result of a leader.
+        """
+
+        return self._coalesced
+
+
+class SingleFlight(BaseSingleFlight):
+    """
+    Thread-safe single flight of the synchronous connections.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__lock: threading.Lock = threading.Lock()
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """
+        Return the flight of the key, and whether the caller is its leader.
+        """
+
+        with self.__lock:
+            flight = self._flights.get(key)
+
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                return flight, True
+
+            self._coalesced += 1
+            return flight, False
+
+    def land(
+        self,
+        key: str,
+        flight: Flight,
+        result: Any = MISSING,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Share the result or the error of the leader with the followers. The next
+        query of the key starts a new flight.
+        """
+
+        with self.__lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight.result = result
+        flight.error = error
+        flight.event.set()
+
+
+class AsyncioSingleFlight(BaseSingleFlight):
+    """
+    Single flight of the asyncio connections, which must be used from one event loop.
+    """
+
+    def join(self, key: str) -> Tuple[asyncio.Future, bool]:
+        """
+        Return the future of the key, and whether the caller is its leader.
+        """
+
+        flight = self._flights.get(key)
+
+        if flight is None:
+            flight = self._flights[key] = asyncio.get_running_loop().create_future()
+            return flight, True
+
+        self._coalesced += 1
+        return flight, False
+
+    def land(
+        self,
+        key: str,
+        flight: asyncio.Future,
+        result: Any = MISSING,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Share the result or the error of the leader with the followers. The next
+        query of the key starts a new flight.
+        """
+
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        if flight.done():
+            return
+
+        if error is None:
+            flight.set_result(result)
+        else:
+            flight.set_exception(error)
+            # The followers raise the error, the leader raises it by itself
+            flight.exception()
+
+
+class BaseTableCache:
+    """
+    Common bookkeeping of the table caches, which keep the documents of a selection
+    by their primary key. The selection is a table or any selection supporting
+    `changes(include_initial=True)`, like a `get_all` slice of a table.
+
+    The documents are read only once the initial documents are loaded, and while the
+    changefeed is followed, so the documents read are never stale. The documents are
+    copied when they are returned, as the caller may mutate them.
+    """
+
+    def __init__(
+        self, selection: RqlQuery, connection: Any, primary_key: str = "id"
+    ) -> None:
+        self.selection: RqlQuery = selection
+        self.connection: Any = connection
+        self.primary_key: str = primary_key
+        self.error: Optional[Exception] = None
+
+        self._lock: threading.Lock = threading.Lock()
+        self._documents: Dict[Any, Any] = {}
+        self._ready: bool = False
+
+    def __len__(self) -> int:
+        self._check_fresh()
+        return len(self._documents)
+
+    def __contains__(self, key: Any) -> bool:
+        self._check_fresh()
+        return make_hashable(key) in self._documents
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        Return whether the documents are loaded and kept fresh by the changefeed.
+        """
+
+        return self._ready and self.error is None
+
+    def _make_query(self) -> RqlQuery:
+        """
+        Return the changefeed of the selection, starting with its documents.
+        """
+
+        return self.selection.changes(include_initial=True, include_states=True)
+
+    def _check_fresh(self) -> None:
+        """
+        Ensure the documents are loaded and kept fresh by the changefeed.
+
+        :raises: ReqlDriverError
+        """
+
+        if self.error is not None:
+            raise ReqlDriverError(
+                f"The changefeed of the table cache failed: {self.error}"
+            ) from self.error
+
+        if not self._ready:
+            raise ReqlDriverError("Table cache is not loaded.")
+
+    def _apply(self, change: Dict[str, Any]) -> None:
+        """
+        Apply a change of the changefeed to the documents.
+        """
+
+        if "state" in change:
+            if change["state"] == "ready":
+                self._ready = True
+
+            return
+
+        old_val = change.get("old_val")
+        new_val = change.get("new_val")
+
+        with self._lock:
+            if old_val is not None:
+                self._documents.pop(make_hashable(old_val[self.primary_key]), None)
+
+            if new_val is not None:
+                self._documents[make_hashable(new_val[self.primary_key])] = new_val
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """
+        Return a copy of the document with the primary key, or `default` if the
+        selection has no such document.
+
+        :raises: ReqlDriverError
+        """
+
+        self._check_fresh()
+        document = self._documents.get(make_hashable(key))
+
+        if document is None:
+            return default
+
+        return copy.deepcopy(document)
+
+    def values(self) -> List[Any]:
+        """
+        Return a copy of every document of the selection.
+
+        :raises: ReqlDriverError
+        """
+
+        self._check_fresh()
+
+        with self._lock:
+            documents = list(self._documents.values())
+
+        return copy.deepcopy(documents)
+
+
+class TableCache(BaseTableCache):
+    """
+    Table cache of the synchronous connection. Once the documents are loaded by
+    `start`, the changefeed is followed by a background thread. The thread checks
+    every `poll_interval` seconds whether the cache was closed.
+    """
+
+    def __init__(
+        self,
+        selection: RqlQuery,
+        connection: Any,
+        primary_key: str = "id",
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        super().__init__(selection, connection, primary_key)
+
+        self.poll_interval: float = poll_interval
+
+        self.__cursor: Any = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__closing: threading.Event = threading.Event()
+
+    def __enter__(self) -> "TableCache":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self, timeout: Optional[float] = None) -> "TableCache":
+        """
+        Load the documents of the selection, and follow its changefeed in the
+        background. Wait at most `timeout` seconds for the documents to be loaded.
+
+        :raises: ReqlTimeoutError | ReqlDriverError | ReqlError
+        """
+
+        cursor = self._make_query().run(self.connection)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        try:
+            while not self._ready:
+                wait = True if deadline is None else deadline - time.monotonic()
+
+                if wait is not True and wait <= 0:
+                    raise ReqlTimeoutError()
+
+                self._apply(cursor.next(wait=wait))
+        except ReqlCursorEmpty as exc:
+            raise ReqlDriverError("The changefeed ended before it was ready.") from exc
+        except BaseException:
+            cursor.close()
+            raise
+
+        self.__cursor = cursor
+        self.__closing.clear()
+        self.__thread = threading.Thread(target=self.__follow, daemon=True)
+        self.__thread.start()
+        return self
+
+    def __follow(self) -> None:
+        """
+        Apply the changes of the changefeed until the cache is closed.
+        """
+
+        cursor = self.__cursor
+
+        try:
+            while not self.__closing.is_set():
+                try:
+                    self._apply(cursor.next(wait=self.poll_interval))
+                except ReqlTimeoutError:
+                    continue
+        except ReqlCursorEmpty:
+            self.error = ReqlDriverError("The changefeed ended.")
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            if cursor.connection.is_open():
+                cursor.close()
+
+    def close(self) -> None:
+        """
+        Stop following the changefeed and drop the documents.
+        """
+
+        self.__closing.set()
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+        self.__cursor = None
+        self._ready = False
+
+        with self._lock:
+            self._documents.clear()
+
+
+class AsyncioTableCache(BaseTableCache):
+    """
+    Table cache of the asyncio connection. Once the documents are loaded by `start`,
+    the changefeed is followed by a background task.
+    """
+
+    def __init__(
+        self, selection: RqlQuery, connection: Any, primary_key: str = "id"
+    ) -> None:
+        super().__init__(selection, connection, primary_key)
+
+        self.__cursor: Any = None
+        self.__task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "AsyncioTableCache":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def start(self, timeout: Optional[float] = None) -> "AsyncioTableCache":
+        """
+        Load the documents of the selection, and follow its changefeed in the
+        background. Wait at most `timeout` seconds for the documents to be loaded.
+
+        :raises: ReqlTimeoutError | ReqlDriverError | ReqlError
+        """
+
+        cursor = await self._make_query().run(self.connection)
+
+        async def load() -> None:
+            while not self._ready:
+                self._apply(await cursor.next())
+
+        try:
+            await asyncio.wait_for(load(), timeout)
+        except asyncio.TimeoutError as exc:
+            await cursor.close()
+            raise ReqlTimeoutError() from exc
+        except ReqlCursorEmpty as exc:
+            raise ReqlDriverError("The changefeed ended before it was ready.") from exc
+        except BaseException:
+            await cursor.close()
+            raise
+
+        self.__cursor = cursor
+        self.__task = asyncio.get_running_loop().create_task(self.__follow())
+        return self
+
+    async def __follow(self) -> None:
+        """
+        Apply the changes of the changefeed until the cache is closed.
+        """
+
+        try:
+            async for change in self.__cursor:
+                self._apply(change)
+
+            self.error = ReqlDriverError("The changefeed ended.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+
+    async def close(self) -> None:
+        """
+        Stop following the changefeed and drop the documents.
+        """
+
+        task, self.__task = self.__task, None
+        cursor, self.__cursor = self.__cursor, None
+
+        if task is not None:
+            task.cancel()
+
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+        if cursor is not None and cursor.connection.is_open():
+            await cursor.close()
+
+        self._ready = False
+
+        with self._lock:
+            self._documents.clear()
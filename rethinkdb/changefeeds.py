@@ -0,0 +1,1201 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The changefeeds module contains the changefeed hubs, which share one server-side
+changefeed among the subscribers of a process following the same query.
+
+Every subscriber receives the changes in its own bounded queue. The server-side
+changefeed is started with the first subscriber of the query, and stopped once the
+last subscriber is closed.
+
+It also contains the resumable changefeeds, which follow the changes of a selection
+across broken connections and failed changefeeds. They reconnect with exponential
+backoff, and reconcile the documents of the restarted changefeed with the last known
+documents, so the consumer only receives the differences instead of a full reload.
+"""
+
+__all__ = [
+    "AsyncioChangefeedHub",
+    "AsyncioResumableFeed",
+    "AsyncioSubscription",
+    "ChangefeedHub",
+    "OVERFLOW_POLICIES",
+    "ResumableFeed",
+    "Subscription",
+]
+
+import asyncio
+from collections import deque
+import contextlib
+import copy
+import random
+import threading
+import time
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from rethinkdb.ast import RqlQuery, expr
+from rethinkdb.cache import DEFAULT_POLL_INTERVAL
+from rethinkdb.encoder import make_hashable
+from rethinkdb.errors import (
+    ReqlAuthError,
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlError,
+    ReqlOperationError,
+    ReqlTimeoutError,
+)
+from rethinkdb.net import split_client_optargs, wait_to_timeout
+
+DEFAULT_MAX_QUEUED: int = 1000
+DEFAULT_MIN_BACKOFF: float = 0.1
+DEFAULT_MAX_BACKOFF: float = 10.0
+
+# What happens to a change broadcast to a subscriber whose queue is full. With
+# "block", the changefeed waits until the subscriber consumed a change, which holds
+# back every subscriber of the changefeed. With "drop_oldest" and "drop_newest", the
+# oldest queued change or the new change is dropped and counted.
+OVERFLOW_POLICIES: Tuple[str, ...] = ("block", "drop_oldest", "drop_newest")
+
+
+class BaseSubscription:
+    """
+    Common bookkeeping of the subscriptions, which queue the changes broadcast by
+    a shared changefeed for one subscriber.
+
+    The subscribers share the changes, which they must not mutate, unless they
+    subscribed with `copy_changes` to receive their own copy of every change.
+    """
+
+    def __init__(
+        self,
+        hub: Any,
+        key: str,
+        max_queued: int,
+        overflow: str,
+        copy_changes: bool = False,
+    ) -> None:
+        if max_queued < 1 or overflow not in OVERFLOW_POLICIES:
+            raise ReqlDriverError(
+                f"Invalid subscription queue: max_queued={max_queued}, "
+                f"overflow={overflow!r}"
+            )
+
+        self.hub: Any = hub
+        self.key: str = key
+        self.max_queued: int = max_queued
+        self.overflow: str = overflow
+        self.copy_changes: bool = copy_changes
+        self.error: Optional[Exception] = None
+
+        self._changes: Deque[Any] = deque()
+        self._closed: bool = False
+        self._dropped: int = 0
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Return the number of changes dropped because the queue was full.
+        """
+
+        return self._dropped
+
+    @property
+    def is_closed(self) -> bool:
+        """
+        Return whether the subscription is closed.
+        """
+
+        return self._closed
+
+    def _queue(self, change: Any) -> bool:
+        """
+        Queue the change unless the queue is full, dropping a change as the overflow
+        policy says. Return whether the change was handled, as opposed to waiting for
+        room in the queue.
+        """
+
+        if len(self._changes) < self.max_queued:
+            self._changes.append(change)
+        elif self.overflow == "drop_oldest":
+            self._changes.popleft()
+            self._changes.append(change)
+            self._dropped += 1
+        elif self.overflow == "drop_newest":
+            self._dropped += 1
+        else:
+            return False
+
+        return True
+
+    def _pop(self) -> Any:
+        """
+        Return the next queued change, or raise the error of the changefeed once the
+        queued changes are consumed.
+
+        :raises: ReqlCursorEmpty | ReqlError
+        """
+
+        if self._changes:
+            return self._changes.popleft()
+
+        if self.error is not None:
+            raise self.error
+
+        if self._closed:
+            raise ReqlCursorEmpty()
+
+        return None
+
+
+class Subscription(BaseSubscription):
+    """
+    Subscription of the synchronous changefeed hub, iterated like a cursor.
+    """
+
+    def __init__(
+        self,
+        hub: Any,
+        key: str,
+        max_queued: int,
+        overflow: str,
+        copy_changes: bool = False,
+    ) -> None:
+        super().__init__(hub, key, max_queued, overflow, copy_changes)
+
+        self.__condition: threading.Condition = threading.Condition()
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __iter__(self) -> "Subscription":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopIteration from exc
+
+    def _deliver(self, change: Any, closing: threading.Event) -> None:
+        """
+        Queue a change of the changefeed. With the "block" policy, wait until the
+        queue has room, the subscription is closed or the changefeed is closing.
+        """
+
+        with self.__condition:
+            while not (self._closed or closing.is_set() or self._queue(change)):
+                self.__condition.wait(DEFAULT_POLL_INTERVAL)
+
+            self.__condition.notify_all()
+
+    def _fail(self, error: Exception) -> None:
+        """
+        Raise the error of the changefeed once the queued changes are consumed.
+        """
+
+        with self.__condition:
+            self.error = error
+            self.__condition.notify_all()
+
+    def next(self, wait: Any = True) -> Any:
+        """
+        Return the next change. If `wait` is `False` or a number, a `ReqlTimeoutError`
+        is raised when no change arrived in time.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.__condition:
+            while True:
+                change = self._pop()
+
+                if change is not None:
+                    self.__condition.notify_all()
+                    return change
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    raise ReqlTimeoutError()
+
+                self.__condition.wait(remaining)
+
+    def close(self) -> None:
+        """
+        Stop receiving changes, and stop the changefeed if no other subscriber
+        follows it.
+        """
+
+        with self.__condition:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._changes.clear()
+            self.__condition.notify_all()
+
+        self.hub._release(self)  # pylint: disable=protected-access
+
+
+class AsyncioSubscription(BaseSubscription):
+    """
+    Subscription of the asyncio changefeed hub, supporting `async for`.
+    """
+
+    def __init__(
+        self,
+        hub: Any,
+        key: str,
+        max_queued: int,
+        overflow: str,
+        copy_changes: bool = False,
+    ) -> None:
+        super().__init__(hub, key, max_queued, overflow, copy_changes)
+
+        self.__readable: asyncio.Event = asyncio.Event()
+        self.__writable: asyncio.Event = asyncio.Event()
+
+    async def __aenter__(self) -> "AsyncioSubscription":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def __aiter__(self) -> "AsyncioSubscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopAsyncIteration from exc
+
+    async def _deliver(self, change: Any) -> None:
+        """
+        Queue a change of the changefeed. With the "block" policy, wait until the
+        queue has room or the subscription is closed.
+        """
+
+        while not (self._closed or self._queue(change)):
+            self.__writable.clear()
+            await self.__writable.wait()
+
+        self.__readable.set()
+
+    def _fail(self, error: Exception) -> None:
+        """
+        Raise the error of the changefeed once the queued changes are consumed.
+        """
+
+        self.error = error
+        self.__readable.set()
+
+    async def next(self, wait: Any = True) -> Any:
+        """
+        Return the next change. If `wait` is `False` or a number, a `ReqlTimeoutError`
+        is raised when no change arrived in time.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+
+        while True:
+            change = self._pop()
+
+            if change is not None:
+                self.__writable.set()
+                return change
+
+            self.__readable.clear()
+
+            try:
+                await asyncio.wait_for(self.__readable.wait(), timeout)
+            except asyncio.TimeoutError as exc:
+                raise ReqlTimeoutError() from exc
+
+    async def close(self) -> None:
+        """
+        Stop receiving changes, and stop the changefeed if no other subscriber
+        follows it.
+        """
+
+        if self._closed:
+            return
+
+        self._closed = True
+        self._changes.clear()
+        self.__readable.set()
+        self.__writable.set()
+
+        await self.hub._release(self)  # pylint: disable=protected-access
+
+
+class BaseChangefeedHub:
+    """
+    Common bookkeeping of the changefeed hubs, which key the changefeeds by the
+    fingerprint of their query, the global optional arguments sent to the server and
+    the response format.
+
+    A subscriber joining a running changefeed receives the changes from then on, so
+    the initial values of the queries run with `include_initial` are received by
+    the first subscribers only.
+    """
+
+    def __init__(self, connection: Any) -> None:
+        self.connection: Any = connection
+
+    @staticmethod
+    def make_key(query: RqlQuery, global_optargs: Dict[str, Any]) -> str:
+        """
+        Return the key of the changefeed of the query run with the global optional
+        arguments.
+        """
+
+        server_optargs, client_optargs = split_client_optargs(global_optargs)
+        response_format = client_optargs.get("response_format", "native")
+
+        return ":".join(
+            (query.fingerprint(), expr(server_optargs).fingerprint(), response_format)
+        )
+
+
+def copy_change(subscriber: BaseSubscription, change: Any) -> Any:
+    """
+    Return the change to deliver to the subscriber: a copy if it subscribed with
+    `copy_changes`, otherwise the change shared with the other subscribers.
+    """
+
+    return copy.deepcopy(change) if subscriber.copy_changes else change
+
+
+class SharedFeed:
+    """
+    A changefeed of the synchronous hub and its subscribers, followed by a
+    background thread.
+    """
+
+    def __init__(self, key: str, cursor: Any) -> None:
+        self.key: str = key
+        self.cursor: Any = cursor
+        self.subscribers: Tuple[Subscription, ...] = ()
+        self.error: Optional[Exception] = None
+        self.closing: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(
+            target=self.__follow, daemon=True
+        )
+
+    def __follow(self) -> None:
+        """
+        Broadcast the changes to the subscribers until the changefeed is closed.
+        """
+
+        cursor = self.cursor
+
+        try:
+            while not self.closing.is_set():
+                try:
+                    change = cursor.next(wait=DEFAULT_POLL_INTERVAL)
+                except ReqlTimeoutError:
+                    continue
+
+                for subscriber in self.subscribers:
+                    subscriber._deliver(copy_change(subscriber, change), self.closing)
+        except ReqlCursorEmpty:
+            self.error = ReqlDriverError("The changefeed ended.")
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            if cursor.connection.is_open():
+                cursor.close()
+
+        if self.error is not None:
+            for subscriber in self.subscribers:
+                subscriber._fail(self.error)
+
+    def stop(self) -> None:
+        """
+        Stop following the changefeed.
+        """
+
+        self.closing.set()
+
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class ChangefeedHub(BaseChangefeedHub):
+    """
+    Changefeed hub of the synchronous connection. The changefeeds are followed by
+    background threads, checking every `poll_interval` seconds whether they were
+    closed, which broadcast the changes to the subscribers.
+    """
+
+    def __init__(self, connection: Any) -> None:
+        super().__init__(connection)
+
+        self.__lock: threading.Lock = threading.Lock()
+        self.__feeds: Dict[str, SharedFeed] = {}
+
+    def __len__(self) -> int:
+        return len(self.__feeds)
+
+    def subscribe(
+        self,
+        query: RqlQuery,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        overflow: str = "block",
+        copy_changes: bool = False,
+        **global_optargs: Any,
+    ) -> Subscription:
+        """
+        Return a new subscription to the changefeed of the query, starting the
+        changefeed unless another subscriber follows it already. The changes are
+        shared with the other subscribers, unless `copy_changes` is set to receive a
+        copy which the subscriber may mutate.
+
+        :raises: ReqlDriverError | ReqlError
+        """
+
+        key = self.make_key(query, global_optargs)
+        subscription = Subscription(self, key, max_queued, overflow, copy_changes)
+
+        with self.__lock:
+            feed = self.__feeds.get(key)
+
+            if feed is None or feed.error is not None:
+                cursor = query.run(self.connection, **global_optargs)
+                feed = self.__feeds[key] = SharedFeed(key, cursor)
+                feed.subscribers = (subscription,)
+                feed.thread.start()
+            else:
+                feed.subscribers += (subscription,)
+
+        return subscription
+
+    def _release(self, subscription: Subscription) -> None:
+        """
+        Remove the subscriber from its changefeed, and stop the changefeed if it was
+        the last subscriber.
+        """
+
+        with self.__lock:
+            feed = self.__feeds.get(subscription.key)
+
+            if feed is None or subscription not in feed.subscribers:
+                return
+
+            feed.subscribers = tuple(
+                subscriber
+                for subscriber in feed.subscribers
+                if subscriber is not subscription
+            )
+
+            if feed.subscribers:
+                return
+
+            del self.__feeds[subscription.key]
+
+        feed.stop()
+
+    def close(self) -> None:
+        """
+        Close every subscription and stop every changefeed.
+        """
+
+        with self.__lock:
+            subscriptions = [
+                subscriber
+                for feed in self.__feeds.values()
+                for subscriber in feed.subscribers
+            ]
+
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class AsyncioSharedFeed:
+    """
+    A changefeed of the asyncio hub and its subscribers, followed by a background
+    task.
+    """
+
+    def __init__(self, key: str, cursor: Any) -> None:
+        self.key: str = key
+        self.cursor: Any = cursor
+        self.subscribers: Tuple[AsyncioSubscription, ...] = ()
+        self.error: Optional[Exception] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Follow the changefeed in a background task.
+        """
+
+        self.task = asyncio.get_running_loop().create_task(self.__follow())
+
+    async def __follow(self) -> None:
+        """
+        Broadcast the changes to the subscribers until the changefeed is closed.
+        """
+
+        try:
+            async for change in self.cursor:
+                for subscriber in self.subscribers:
+                    await subscriber._deliver(copy_change(subscriber, change))
+
+            self.error = ReqlDriverError("The changefeed ended.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+
+        if self.cursor.connection.is_open():
+            await self.cursor.close()
+
+        for subscriber in self.subscribers:
+            subscriber._fail(self.error)
+
+    async def stop(self) -> None:
+        """
+        Stop following the changefeed.
+        """
+
+        task, self.task = self.task, None
+
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+        if self.cursor.connection.is_open():
+            await self.cursor.close()
+
+
+class AsyncioChangefeedHub(BaseChangefeedHub):
+    """
+    Changefeed hub of the asyncio connection. The changefeeds are followed by
+    background tasks, which broadcast the changes to the subscribers.
+    """
+
+    def __init__(self, connection: Any) -> None:
+        super().__init__(connection)
+
+        self.__lock: Optional[asyncio.Lock] = None
+        self.__feeds: Dict[str, AsyncioSharedFeed] = {}
+
+    def __len__(self) -> int:
+        return len(self.__feeds)
+
+    async def subscribe(
+        self,
+        query: RqlQuery,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        overflow: str = "block",
+        copy_changes: bool = False,
+        **global_optargs: Any,
+    ) -> AsyncioSubscription:
+        """
+        Return a new subscription to the changefeed of the query, starting the
+        changefeed unless another subscriber follows it already. The changes are
+        shared with the other subscribers, unless `copy_changes` is set to receive a
+        copy which the subscriber may mutate.
+
+        :raises: ReqlDriverError | ReqlError
+        """
+
+        key = self.make_key(query, global_optargs)
+        subscription = AsyncioSubscription(
+            self, key, max_queued, overflow, copy_changes
+        )
+
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+
+        # Hold the lock while the changefeed starts, so it is started only once
+        async with self.__lock:
+            feed = self.__feeds.get(key)
+
+            if feed is None or feed.error is not None:
+                cursor = await query.run(self.connection, **global_optargs)
+                feed = self.__feeds[key] = AsyncioSharedFeed(key, cursor)
+                feed.subscribers = (subscription,)
+                feed.start()
+            else:
+                feed.subscribers += (subscription,)
+
+        return subscription
+
+    async def _release(self, subscription: AsyncioSubscription) -> None:
+        """
+        Remove the subscriber from its changefeed, and stop the changefeed if it was
+        the last subscriber.
+        """
+
+        feed = self.__feeds.get(subscription.key)
+
+        if feed is None or subscription not in feed.subscribers:
+            return
+
+        feed.subscribers = tuple(
+            subscriber
+            for subscriber in feed.subscribers
+            if subscriber is not subscription
+        )
+
+        if not feed.subscribers:
+            del self.__feeds[subscription.key]
+            await feed.stop()
+
+    async def close(self) -> None:
+        """
+        Close every subscription and stop every changefeed.
+        """
+
+        subscriptions = [
+            subscriber
+            for feed in self.__feeds.values()
+            for subscriber in feed.subscribers
+        ]
+
+        for subscription in subscriptions:
+            await subscription.close()
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Return whether the changefeed may be resumed after the error: the connection
+    failed, or the server could not serve the changefeed for now, like while a table
+    is unavailable.
+    """
+
+    return isinstance(error, (ReqlDriverError, ReqlOperationError)) and not isinstance(
+        error, ReqlAuthError
+    )
+
+
+class BaseResumableFeed:
+    """
+    Common bookkeeping of the resumable changefeeds, which keep the last known
+    documents of the selection by their primary key to reconcile them with the
+    initial documents of a restarted changefeed. The selection is a table or any
+    selection supporting `changes(include_initial=True)`, like a `get_all` slice of
+    a table.
+
+    Every change has an `old_val` and a `new_val`, which is `None` for a document
+    inserted or deleted. The first changes are the initial documents of the
+    selection. Once the changefeed is restarted, a change is received for every
+    document inserted, updated or deleted while the changefeed was interrupted,
+    and none for the unchanged documents.
+
+    With `squash` seconds, the changes of a document received within the window
+    opened by the first queued change are coalesced into one change, and the changes
+    cancelling out within the window, like an insert followed by a delete, are not
+    received at all.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        selection: RqlQuery,
+        connection: Any,
+        primary_key: str = "id",
+        squash: float = 0,
+        min_backoff: float = DEFAULT_MIN_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        max_retries: Optional[int] = None,
+        **global_optargs: Any,
+    ) -> None:
+        if (
+            squash < 0
+            or not 0 < min_backoff <= max_backoff
+            or (max_retries is not None and max_retries < 0)
+        ):
+            raise ReqlDriverError("Invalid resumable changefeed configuration.")
+
+        self.selection: RqlQuery = selection
+        self.connection: Any = connection
+        self.primary_key: str = primary_key
+        self.squash: float = squash
+        self.min_backoff: float = min_backoff
+        self.max_backoff: float = max_backoff
+        self.max_retries: Optional[int] = max_retries
+        self.global_optargs: Dict[str, Any] = global_optargs
+        self.error: Optional[Exception] = None
+
+        self._cursor: Any = None
+        self._closed: bool = False
+        self._ready: bool = False
+        self._restarts: int = 0
+        self._attempts: int = 0
+        self._retry_at: Optional[float] = None
+        self._documents: Dict[Any, Any] = {}
+        self._snapshot: Optional[Dict[Any, Any]] = None
+        self._changes: Deque[Dict[str, Any]] = deque()
+        self._squashed: Dict[Any, Dict[str, Any]] = {}
+        self._squash_deadline: Optional[float] = None
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        Return whether the initial documents of the selection were received.
+        """
+
+        return self._ready
+
+    @property
+    def restarts(self) -> int:
+        """
+        Return the number of times the changefeed was restarted after a failure.
+        """
+
+        return self._restarts
+
+    def _make_query(self) -> RqlQuery:
+        """
+        Return the changefeed of the selection, starting with its documents.
+        """
+
+        return self.selection.changes(include_initial=True, include_states=True)
+
+    def _backoff(self) -> float:
+        """
+        Return the seconds to wait before the next attempt to start the changefeed,
+        doubling with every failed attempt up to `max_backoff`. A random part of the
+        delay is dropped, so the clients of a restarted server do not reconnect all
+        at once.
+        """
+
+        delay = min(self.min_backoff * 2 ** (self._attempts - 1), self.max_backoff)
+        return random.uniform(delay / 2, delay)
+
+    def _retry_delay(self, deadline: Optional[float]) -> float:
+        """
+        Return the seconds to wait before the next attempt to start the changefeed.
+
+        :raises: ReqlTimeoutError
+        """
+
+        if self._retry_at is None:
+            return 0.0
+
+        now = time.monotonic()
+
+        if deadline is not None and deadline < self._retry_at:
+            raise ReqlTimeoutError()
+
+        return max(self._retry_at - now, 0.0)
+
+    def _failed_attempt(self, error: Exception) -> None:
+        """
+        Schedule the next attempt to start the changefeed, or fail the changefeed if
+        the error is final or the attempts are exhausted.
+
+        :raises: ReqlError
+        """
+
+        if not is_retryable(error) or (
+            self.max_retries is not None and self._attempts > self.max_retries
+        ):
+            self.error = error
+            raise error
+
+        self._retry_at = time.monotonic() + self._backoff()
+
+    def _interrupted(self, error: Exception) -> None:
+        """
+        Forget the cursor of the interrupted changefeed, which is restarted on the
+        next read, or fail the changefeed if the error is final.
+
+        :raises: ReqlError
+        """
+
+        self._cursor = None
+        self._snapshot = None
+
+        if not is_retryable(error):
+            self.error = error
+            raise error
+
+        self._restarts += 1
+
+    def _receive(self, item: Dict[str, Any]) -> bool:
+        """
+        Apply an item of the changefeed. Return `False` if the changefeed reported an
+        error, like changes lost by the server, so it must be restarted.
+        """
+
+        if "state" in item:
+            if item["state"] == "initializing":
+                self._snapshot = {}
+            elif item["state"] == "ready":
+                self._reconcile()
+
+            return True
+
+        if "error" in item:
+            return False
+
+        old_val = item.get("old_val")
+        new_val = item.get("new_val")
+
+        if self._snapshot is not None:
+            self.__apply(self._snapshot, old_val, new_val)
+        else:
+            self.__apply(self._documents, old_val, new_val)
+            self._queue({"old_val": old_val, "new_val": new_val})
+
+        return True
+
+    def __apply(self, documents: Dict[Any, Any], old_val: Any, new_val: Any) -> None:
+        """
+        Apply a change to the documents.
+        """
+
+        if old_val is not None:
+            documents.pop(make_hashable(old_val[self.primary_key]), None)
+
+        if new_val is not None:
+            documents[make_hashable(new_val[self.primary_key])] = new_val
+
+    def _reconcile(self) -> None:
+        """
+        Queue the differences between the last known documents and the documents of
+        the changefeed, which replace them.
+        """
+
+        documents, self._snapshot = self._snapshot or {}, None
+
+        # The squashed changes lead to the last known documents, so they go first
+        self._flush()
+
+        for key, document in documents.items():
+            known = self._documents.get(key)
+
+            if known != document:
+                self._changes.append({"old_val": known, "new_val": document})
+
+        for key, known in self._documents.items():
+            if key not in documents:
+                self._changes.append({"old_val": known, "new_val": None})
+
+        self._documents = documents
+        self._ready = True
+        self._attempts = 0
+        self._retry_at = None
+
+    def _queue(self, change: Dict[str, Any]) -> None:
+        """
+        Queue a change, coalescing it with the squashed change of the same document.
+        """
+
+        if not self.squash:
+            self._changes.append(change)
+            return
+
+        document = change["new_val"] or change["old_val"]
+        key = make_hashable(document[self.primary_key])
+        squashed = self._squashed.get(key)
+
+        if self._squash_deadline is None:
+            self._squash_deadline = time.monotonic() + self.squash
+
+        if squashed is None:
+            self._squashed[key] = change
+        elif squashed["old_val"] == change["new_val"]:
+            del self._squashed[key]
+        else:
+            squashed["new_val"] = change["new_val"]
+
+    def _flush(self) -> None:
+        """
+        Queue the squashed changes.
+        """
+
+        self._changes.extend(self._squashed.values())
+        self._squashed.clear()
+        self._squash_deadline = None
+
+    def _pop(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the next queued change, or raise the error of the changefeed once the
+        queued changes are consumed.
+
+        :raises: ReqlCursorEmpty | ReqlError
+        """
+
+        if (
+            self._squash_deadline is not None
+            and time.monotonic() >= self._squash_deadline
+        ):
+            self._flush()
+
+        if self._changes:
+            return self._changes.popleft()
+
+        if self.error is not None:
+            raise self.error
+
+        if self._closed:
+            raise ReqlCursorEmpty()
+
+        return None
+
+    def _cursor_wait(self, deadline: Optional[float]) -> Any:
+        """
+        Return the `wait` argument of the cursor, waiting until the deadline or the
+        end of the squash window.
+        """
+
+        now = time.monotonic()
+        timeouts = [
+            max(limit - now, 0.0)
+            for limit in (deadline, self._squash_deadline)
+            if limit is not None
+        ]
+
+        return min(timeouts) if timeouts else True
+
+    def _squash_due(self) -> bool:
+        """
+        Return whether the squash window is over.
+        """
+
+        return (
+            self._squash_deadline is not None
+            and time.monotonic() >= self._squash_deadline
+        )
+
+
+class ResumableFeed(BaseResumableFeed):
+    """
+    Resumable changefeed of the synchronous connection, iterated like a cursor by
+    one thread. The connection is reconnected if it was closed, and the changefeed
+    is restarted on the next read after a failure.
+    """
+
+    def __enter__(self) -> "ResumableFeed":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __iter__(self) -> "ResumableFeed":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        try:
+            return self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopIteration from exc
+
+    def __start(self, deadline: Optional[float]) -> None:
+        """
+        Start the changefeed, reconnecting if the connection was closed, and wait
+        between the failed attempts.
+
+        :raises: ReqlTimeoutError | ReqlError
+        """
+
+        while self._cursor is None:
+            time.sleep(self._retry_delay(deadline))
+            self._attempts += 1
+
+            try:
+                if not self.connection.is_open():
+                    self.connection.reconnect(noreply_wait=False)
+
+                self._cursor = self._make_query().run(
+                    self.connection, **self.global_optargs
+                )
+            except ReqlError as exc:
+                self._failed_attempt(exc)
+
+    def __stop(self) -> None:
+        """
+        Stop the changefeed if the connection is still open.
+        """
+
+        cursor, self._cursor = self._cursor, None
+
+        if cursor is not None and cursor.connection.is_open():
+            with contextlib.suppress(ReqlError):
+                cursor.close()
+
+    def next(self, wait: Any = True) -> Dict[str, Any]:
+        """
+        Return the next change. If `wait` is `False` or a number, a `ReqlTimeoutError`
+        is raised when no change arrived in time, including while the changefeed is
+        restarted.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            change = self._pop()
+
+            if change is not None:
+                return change
+
+            self.__start(deadline)
+
+            try:
+                item = self._cursor.next(wait=self._cursor_wait(deadline))
+            except ReqlTimeoutError:
+                if self._squash_due():
+                    continue
+
+                raise
+            except ReqlCursorEmpty:
+                self._interrupted(ReqlDriverError("The changefeed ended."))
+                continue
+            except ReqlError as exc:
+                self.__stop()
+                self._interrupted(exc)
+                continue
+
+            if not self._receive(item):
+                self.__stop()
+                self._interrupted(ReqlDriverError(item["error"]))
+
+    def close(self) -> None:
+        """
+        Stop the changefeed. The changes not read yet are discarded.
+        """
+
+        self._closed = True
+        self._changes.clear()
+        self._squashed.clear()
+        self._squash_deadline = None
+        self.__stop()
+
+
+class AsyncioResumableFeed(BaseResumableFeed):
+    """
+    Resumable changefeed of the asyncio connection, supporting `async for`. The
+    connection is reconnected if it was closed, and the changefeed is restarted on
+    the next read after a failure.
+    """
+
+    async def __aenter__(self) -> "AsyncioResumableFeed":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def __aiter__(self) -> "AsyncioResumableFeed":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        try:
+            return await self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopAsyncIteration from exc
+
+    async def __start(self, deadline: Optional[float]) -> None:
+        """
+        Start the changefeed, reconnecting if the connection was closed, and wait
+        between the failed attempts.
+
+        :raises: ReqlTimeoutError | ReqlError
+        """
+
+        while self._cursor is None:
+            await asyncio.sleep(self._retry_delay(deadline))
+            self._attempts += 1
+
+            try:
+                if not self.connection.is_open():
+                    await self.connection.reconnect(noreply_wait=False)
+
+                self._cursor = await self._make_query().run(
+                    self.connection, **self.global_optargs
+                )
+            except ReqlError as exc:
+                self._failed_attempt(exc)
+
+    async def __stop(self) -> None:
+        """
+        Stop the changefeed if the connection is still open.
+        """
+
+        cursor, self._cursor = self._cursor, None
+
+        if cursor is not None and cursor.connection.is_open():
+            with contextlib.suppress(ReqlError):
+                await cursor.close()
+
+    async def next(self, wait: Any = True) -> Dict[str, Any]:
+        """
+        Return the next change. If `wait` is `False` or a number, a `ReqlTimeoutError`
+        is raised when no change arrived in time, including while the changefeed is
+        restarted.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            change = self._pop()
+
+            if change is not None:
+                return change
+
+            await self.__start(deadline)
+
+            try:
+                item = await self._cursor.next(wait=self._cursor_wait(deadline))
+            except ReqlTimeoutError:
+                if self._squash_due():
+                    continue
+
+                raise
+            except ReqlCursorEmpty:
+                self._interrupted(ReqlDriverError("The changefeed ended."))
+                continue
+            except ReqlError as exc:
+                await self.__stop()
+                self._interrupted(exc)
+                continue
+
+            if not self._receive(item):
+                await self.__stop()
+                self._interrupted(ReqlDriverError(item["error"]))
+
+    async def close(self) -> None:
+        """
+        Stop the changefeed. The changes not read yet are discarded.
+        """
+
+        self._closed = True
+        self._changes.clear()
+        self._squashed.clear()
+        self._squash_deadline = None
+        await self.__stop()
@@ -21,14 +21,47 @@ decode pseudo-type objects to Python native objects.
 """
 
 import base64
+from collections.abc import Mapping, Sequence
+import copy
 from datetime import datetime
 import json
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import math
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from rethinkdb.ast import RqlBinary, RqlQuery, RqlTzinfo
+from rethinkdb.ast import Datum, JsonDatum, RqlBinary, RqlQuery, RqlTzinfo
 from rethinkdb.errors import ReqlDriverError
-
-__all__ = ["ReQLEncoder", "ReQLDecoder"]
+from rethinkdb.prepared import BoundQuery
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = [
+    "DEFAULT_JSON_DECODER",
+    "DEFAULT_JSON_ENCODER",
+    "LazyDocument",
+    "LazyList",
+    "LazyReQLDecoder",
+    "OrjsonReQLDecoder",
+    "OrjsonReQLEncoder",
+    "ReQLDecoder",
+    "ReQLEncoder",
+]
+
+PSEUDO_TYPE_MARKER: bytes = b"$reql_type$"
+
+# The scalar types orjson serializes exactly like the standard library. The floats
+# are serialized alike only if they are finite, as orjson serializes `NaN` and
+# infinite floats as `null` where the standard library raises.
+ORJSON_SCALAR_TYPES = frozenset((str, int, bool, type(None)))
+
+if orjson is not None:
+    # The types orjson would serialize by itself, unlike the standard library, are
+    # passed to `default` instead
+    ORJSON_OPTIONS: int = (
+        orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+    )
 
 
 class ReQLEncoder(json.JSONEncoder):
@@ -71,6 +104,77 @@ class ReQLEncoder(json.JSONEncoder):
 
         return super().default(o)
 
+    def encode_bytes(self, o: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON representation of ``o``.
+
+        :raises: TypeError | ValueError
+        """
+
+        return self.encode(o).encode("utf-8")
+
+    def encode_term(self, term: RqlQuery) -> bytes:
+        """
+        Return the UTF-8 encoded JSON representation of the term. The JSON of every
+        term of the tree is memoized on the term, so the subtrees which are reused by
+        many queries are serialized only once and spliced into the JSON of the others.
+        The bound prepared queries splice their values into their serialized template.
+
+        :raises: TypeError | ValueError
+        """
+
+        if isinstance(term, BoundQuery):
+            return term.encode(self)
+
+        fragment = term.get_fragment()
+
+        if fragment is None:
+            if isinstance(term, JsonDatum):
+                # The built datum contains no terms to splice
+                fragment = self._encode_json(term.build())
+            else:
+                fragment = self.__encode_built(term.build())
+
+            term.set_fragment(fragment)
+
+        return fragment
+
+    def _encode_json(self, value: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON of the built datum of a `JsonDatum`, which is
+        made of JSON values only.
+
+        :raises: TypeError | ValueError
+        """
+
+        return self.encode_bytes(value)
+
+    def __encode_built(self, value: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON of the built term, splicing the JSON of the
+        nested terms.
+        """
+
+        if isinstance(value, RqlQuery):
+            return self.encode_term(value)
+
+        if isinstance(value, list):
+            return b"[" + b",".join(self.__encode_built(item) for item in value) + b"]"
+
+        if isinstance(value, dict) and any(
+            isinstance(item, RqlQuery) for item in value.values()
+        ):
+            return (
+                b"{"
+                + b",".join(
+                    self.encode_bytes(key) + b":" + self.__encode_built(item)
+                    for key, item in value.items()
+                )
+                + b"}"
+            )
+
+        return self.encode_bytes(value)
+
 
 class ReQLDecoder(json.JSONDecoder):
     """
@@ -100,6 +204,15 @@ class ReQLDecoder(json.JSONDecoder):
 
         self.reql_format_opts = reql_format_opts or {}
 
+    def decode_bytes(self, data: bytes) -> Any:
+        """
+        Return the Python representation of the UTF-8 encoded JSON document.
+
+        :raises: ValueError | ReqlDriverError
+        """
+
+        return self.decode(data.decode("utf-8"))
+
     @staticmethod
     def convert_time(obj: Dict[str, Any]) -> datetime:
         """
@@ -170,7 +283,7 @@ class ReQLDecoder(json.JSONDecoder):
                 f'Unknown {format_name} run option "{pseudo_type_format}".'
             )
 
-        return None
+        return obj
 
     def convert_pseudo_type(self, obj: Dict[str, Any]) -> Any:
         """
@@ -187,17 +300,371 @@ class ReQLDecoder(json.JSONDecoder):
             return obj
 
         if reql_type == "TIME":
-            self.__convert_pseudo_type(obj, "time_format", self.convert_time)
-        elif reql_type == "GROUPED_DATA":
-            self.__convert_pseudo_type(obj, "group_format", self.convert_grouped_data)
-        elif reql_type == "BINARY":
-            self.__convert_pseudo_type(obj, "binary_format", self.convert_binary)
-        elif reql_type == "GEOMETRY":
+            return self.__convert_pseudo_type(obj, "time_format", self.convert_time)
+
+        if reql_type == "GROUPED_DATA":
+            return self.__convert_pseudo_type(
+                obj, "group_format", self.convert_grouped_data
+            )
+
+        if reql_type == "BINARY":
+            return self.__convert_pseudo_type(obj, "binary_format", self.convert_binary)
+
+        if reql_type == "GEOMETRY":
             # No special support for this, just return the raw object
             return obj
 
         raise ReqlDriverError(f'Unknown pseudo-type "{reql_type}"')
 
+    def convert_pseudo_types(self, document: Any) -> Any:
+        """
+        Convert the pseudo-type objects of an already parsed document, the nested
+        objects first, as the object hook of the standard library would do.
+
+        :raises: ReqlDriverError
+        """
+
+        if not isinstance(document, (dict, list)):
+            return document
+
+        root: List[Any] = [document]
+        stack: List[Tuple[Any, Any, Any, bool]] = [(root, 0, document, False)]
+
+        while stack:
+            parent, key, node, visited = stack.pop()
+
+            if visited:
+                parent[key] = self.convert_pseudo_type(node)
+                continue
+
+            if isinstance(node, dict):
+                stack.append((parent, key, node, True))
+                children = node.items()
+            else:
+                children = enumerate(node)
+
+            for child_key, child in children:
+                if isinstance(child, (dict, list)):
+                    stack.append((node, child_key, child, False))
+
+        return root[0]
+
+
+def is_orjson_compatible(value: Any) -> bool:
+    """
+    Return whether orjson serializes the value exactly like the standard library,
+    which is the case if the value is made of dictionaries with string keys, lists,
+    tuples, and JSON scalars, with finite floats only.
+    """
+
+    pending = [value]
+
+    while pending:
+        current = pending.pop()
+        cls = type(current)
+
+        if cls in ORJSON_SCALAR_TYPES:
+            continue
+
+        if cls is float:
+            if not math.isfinite(current):
+                return False
+        elif cls is dict:
+            if any(type(key) is not str for key in current):
+                return False
+
+            pending.extend(current.values())
+        elif cls in (list, tuple):
+            pending.extend(current)
+        else:
+            return False
+
+    return True
+
+
+class OrjsonReQLEncoder(ReQLEncoder):
+    """
+    ReQLEncoder serializing with orjson. The values orjson would serialize unlike the
+    standard library are serialized by the standard library instead, so both encoders
+    produce the same JSON and raise the same errors. These are the integers exceeding
+    64 bits, the dictionaries with non-string keys, the `NaN` and infinite floats,
+    which orjson serializes as `null`, and the objects orjson serializes natively,
+    like `datetime`, `UUID` or dataclasses, which the standard library rejects.
+    """
+
+    def encode_bytes(self, o: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON representation of ``o``.
+
+        :raises: TypeError | ValueError
+        """
+
+        if not isinstance(o, RqlQuery) and not is_orjson_compatible(o):
+            return json.JSONEncoder.encode(self, o).encode("utf-8")
+
+        return self._encode_json(o)
+
+    def __orjson_default(self, o: Any) -> Any:
+        """
+        Return a serializable object for ``o`` to orjson. The values of the datums are
+        checked like the values passed to `encode_bytes`.
+
+        :raises: TypeError
+        """
+
+        built = self.default(o)
+
+        if (
+            isinstance(o, Datum)
+            and not isinstance(o, JsonDatum)
+            and not is_orjson_compatible(built)
+        ):
+            # Serialized by the standard library instead, raising the same errors
+            raise TypeError("The datum is serialized by the standard library.")
+
+        return built
+
+    def _encode_json(self, value: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON of a value made of JSON values and query terms,
+        which is not checked again.
+
+        :raises: TypeError | ValueError
+        """
+
+        try:
+            return orjson.dumps(
+                value, default=self.__orjson_default, option=ORJSON_OPTIONS
+            )
+        except orjson.JSONEncodeError:
+            return json.JSONEncoder.encode(self, value).encode("utf-8")
+
+    def encode(self, o: Any) -> str:
+        """
+        Return the JSON representation of ``o``.
+
+        :raises: TypeError | ValueError
+        """
+
+        return self.encode_bytes(o).decode("utf-8")
+
+
+class OrjsonReQLDecoder(ReQLDecoder):
+    """
+    ReQLDecoder parsing with orjson. Instead of calling a hook for every parsed
+    object, the pseudo-type objects are converted in a single pass over the parsed
+    document, which is skipped entirely if the document contains no pseudo-types.
+
+    If any of the parse hooks of the standard library are set, the standard library
+    is used for decoding.
+    """
+
+    def __init__(
+        self,
+        object_hook: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        parse_float: Optional[Callable[[str], Any]] = None,
+        parse_int: Optional[Callable[[str], Any]] = None,
+        parse_constant: Optional[Callable[[str], Any]] = None,
+        strict: bool = True,
+        object_pairs_hook: Optional[Callable[[List[Tuple[str, Any]]], Any]] = None,
+        reql_format_opts: Optional[Dict[str, Any]] = None,
+    ):
+        super().__init__(
+            object_hook=object_hook,
+            parse_float=parse_float,
+            parse_int=parse_int,
+            parse_constant=parse_constant,
+            strict=strict,
+            object_pairs_hook=object_pairs_hook,
+            reql_format_opts=reql_format_opts,
+        )
+
+        self.__has_default_hooks: bool = all(
+            hook is None
+            for hook in (
+                object_hook,
+                parse_float,
+                parse_int,
+                parse_constant,
+                object_pairs_hook,
+            )
+        )
+
+    def decode_bytes(self, data: bytes) -> Any:
+        """
+        Return the Python representation of the UTF-8 encoded JSON document.
+
+        :raises: ValueError | ReqlDriverError
+        """
+
+        if not self.__has_default_hooks:
+            return json.JSONDecoder.decode(self, data.decode("utf-8"))
+
+        document = orjson.loads(data)
+
+        if PSEUDO_TYPE_MARKER not in data:
+            return document
+
+        return self.convert_pseudo_types(document)
+
+    # pylint: disable=arguments-differ
+    def decode(self, s: str) -> Any:  # type: ignore
+        """
+        Return the Python representation of the JSON document.
+
+        :raises: ValueError | ReqlDriverError
+        """
+
+        return self.decode_bytes(s.encode("utf-8"))
+
+
+def make_lazy(value: Any, decoder: ReQLDecoder) -> Any:
+    """
+    Wrap the parsed JSON value into a lazy view. Pseudo-type objects are converted
+    right away, as they are only created when the value itself is accessed.
+
+    :raises: ReqlDriverError
+    """
+
+    if isinstance(value, dict):
+        if "$reql_type$" in value:
+            return decoder.convert_pseudo_types(value)
+
+        return LazyDocument(value, decoder)
+
+    if isinstance(value, list):
+        return LazyList(value, decoder)
+
+    return value
+
+
+class LazyDocument(Mapping):
+    """
+    Read-only mapping view of a parsed JSON object. The pseudo-type objects of the
+    document are converted only when they are accessed, and the converted values are
+    cached.
+    """
+
+    __slots__ = ("_raw", "_decoder", "_converted")
+
+    def __init__(self, raw: Dict[str, Any], decoder: ReQLDecoder):
+        self._raw: Dict[str, Any] = raw
+        self._decoder: ReQLDecoder = decoder
+        self._converted: Dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._converted[key]
+        except KeyError:
+            value = make_lazy(self._raw[key], self._decoder)
+
+        self._converted[key] = value
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._raw!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the document as a dictionary with every pseudo-type converted.
+
+        :raises: ReqlDriverError
+        """
+
+        return self._decoder.convert_pseudo_types(copy.deepcopy(self._raw))
+
+
+class LazyList(Sequence):
+    """
+    Read-only sequence view of a parsed JSON array, converting its items on access.
+    """
+
+    __slots__ = ("_raw", "_decoder", "_converted")
+
+    def __init__(self, raw: List[Any], decoder: ReQLDecoder):
+        self._raw: List[Any] = raw
+        self._decoder: ReQLDecoder = decoder
+        self._converted: Dict[int, Any] = {}
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._raw)))]
+
+        if index < 0:
+            index += len(self._raw)
+
+        try:
+            return self._converted[index]
+        except KeyError:
+            value = make_lazy(self._raw[index], self._decoder)
+
+        self._converted[index] = value
+        return value
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._raw!r})"
+
+    def to_list(self) -> List[Any]:
+        """
+        Return the items as a list with every pseudo-type converted.
+
+        :raises: ReqlDriverError
+        """
+
+        return self._decoder.convert_pseudo_types(copy.deepcopy(self._raw))
+
+
+class LazyReQLDecoder(ReQLDecoder):
+    """
+    ReQLDecoder returning the JSON objects as `LazyDocument` and the arrays as
+    `LazyList` views, which convert the pseudo-type objects only when accessed.
+    """
+
+    def decode_bytes(self, data: bytes) -> Any:
+        """
+        Return the lazy view of the UTF-8 encoded JSON document.
+
+        :raises: ValueError
+        """
+
+        if orjson is not None:
+            return make_lazy(orjson.loads(data), self)
+
+        return self.decode(data.decode("utf-8"))
+
+    # pylint: disable=arguments-differ
+    def decode(self, s: str) -> Any:  # type: ignore
+        """
+        Return the lazy view of the JSON document.
+
+        :raises: ValueError
+        """
+
+        return make_lazy(json.loads(s), self)
+
+
+if orjson is not None:
+    DEFAULT_JSON_ENCODER: type = OrjsonReQLEncoder
+    DEFAULT_JSON_DECODER: type = OrjsonReQLDecoder
+else:  # pragma: no cover
+    DEFAULT_JSON_ENCODER = ReQLEncoder
+    DEFAULT_JSON_DECODER = ReQLDecoder
+
 
 def make_hashable(obj: Dict[str, Any]) -> Union[tuple, frozenset, dict]:
     """
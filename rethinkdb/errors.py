@@ -84,7 +84,7 @@ class QueryPrinter:
         ]
 
         kwargs: Dict[int, List[str]] = {
-            k: self.__compose_term(v) for k, v in term.optargs.items()
+            k: self.__compose_term(v) for k, v in term.kwargs.items()
         }
 
         return term.compose(args, kwargs)
@@ -110,7 +110,7 @@ class QueryPrinter:
         ]
 
         kwargs: Dict[int, List[str]] = {}
-        for key, value in term.optargs.items():
+        for key, value in term.kwargs.items():
             if current_frame == key:
                 kwargs[key] = self.__compose_carets(value, frames)
             else:
@@ -25,13 +25,16 @@ This module contains the supported handshakes which can be used to establish a n
 
 from abc import abstractproperty
 import base64
+from collections import OrderedDict
 from enum import Enum
 import hashlib
 import hmac
 import json
+import os
 from random import SystemRandom
 import struct
-from typing import Dict, Optional
+import threading
+from typing import Dict, Optional, Tuple
 
 from rethinkdb import ql2_pb2
 from rethinkdb.errors import InvalidHandshakeStateError, ReqlAuthError, ReqlDriverError
@@ -47,6 +50,92 @@ class HandshakeState(Enum):
     INITIAL_RESPONSE = 1
     AUTH_REQUEST = 2
     AUTH_RESPONSE = 3
+    AUTHENTICATED = 4
+
+
+ScramKeys = Tuple[bytes, bytes]
+
+
+def derive_scram_keys(password: bytes, salt: bytes, iterations: int) -> ScramKeys:
+    """
+    Derive the `ClientKey` and `ServerKey` of RFC 5802 from the password. This is the
+    expensive part of the authentication, as it runs `iterations` rounds of PBKDF2.
+    """
+
+    salted_password: bytes = hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
+
+    return (
+        hmac.new(salted_password, b"Client Key", hashlib.sha256).digest(),
+        hmac.new(salted_password, b"Server Key", hashlib.sha256).digest(),
+    )
+
+
+class ScramKeyCache:
+    """
+    Bounded, thread-safe LRU cache of the SCRAM keys derived from the passwords, so
+    reconnecting with the same credentials skips the key derivation.
+
+    The plaintext password is never stored. The password is part of the key only as an
+    HMAC computed with a secret generated for the process, so the cache entries of a
+    changed password are not reused.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize: int = maxsize
+
+        self.__secret: bytes = os.urandom(32)
+        self.__lock: threading.Lock = threading.Lock()
+        self.__entries: "OrderedDict[Tuple[bytes, bytes, int, bytes], ScramKeys]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get_or_derive(
+        self, username: bytes, password: bytes, salt: bytes, iterations: int
+    ) -> ScramKeys:
+        """
+        Return the cached keys of the credentials, deriving and caching them if they
+        are not cached yet.
+        """
+
+        password_digest: bytes = hmac.new(
+            self.__secret, password, hashlib.sha256
+        ).digest()
+        key = (username, salt, iterations, password_digest)
+
+        with self.__lock:
+            keys: Optional[ScramKeys] = self.__entries.get(key)
+
+            if keys is not None:
+                self.__entries.move_to_end(key)
+                return keys
+
+        keys = derive_scram_keys(password, salt, iterations)
+
+        if self.maxsize <= 0:
+            return keys
+
+        with self.__lock:
+            self.__entries[key] = keys
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+        return keys
+
+    def clear(self) -> None:
+        """
+        Drop every cached key.
+        """
+
+        with self.__lock:
+            self.__entries.clear()
+
+
+SCRAM_KEY_CACHE = ScramKeyCache()
 
 
 class BaseHandshake:
@@ -125,6 +214,7 @@ class HandshakeV1_0(BaseHandshake):  # pylint: disable=invalid-name
         1: HandshakeState.INITIAL_RESPONSE,
         2: HandshakeState.AUTH_REQUEST,
         3: HandshakeState.AUTH_RESPONSE,
+        4: HandshakeState.AUTHENTICATED,
     }
 
     def __init__(self, host: str, port: int, username: bytes, password: bytes):
@@ -255,8 +345,8 @@ class HandshakeV1_0(BaseHandshake):  # pylint: disable=invalid-name
         if random_nonce != self._random_nonce:
             raise ReqlAuthError("Invalid nonce from server", self.host, self.port)
 
-        salted_password: bytes = hashlib.pbkdf2_hmac(
-            "sha256",
+        client_key, server_key = SCRAM_KEY_CACHE.get_or_derive(
+            self.__username,
             self.__password,
             base64.standard_b64decode(authentication[b"s"]),
             int(authentication[b"i"]),
@@ -268,13 +358,7 @@ class HandshakeV1_0(BaseHandshake):  # pylint: disable=invalid-name
         )
 
         self._server_signature = hmac.new(
-            hmac.new(salted_password, b"Server Key", hashlib.sha256).digest(),
-            auth_message,
-            hashlib.sha256,
-        ).digest()
-
-        client_key: bytes = hmac.new(
-            salted_password, b"Client Key", hashlib.sha256
+            server_key, auth_message, hashlib.sha256
         ).digest()
 
         client_signature: bytes = hmac.new(
@@ -335,9 +419,21 @@ class HandshakeV1_0(BaseHandshake):  # pylint: disable=invalid-name
         self._server_signature = None
         self.state = HandshakeState.INITIAL_CONNECTION
 
+    @property
+    def is_completed(self) -> bool:
+        """
+        Return whether the server accepted the authentication.
+        """
+
+        return self.state == HandshakeState.AUTHENTICATED
+
     def next_message(self, raw_response: Optional[bytes]) -> Optional[bytes]:
         """
-        Handle the next message to send or receive.
+        Handle the next message to send or receive. Every call processes exactly one
+        step of the handshake; when the returned message is `None` and the handshake
+        is not completed yet, the next response of the server must be read.
+
+        :raises: InvalidHandshakeStateError | ReqlDriverError | ReqlAuthError
         """
 
         response: str = ""
@@ -355,13 +451,16 @@ class HandshakeV1_0(BaseHandshake):  # pylint: disable=invalid-name
 
             message = self.__initialize_connection()
 
-        if self.state == HandshakeState.INITIAL_RESPONSE:
+        elif self.state == HandshakeState.INITIAL_RESPONSE:
             self.__read_response(response)
 
-        if self.state == HandshakeState.AUTH_REQUEST:
+        elif self.state == HandshakeState.AUTH_REQUEST:
             message = self.__prepare_auth_request(response)
 
-        if self.state == HandshakeState.AUTH_RESPONSE:
+        elif self.state == HandshakeState.AUTH_RESPONSE:
             self.__read_auth_response(response)
 
+        else:
+            raise ReqlDriverError("Handshake is already completed")
+
         return message
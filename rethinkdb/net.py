@@ -0,0 +1,1478 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This file incorporates work covered by the following copyright:
+# Copyright 2010-2016 RethinkDB, all rights reserved.
+
+"""
+The net module contains the wire protocol primitives shared by every transport and the
+synchronous, socket based connection and cursor implementation.
+
+Every query is framed with an 8 byte little-endian token and a 4 byte little-endian
+length, followed by the JSON serialized query. The server responds with frames of the
+same layout, where the token identifies the query the response belongs to. This makes
+it possible to keep many queries in flight on the same socket and match the responses
+to the queries by their tokens.
+"""
+
+__all__ = [
+    "BaseConnection",
+    "BaseCursor",
+    "Connection",
+    "Cursor",
+    "DEFAULT_HOST",
+    "DEFAULT_PORT",
+    "DEFAULT_TIMEOUT",
+    "DEFAULT_USER",
+    "Query",
+    "Response",
+    "connect",
+]
+
+from collections import deque
+import copy
+import itertools
+import numbers
+import select
+import socket
+import ssl
+import struct
+import sys
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+from rethinkdb import ql2_pb2
+from rethinkdb.ast import DB, RqlQuery, expr
+from rethinkdb.cache import MISSING, BaseSingleFlight, ResultCache
+from rethinkdb.encoder import (
+    DEFAULT_JSON_DECODER,
+    DEFAULT_JSON_ENCODER,
+    LazyReQLDecoder,
+    ReQLDecoder,
+    ReQLEncoder,
+)
+from rethinkdb.errors import (
+    ReqlAuthError,
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlError,
+    ReqlInternalError,
+    ReqlNonExistenceError,
+    ReqlOpFailedError,
+    ReqlOpIndeterminateError,
+    ReqlPermissionError,
+    ReqlQueryLogicError,
+    ReqlResourceLimitError,
+    ReqlRuntimeError,
+    ReqlServerCompileError,
+    ReqlTimeoutError,
+    ReqlUserError,
+)
+from rethinkdb.handshake import HandshakeV1_0
+from rethinkdb.streaming import RawResponseDecoder, ResponseStream
+from rethinkdb.tuning import AdaptiveBatchSizer, BatchObserver
+
+DEFAULT_HOST: str = "localhost"
+DEFAULT_PORT: int = 28015
+DEFAULT_USER: str = "admin"
+DEFAULT_TIMEOUT: float = 20
+
+# The options which are used by the client to decode the response, but the server
+# accepts them as global optional arguments too.
+REQL_FORMAT_OPTS: Tuple[str, ...] = ("time_format", "group_format", "binary_format")
+
+# The values of the client-only `response_format` run option. With "lazy", the
+# results are returned as mapping views converting the pseudo-types on access. With
+# "raw", the results are not decoded, and every batch is returned as a `memoryview`
+# of its JSON array in the received bytes.
+RESPONSE_FORMATS: Tuple[str, ...] = ("native", "lazy", "raw")
+
+# The run options used by the client only, which are never sent to the server
+CLIENT_OPTARGS: Tuple[str, ...] = (
+    "batch_sizer",
+    "max_buffered_bytes",
+    "prefetch",
+    "response_format",
+    "result_cache",
+    "single_flight",
+    "stream_rows",
+)
+
+FRAME_HEADER = struct.Struct("<QL")
+READ_CHUNK_SIZE: int = 64 * 1024
+
+P_QUERY = ql2_pb2.Query.QueryType  # pylint: disable=invalid-name
+P_RESPONSE = ql2_pb2.Response.ResponseType  # pylint: disable=invalid-name
+P_ERROR = ql2_pb2.Response.ErrorType  # pylint: disable=invalid-name
+
+RUNTIME_ERRORS: Dict[int, Type[ReqlRuntimeError]] = {
+    P_ERROR.INTERNAL: ReqlInternalError,
+    P_ERROR.RESOURCE_LIMIT: ReqlResourceLimitError,
+    P_ERROR.QUERY_LOGIC: ReqlQueryLogicError,
+    P_ERROR.NON_EXISTENCE: ReqlNonExistenceError,
+    P_ERROR.OP_FAILED: ReqlOpFailedError,
+    P_ERROR.OP_INDETERMINATE: ReqlOpIndeterminateError,
+    P_ERROR.USER: ReqlUserError,
+    P_ERROR.PERMISSION_ERROR: ReqlPermissionError,
+}
+
+
+class SequenceResult:
+    """
+    The rows of a sequence result completed by the first response, which are cached
+    and shared instead of its cursor. Every caller receives a new cursor over them.
+    """
+
+    __slots__ = ("rows",)
+
+    def __init__(self, rows: List[Any]) -> None:
+        self.rows: List[Any] = rows
+
+
+class Query:
+    """
+    A query sent to the server, identified by its token.
+    """
+
+    __slots__ = (
+        "query_type",
+        "token",
+        "term",
+        "global_optargs",
+        "response_format",
+        "stream",
+        "low_water_mark",
+        "max_buffered_bytes",
+        "batch_observer",
+    )
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        query_type: int,
+        token: int,
+        term: Optional[RqlQuery] = None,
+        global_optargs: Optional[Dict[str, Any]] = None,
+        response_format: str = "native",
+    ) -> None:
+        self.query_type: int = query_type
+        self.token: int = token
+        self.term: Optional[RqlQuery] = term
+        self.global_optargs: Optional[Dict[str, Any]] = global_optargs
+        self.response_format: str = response_format
+        self.stream: Optional[ResponseStream] = None
+        self.low_water_mark: Optional[int] = None
+        self.max_buffered_bytes: Optional[int] = None
+        self.batch_observer: Optional[BatchObserver] = None
+
+    def serialize(self, encoder: ReQLEncoder) -> bytes:
+        """
+        Return the framed wire representation of the query.
+        """
+
+        message: List[bytes] = [encoder.encode_bytes(self.query_type)]
+
+        if self.term is not None:
+            message.append(encoder.encode_term(self.term))
+
+        if self.global_optargs is not None:
+            message.append(encoder.encode_term(expr(self.global_optargs)))
+
+        payload: bytes = b"[" + b",".join(message) + b"]"
+        return FRAME_HEADER.pack(self.token, len(payload)) + payload
+
+
+class Response:
+    """
+    A decoded response of the server for the query identified by the token.
+
+    Responses which are streamed are announced before they are fully received, as
+    soon as their first results are available. These responses are not final, and
+    their results are handed over by the stream of the query instead of `data`.
+    """
+
+    __slots__ = (
+        "token",
+        "response_type",
+        "data",
+        "backtrace",
+        "profile",
+        "error_type",
+        "notes",
+        "is_final",
+        "size",
+    )
+
+    def __init__(self, token: int, payload: bytes, decoder: ReQLDecoder) -> None:
+        self._load(token, decoder.decode_bytes(payload), True)
+        self.size = len(payload)
+
+    @classmethod
+    def from_document(
+        cls, token: int, response: Dict[str, Any], is_final: bool = True
+    ) -> "Response":
+        """
+        Return the response of an already decoded response document.
+        """
+
+        instance = cls.__new__(cls)
+        instance._load(token, response, is_final)  # pylint: disable=protected-access
+        return instance
+
+    def _load(self, token: int, response: Dict[str, Any], is_final: bool) -> None:
+        self.token: int = token
+        self.response_type: int = response["t"]
+        self.data: List[Any] = response["r"]
+        self.backtrace: Optional[List[Any]] = response.get("b")
+        self.profile: Optional[Any] = response.get("p")
+        self.error_type: Optional[int] = response.get("e")
+        self.notes: List[int] = response.get("n", [])
+        self.is_final: bool = is_final
+
+        # The bytes of the received payload, set by the receiver of the payload
+        self.size: int = 0
+
+    def make_error(self, query: Query) -> ReqlError:
+        """
+        Return the exception which represents the error response.
+        """
+
+        if self.response_type == P_RESPONSE.CLIENT_ERROR:
+            return ReqlDriverError(self.data[0], query.term, self.backtrace)
+
+        if self.response_type == P_RESPONSE.COMPILE_ERROR:
+            return ReqlServerCompileError(self.data[0], query.term, self.backtrace)
+
+        if self.response_type == P_RESPONSE.RUNTIME_ERROR:
+            error_class = RUNTIME_ERRORS.get(self.error_type, ReqlRuntimeError)
+            return error_class(self.data[0], query.term, self.backtrace)
+
+        return ReqlDriverError(
+            f"Unknown Response type {self.response_type} encountered in a response."
+        )
+
+
+def maybe_profile(value: Any, response: Response) -> Any:
+    """
+    Attach the profile to the value if the query was run with profiling enabled.
+    """
+
+    if response.profile is not None:
+        return {"value": value, "profile": response.profile}
+
+    return value
+
+
+def stream_event(token: int, stream: ResponseStream, data: bytes) -> Optional[Any]:
+    """
+    Feed the next received bytes of a response to its stream. Return a response
+    announcing the results if the data completed new results, otherwise `None`.
+    """
+
+    if stream.feed(data) and stream.is_streaming:
+        return Response.from_document(
+            token, {"t": stream.response_type, "r": []}, is_final=False
+        )
+
+    return None
+
+
+def stream_result(token: int, stream: ResponseStream) -> Any:
+    """
+    Return the final response of a fully received streamed response, or the exception
+    raised while decoding it.
+    """
+
+    try:
+        response = Response.from_document(token, stream.finish())
+    except (ReqlDriverError, ValueError) as exc:
+        return exc
+
+    response.size = stream.size
+    return response
+
+
+def is_final_result(item: Any) -> bool:
+    """
+    Return whether the received item completes a response, as opposed to announcing
+    the results of a streamed response which is not fully received yet.
+    """
+
+    return not isinstance(item, Response) or item.is_final
+
+
+def wait_to_timeout(wait: Any) -> Optional[float]:
+    """
+    Convert the `wait` argument of the cursors to a timeout in seconds, where `None`
+    means waiting without a time limit.
+
+    :raises: ReqlDriverError
+    """
+
+    if isinstance(wait, bool):
+        return None if wait else 0
+
+    if isinstance(wait, numbers.Real) and wait >= 0:
+        return float(wait)
+
+    raise ReqlDriverError(f"Invalid wait timeout '{wait}'")
+
+
+def split_client_optargs(
+    global_optargs: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split the run options into the global optional arguments sent to the server and
+    the client-only options.
+    """
+
+    server_optargs = {}
+    client_optargs = {}
+
+    for name, value in global_optargs.items():
+        if name in CLIENT_OPTARGS:
+            client_optargs[name] = value
+        else:
+            server_optargs[name] = value
+
+    return server_optargs, client_optargs
+
+
+def prefetch_to_low_water_mark(prefetch: Any) -> Optional[int]:
+    """
+    Convert the client-only `prefetch` run option to the number of unread results
+    below which the cursors request the next batch, where `None` means requesting
+    the next batch once every result is read.
+
+    With `True`, the next batch is requested as soon as a batch arrives. With a
+    number, it is requested once at most that many results are left unread.
+
+    :raises: ReqlDriverError
+    """
+
+    if isinstance(prefetch, bool):
+        return sys.maxsize if prefetch else None
+
+    if isinstance(prefetch, numbers.Integral) and prefetch >= 0:
+        return int(prefetch)
+
+    raise ReqlDriverError(f"Invalid prefetch '{prefetch}'")
+
+
+def check_max_buffered_bytes(max_buffered_bytes: Any) -> Optional[int]:
+    """
+    Validate the client-only `max_buffered_bytes` run option, the budget of the
+    received bytes a cursor holds before it stops requesting batches ahead.
+
+    :raises: ReqlDriverError
+    """
+
+    if max_buffered_bytes is None:
+        return None
+
+    if (
+        isinstance(max_buffered_bytes, numbers.Integral)
+        and not isinstance(max_buffered_bytes, bool)
+        and max_buffered_bytes > 0
+    ):
+        return int(max_buffered_bytes)
+
+    raise ReqlDriverError(f"Invalid max_buffered_bytes '{max_buffered_bytes}'")
+
+
+class BaseCursor:
+    """
+    Common behaviour of the cursors, which iterate over the results of a sequence
+    query. The cursors request the next batch of results from the server when the
+    already received batches are consumed, or earlier when the query has a low-water
+    mark, so the next batch is on its way while the received results are processed.
+
+    The batches requested ahead are bounded by the `max_buffered_bytes` budget of the
+    query. As the server sends a batch only when it is requested, a cursor whose
+    budget is full receives nothing until its caller consumed enough results.
+    """
+
+    def __init__(self, connection: Any, query: Query, response: Response):
+        self.connection = connection
+        self.query: Query = query
+        self.items: Deque[Any] = deque() if query.stream is None else query.stream.rows
+        self.error: Optional[Exception] = None
+
+        # The number of results and bytes of the received batches, oldest first
+        self._batches: Deque[Tuple[int, int]] = deque()
+
+        # The first response of a streamed query may arrive before it is complete
+        self._outstanding_requests: int = 0 if response.is_final else 1
+        self._completed: bool = False
+
+        self._extend(response)
+        self._maybe_prefetch()
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            status = f"error: {self.error}"
+        elif self._completed:
+            status = "done streaming"
+        else:
+            status = "streaming"
+
+        return f"{self.__class__.__module__}.{self.__class__.__name__} ({status})"
+
+    @property
+    def is_completed(self) -> bool:
+        """
+        Return whether the server has no more results for the cursor.
+        """
+
+        return self._completed or self.error is not None
+
+    @property
+    def buffered_bytes(self) -> int:
+        """
+        Return the received bytes of the results left to return, estimated from the
+        size of their batches.
+        """
+
+        remaining = len(self.items)
+        buffered = 0.0
+
+        for count, size in reversed(self._batches):
+            if remaining <= 0:
+                break
+
+            buffered += size * min(remaining, count) / count
+            remaining -= count
+
+        return round(buffered)
+
+    def _extend(self, response: Response) -> None:
+        """
+        Add the results of a response to the cursor. The results of the streamed
+        responses are added by the stream of the query as they arrive.
+        """
+
+        if not response.is_final:
+            return
+
+        if response.response_type == P_RESPONSE.SUCCESS_PARTIAL:
+            self.items.extend(response.data)
+        elif response.response_type == P_RESPONSE.SUCCESS_SEQUENCE:
+            self.items.extend(response.data)
+            self._completed = True
+        else:
+            self.error = response.make_error(self.query)
+            return
+
+        rows = len(response.data)
+
+        if self.query.stream is not None:
+            rows += self.query.stream.handed_out
+
+        if response.size and rows:
+            self._batches.append((rows, response.size))
+
+            # Forget the consumed batches
+            received = sum(count for count, _ in self._batches)
+
+            while self._batches and received - self._batches[0][0] >= len(self.items):
+                received -= self._batches.popleft()[0]
+
+    def _observe_drained(self) -> None:
+        """
+        Report the consumed batch to the adaptive batch sizer of the query, if any.
+        """
+
+        if self.query.batch_observer is not None:
+            self.query.batch_observer.drained()
+
+    def _raise_if_exhausted(self) -> None:
+        """
+        Raise the error of the cursor, or `ReqlCursorEmpty` if the server has no more
+        results. Called when there are no received results left to return.
+
+        :raises: ReqlCursorEmpty | ReqlError
+        """
+
+        if self.error is not None:
+            raise self.error
+
+        if self._completed:
+            raise ReqlCursorEmpty()
+
+    def _mark_closed(self) -> bool:
+        """
+        Drop the remaining results and return whether the query has to be stopped on
+        the server.
+        """
+
+        if self.is_completed:
+            return False
+
+        self._completed = True
+        self.items.clear()
+
+        if self.query.stream is not None:
+            self.query.stream.close()
+
+        return bool(self.connection.is_open())
+
+    def _receive(self, response: Response) -> None:
+        """
+        Process a response to the requests of the cursor.
+        """
+
+        if response.is_final:
+            self._outstanding_requests -= 1
+
+        self._extend(response)
+        self._maybe_prefetch()
+
+    def _maybe_fetch_batch(self) -> None:
+        """
+        Request the next batch if there is nothing to return and no batch is being
+        fetched already.
+        """
+
+        if not self.items and not self.is_completed and self._outstanding_requests == 0:
+            self._outstanding_requests += 1
+            self.connection._continue(self)  # pylint: disable=protected-access
+
+    def _maybe_prefetch(self) -> None:
+        """
+        Request the next batch ahead if no more than the low-water mark of the query
+        is left to return, and no batch is being fetched already.
+        """
+
+        low_water_mark = self.query.low_water_mark
+
+        if (
+            low_water_mark is not None
+            and len(self.items) <= low_water_mark
+            and not self.is_completed
+            and self._outstanding_requests == 0
+            and self._has_buffer_room()
+        ):
+            self._outstanding_requests += 1
+            self.connection._continue(self)  # pylint: disable=protected-access
+
+    def _has_buffer_room(self) -> bool:
+        """
+        Return whether the next batch, expected as large as the last one, fits in
+        the budget of the buffered bytes of the query.
+        """
+
+        budget = self.query.max_buffered_bytes
+
+        if budget is None or not self.items:
+            return True
+
+        expected = min(self._batches[-1][1], budget) if self._batches else 0
+        return self.buffered_bytes + expected <= budget
+
+
+class Cursor(BaseCursor):
+    """
+    Cursor of the synchronous connection.
+    """
+
+    def __enter__(self) -> "Cursor":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopIteration from exc
+
+    def next(self, wait: Any = True) -> Any:
+        """
+        Return the next result of the cursor. If `wait` is `False` or a number, a
+        `ReqlTimeoutError` is raised when no result arrived in time.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not self.items:
+            self._observe_drained()
+            self._raise_if_exhausted()
+            self._maybe_fetch_batch()
+
+            # pylint: disable=protected-access
+            self._receive(self.connection._read_response(self.query, deadline))
+
+        item = self.items.popleft()
+        self._maybe_prefetch()
+        return item
+
+    def close(self) -> None:
+        """
+        Stop the query on the server and drop the remaining results.
+        """
+
+        if self._mark_closed():
+            self.connection._stop(self)  # pylint: disable=protected-access
+
+
+class BaseConnection:
+    """
+    Common behaviour of the connections, independent of the transport used to talk to
+    the server.
+    """
+
+    cursor_class: Type[BaseCursor] = BaseCursor
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        db: Optional[str] = None,  # pylint: disable=invalid-name
+        user: str = DEFAULT_USER,
+        password: str = "",
+        timeout: float = DEFAULT_TIMEOUT,
+        ssl: Optional[Dict[str, Any]] = None,  # pylint: disable=redefined-outer-name
+        json_encoder: Type[ReQLEncoder] = DEFAULT_JSON_ENCODER,
+        json_decoder: Type[ReQLDecoder] = DEFAULT_JSON_DECODER,
+        result_cache: Optional[ResultCache] = None,
+        single_flight: Optional[BaseSingleFlight] = None,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+    ) -> None:
+        try:
+            self.port: int = int(port)
+        except ValueError as exc:
+            raise ReqlDriverError(
+                f"Could not convert port {port!r} to an integer."
+            ) from exc
+
+        self.host: str = host
+        self.db: Optional[str] = db  # pylint: disable=invalid-name
+        self.timeout: float = timeout
+        self.ssl: Dict[str, Any] = ssl or {}
+
+        self.json_encoder: Type[ReQLEncoder] = json_encoder
+        self.json_decoder: Type[ReQLDecoder] = json_decoder
+        self.result_cache: Optional[ResultCache] = result_cache
+        self.single_flight: Optional[BaseSingleFlight] = single_flight
+        self.batch_sizer: Optional[AdaptiveBatchSizer] = batch_sizer
+
+        self.handshake = HandshakeV1_0(
+            self.host, self.port, user.encode("utf-8"), password.encode("utf-8")
+        )
+
+        self._tokens: Iterator[int] = itertools.count()
+        self._encoder: ReQLEncoder = self.json_encoder()
+
+    def _make_ssl_context(self) -> Optional[ssl.SSLContext]:
+        """
+        Return the TLS context of the connection, or `None` if TLS is not requested.
+        """
+
+        if not self.ssl:
+            return None
+
+        return ssl.create_default_context(cafile=self.ssl.get("ca_certs"))
+
+    def _new_token(self) -> int:
+        """
+        Return a token which is not used by any other query of the connection.
+        """
+
+        return next(self._tokens)
+
+    def _get_decoder(self, query: Query) -> ReQLDecoder:
+        """
+        Return a decoder respecting the format options of the query.
+        """
+
+        reql_format_opts = {
+            key: value
+            for key, value in (query.global_optargs or {}).items()
+            if key in REQL_FORMAT_OPTS
+        }
+
+        if query.response_format == "lazy":
+            return LazyReQLDecoder(reql_format_opts=reql_format_opts)
+
+        if query.response_format == "raw":
+            return RawResponseDecoder(
+                profile=bool((query.global_optargs or {}).get("profile"))
+            )
+
+        return self.json_decoder(reql_format_opts=reql_format_opts)
+
+    def _make_start_query(
+        self, term: RqlQuery, global_optargs: Dict[str, Any]
+    ) -> Query:
+        """
+        Return the START query of the term, using the default database of the
+        connection unless the query sets its own. The client-only options are
+        removed from the optional arguments sent to the server.
+
+        :raises: ReqlDriverError
+        """
+
+        response_format = global_optargs.pop("response_format", "native")
+        stream_rows = bool(global_optargs.pop("stream_rows", False))
+        low_water_mark = prefetch_to_low_water_mark(
+            global_optargs.pop("prefetch", False)
+        )
+        batch_sizer = global_optargs.pop("batch_sizer", self.batch_sizer)
+        max_buffered_bytes = check_max_buffered_bytes(
+            global_optargs.pop("max_buffered_bytes", None)
+        )
+
+        if response_format not in RESPONSE_FORMATS:
+            raise ReqlDriverError(f'Unknown response_format "{response_format}".')
+
+        if stream_rows and response_format == "raw":
+            raise ReqlDriverError('stream_rows cannot be used with the "raw" format.')
+
+        if "db" in global_optargs or self.db is not None:
+            global_optargs["db"] = DB(global_optargs.get("db", self.db))
+
+        query = Query(
+            P_QUERY.START, self._new_token(), term, global_optargs, response_format
+        )
+
+        if stream_rows:
+            query.stream = ResponseStream(self._get_decoder(query))
+
+        query.low_water_mark = low_water_mark
+
+        if batch_sizer is not None and not stream_rows and response_format != "raw":
+            query.batch_observer = batch_sizer.apply(term, global_optargs)
+
+        if max_buffered_bytes is not None:
+            # A single batch must fit in the budget too
+            global_optargs["max_batch_bytes"] = min(
+                global_optargs.get("max_batch_bytes", max_buffered_bytes),
+                max_buffered_bytes,
+            )
+            query.max_buffered_bytes = max_buffered_bytes
+
+        return query
+
+    @staticmethod
+    def _make_result_key(
+        query: Query,
+        result_cache: Optional[ResultCache],
+        single_flight: Optional[BaseSingleFlight],
+    ) -> Optional[str]:
+        """
+        Return the key of the query result, or `None` if the query bypasses the
+        result cache and the single flight.
+        """
+
+        if result_cache is None and single_flight is None:
+            return None
+
+        return ResultCache.make_key(
+            query.term, query.global_optargs, query.response_format
+        )
+
+    @staticmethod
+    def _snapshot_result(query: Query, result: Any) -> Any:
+        """
+        Return the result of the query to cache or hand out to the other callers, or
+        `MISSING` if the result is a cursor whose sequence is not complete yet. The
+        native results are copied, as the callers may mutate them, while the lazy
+        results are read-only views.
+        """
+
+        if isinstance(result, BaseCursor):
+            # pylint: disable=protected-access
+            if not result._completed or result.error is not None:
+                return MISSING
+
+            result = SequenceResult(list(result.items))
+
+        if query.response_format == "native":
+            return copy.deepcopy(result)
+
+        return result
+
+    def _share_result(self, query: Query, result: Any) -> Any:
+        """
+        Return a snapshot of a result to hand out to a caller, copied like the
+        snapshot. A new cursor is returned over the rows of a sequence.
+        """
+
+        if query.response_format == "native":
+            result = copy.deepcopy(result)
+
+        if isinstance(result, SequenceResult):
+            response = Response.from_document(
+                query.token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": result.rows}
+            )
+            return self.cursor_class(self, query, response)
+
+        return result
+
+    def _lookup_result(
+        self, query: Query, result_cache: Optional[ResultCache], key: Optional[str]
+    ) -> Any:
+        """
+        Return the cached result of the query, or `MISSING` if the result is not
+        cached.
+        """
+
+        if result_cache is None or key is None:
+            return MISSING
+
+        result = result_cache.get(key, MISSING)
+
+        if result is MISSING:
+            return MISSING
+
+        return self._share_result(query, result)
+
+    def _store_result(
+        self,
+        query: Query,
+        result_cache: Optional[ResultCache],
+        key: Optional[str],
+        result: Any,
+    ) -> None:
+        """
+        Cache the result of the query, unless the query bypasses the cache or
+        returned a cursor.
+        """
+
+        if result_cache is None or key is None:
+            return
+
+        result = self._snapshot_result(query, result)
+
+        if result is not MISSING:
+            result_cache.put(key, result)
+
+    def _make_response(self, query: Query, item: Any) -> Response:
+        """
+        Return the response of a received item, which is either the payload of the
+        response, an already decoded response, or the exception of a streamed response
+        which could not be decoded.
+
+        :raises: ReqlDriverError | ValueError
+        """
+
+        if isinstance(item, Response):
+            return item
+
+        if isinstance(item, Exception):
+            raise item
+
+        observer = query.batch_observer
+
+        if observer is None:
+            return Response(query.token, item, self._get_decoder(query))
+
+        started = observer.sizer.clock()
+        response = Response(query.token, item, self._get_decoder(query))
+
+        if response.response_type in (
+            P_RESPONSE.SUCCESS_PARTIAL,
+            P_RESPONSE.SUCCESS_SEQUENCE,
+        ):
+            decode_seconds = observer.sizer.clock() - started
+            observer.received(len(response.data), len(item), decode_seconds)
+
+        return response
+
+    def _process_response(self, query: Query, response: Response) -> Any:
+        """
+        Convert the first response of a query to the value returned to the caller.
+
+        :raises: ReqlError
+        """
+
+        if response.response_type == P_RESPONSE.SUCCESS_ATOM:
+            return maybe_profile(response.data[0], response)
+
+        if response.response_type in (
+            P_RESPONSE.SUCCESS_PARTIAL,
+            P_RESPONSE.SUCCESS_SEQUENCE,
+        ):
+            return maybe_profile(self.cursor_class(self, query, response), response)
+
+        if response.response_type == P_RESPONSE.WAIT_COMPLETE:
+            return None
+
+        if response.response_type == P_RESPONSE.SERVER_INFO:
+            return response.data[0]
+
+        raise response.make_error(query)
+
+    def is_open(self) -> bool:
+        """
+        Return whether the connection is open.
+        """
+
+        raise NotImplementedError()
+
+    def check_open(self) -> None:
+        """
+        Ensure the connection is open.
+
+        :raises: ReqlDriverError
+        """
+
+        if not self.is_open():
+            raise ReqlDriverError("Connection is closed.")
+
+    def use(self, db: str) -> None:  # pylint: disable=invalid-name
+        """
+        Change the default database of the connection.
+        """
+
+        self.db = db
+
+
+# pylint: disable=too-many-instance-attributes
+class Connection(BaseConnection):
+    """
+    Synchronous connection to a RethinkDB server.
+
+    The connection is safe to share between threads. Queries are written to the socket
+    as soon as they are started, so many queries can be in flight at the same time.
+    Responses are read by whichever waiting thread acquires the socket first and handed
+    over to the thread waiting for the token of the response.
+    """
+
+    cursor_class: Type[BaseCursor] = Cursor
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        self._socket: Optional[socket.socket] = None
+
+        self.__buffer: bytearray = bytearray()
+        self.__write_lock: threading.Lock = threading.Lock()
+        self.__read_condition: threading.Condition = threading.Condition()
+        self.__reading: bool = False
+        self.__responses: Dict[int, Any] = {}
+        self.__ignored_responses: Dict[int, int] = {}
+        self.__streams: Dict[int, ResponseStream] = {}
+        self.__streamed_frame: Optional[List[Any]] = None
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(noreply_wait=False)
+
+    def __connect_socket(self, timeout: float) -> socket.socket:
+        """
+        Open the TCP socket, and wrap it with TLS if requested.
+
+        :raises: ReqlTimeoutError | ReqlDriverError
+        """
+
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout)
+        except socket.timeout as exc:
+            raise ReqlTimeoutError(self.host, self.port) from exc
+        except OSError as exc:
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc}"
+            ) from exc
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        if not self.ssl:
+            return sock
+
+        try:
+            context = self._make_ssl_context()
+            return context.wrap_socket(sock, server_hostname=self.host)
+        except (OSError, ssl.SSLError) as exc:
+            sock.close()
+            raise ReqlDriverError(
+                f"SSL handshake failed (see server log for more information): {exc}"
+            ) from exc
+
+    def __read_handshake_message(self, deadline: float) -> bytes:
+        """
+        Read a null-terminated handshake message sent by the server.
+        """
+
+        while True:
+            terminator = self.__buffer.find(b"\0")
+
+            if terminator >= 0:
+                message = bytes(self.__buffer[:terminator])
+                del self.__buffer[: terminator + 1]
+                return message
+
+            self.__receive(deadline)
+
+    def __perform_handshake(self, deadline: float) -> None:
+        """
+        Drive the handshake until the server accepts the authentication.
+        """
+
+        self.handshake.reset()
+        message = self.handshake.next_message(None)
+
+        while not self.handshake.is_completed:
+            if message is not None:
+                self.__send(message)
+
+            message = self.handshake.next_message(
+                self.__read_handshake_message(deadline)
+            )
+
+    def __receive(self, deadline: Optional[float]) -> None:
+        """
+        Read the next chunk of data from the socket into the buffer.
+
+        :raises: ReqlTimeoutError | ReqlDriverError
+        """
+
+        sock = self._socket
+
+        if sock is None:
+            raise ReqlDriverError("Connection is closed.")
+
+        has_pending = isinstance(sock, ssl.SSLSocket) and sock.pending() > 0
+
+        if deadline is not None and not has_pending:
+            timeout = max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([sock], [], [], timeout)
+
+            if not readable:
+                raise ReqlTimeoutError()
+
+        try:
+            chunk = sock.recv(READ_CHUNK_SIZE)
+        except OSError as exc:
+            self.__close_socket()
+            raise ReqlDriverError(
+                f"Connection interrupted receiving from {self.host}:{self.port} - {exc}"
+            ) from exc
+
+        if not chunk:
+            self.__close_socket()
+            raise ReqlDriverError("Connection is closed.")
+
+        self.__buffer.extend(chunk)
+
+    def __send(self, data: bytes) -> None:
+        """
+        Write the data to the socket.
+
+        :raises: ReqlDriverError
+        """
+
+        with self.__write_lock:
+            if self._socket is None:
+                raise ReqlDriverError("Connection is closed.")
+
+            try:
+                self._socket.sendall(data)
+            except OSError as exc:
+                self.__close_socket()
+                raise ReqlDriverError(
+                    f"Connection interrupted sending to {self.host}:{self.port} - {exc}"
+                ) from exc
+
+    def __read_streamed_frame(self, deadline: Optional[float]) -> Tuple[int, Any]:
+        """
+        Feed the received bytes of the streamed frame to its stream until the frame is
+        complete or new results are available. The progress is kept in the
+        connection, so any thread can continue reading the frame.
+        """
+
+        frame = self.__streamed_frame
+        token, remaining, stream = frame
+
+        while True:
+            if remaining and self.__buffer:
+                size = min(remaining, len(self.__buffer))
+                data = bytes(self.__buffer[:size])
+                del self.__buffer[:size]
+
+                remaining -= size
+                frame[1] = remaining
+                event = stream_event(token, stream, data)
+
+                if event is not None and remaining:
+                    return token, event
+
+            if not remaining:
+                self.__streamed_frame = None
+                return token, stream_result(token, stream)
+
+            self.__receive(deadline)
+
+    def __read_frame(self, deadline: Optional[float]) -> Tuple[int, Any]:
+        """
+        Read the next response frame from the socket. Incomplete frames are kept in
+        the buffer, so a timeout does not corrupt the stream.
+
+        The frames of the streamed queries are decoded as they arrive, and the read
+        returns early whenever new results of the frame are available.
+        """
+
+        while self.__streamed_frame is None:
+            if len(self.__buffer) >= FRAME_HEADER.size:
+                token, length = FRAME_HEADER.unpack_from(self.__buffer)
+                end = FRAME_HEADER.size + length
+                stream = self.__streams.pop(token, None)
+
+                if stream is not None:
+                    del self.__buffer[: FRAME_HEADER.size]
+                    self.__streamed_frame = [token, length, stream]
+                    break
+
+                if len(self.__buffer) >= end:
+                    payload = bytes(self.__buffer[FRAME_HEADER.size : end])
+                    del self.__buffer[:end]
+                    return token, payload
+
+            self.__receive(deadline)
+
+        return self.__read_streamed_frame(deadline)
+
+    def __dispatch(self, token: int, item: Any) -> None:
+        """
+        Store the response for the thread waiting on its token, unless nobody is
+        interested in the response anymore.
+        """
+
+        ignored = self.__ignored_responses.get(token)
+
+        if not is_final_result(item):
+            if ignored is None:
+                self.__responses.setdefault(token, item)
+        elif ignored is None:
+            self.__responses[token] = item
+        elif ignored > 1:
+            self.__ignored_responses[token] = ignored - 1
+        else:
+            del self.__ignored_responses[token]
+
+    def __wait_for(self, token: int, deadline: Optional[float]) -> Any:
+        """
+        Wait for the response of the given token. If no other thread is reading the
+        socket, the current thread reads frames until its own response arrives, storing
+        the responses of other tokens for their threads.
+
+        :raises: ReqlTimeoutError | ReqlDriverError
+        """
+
+        with self.__read_condition:
+            while token not in self.__responses:
+                self.check_open()
+
+                if self.__reading:
+                    timeout = None
+
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+
+                        if timeout <= 0:
+                            raise ReqlTimeoutError()
+
+                    self.__read_condition.wait(timeout)
+                    continue
+
+                self.__reading = True
+                self.__read_condition.release()
+
+                try:
+                    frame_token, item = self.__read_frame(deadline)
+                finally:
+                    self.__read_condition.acquire()
+                    self.__reading = False
+                    self.__read_condition.notify_all()
+
+                self.__dispatch(frame_token, item)
+
+            return self.__responses.pop(token)
+
+    def __close_socket(self) -> None:
+        """
+        Close the socket and wake up every thread waiting for a response.
+        """
+
+        sock, self._socket = self._socket, None
+
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            finally:
+                sock.close()
+
+        with self.__read_condition:
+            self.__read_condition.notify_all()
+
+    def _send_query(self, query: Query) -> None:
+        """
+        Serialize the query and write it to the socket.
+        """
+
+        self.__send(query.serialize(self._encoder))
+
+    def _read_response(
+        self, query: Query, deadline: Optional[float] = None
+    ) -> Response:
+        """
+        Wait for the next response of the query.
+
+        :raises: ReqlTimeoutError | ReqlDriverError
+        """
+
+        return self._make_response(query, self.__wait_for(query.token, deadline))
+
+    def _ignore_responses(self, token: int, count: int) -> None:
+        """
+        Drop the given number of upcoming responses of the token.
+        """
+
+        with self.__read_condition:
+            self.__streams.pop(token, None)
+
+            if is_final_result(self.__responses.pop(token, None)):
+                count -= 1
+
+            if count > 0:
+                self.__ignored_responses[token] = count
+
+    def _run_query(self, query: Query, noreply: bool = False) -> Any:
+        """
+        Send the query to the server and return its result.
+        """
+
+        self._send_query(query)
+
+        if noreply:
+            return None
+
+        return self._process_response(query, self._read_response(query))
+
+    def _start(self, term: RqlQuery, **global_optargs: Any) -> Any:
+        """
+        Start the query on the server. This is the entrypoint of `RqlQuery.run`.
+        """
+
+        self.check_open()
+
+        result_cache = global_optargs.pop("result_cache", self.result_cache)
+        single_flight = global_optargs.pop("single_flight", self.single_flight)
+        query = self._make_start_query(term, global_optargs)
+        key = self._make_result_key(query, result_cache, single_flight)
+        result = self._lookup_result(query, result_cache, key)
+
+        if result is not MISSING:
+            return result
+
+        if single_flight is None or key is None:
+            return self.__run_start(query, result_cache, key)
+
+        return self.__run_coalesced(query, result_cache, single_flight, key)
+
+    def __run_start(
+        self, query: Query, result_cache: Optional[ResultCache], key: Optional[str]
+    ) -> Any:
+        """
+        Run the START query, and cache its result.
+        """
+
+        self._register_stream(query)
+        noreply = bool(query.global_optargs.get("noreply", False))
+        result = self._run_query(query, noreply)
+        self._store_result(query, result_cache, key, result)
+        return result
+
+    def __run_coalesced(
+        self,
+        query: Query,
+        result_cache: Optional[ResultCache],
+        single_flight: BaseSingleFlight,
+        key: str,
+    ) -> Any:
+        """
+        Run the START query as the leader of its flight, or wait for the result of
+        the identical query already in flight.
+        """
+
+        flight, leader = single_flight.join(key)
+
+        if not leader:
+            result = flight.wait()
+
+            if result is MISSING:
+                return self.__run_start(query, result_cache, key)
+
+            return self._share_result(query, result)
+
+        try:
+            result = self.__run_start(query, result_cache, key)
+        except Exception as exc:
+            single_flight.land(key, flight, error=exc)
+            raise
+        except BaseException:
+            single_flight.land(key, flight)
+            raise
+
+        single_flight.land(key, flight, self._snapshot_result(query, result))
+        return result
+
+    def _register_stream(self, query: Query) -> None:
+        """
+        Decode the next response of the query incrementally, if the query is streamed.
+        """
+
+        if query.stream is not None:
+            with self.__read_condition:
+                query.stream.reset()
+                self.__streams[query.token] = query.stream
+
+    def _continue(self, cursor: Cursor) -> None:
+        """
+        Request the next batch of the cursor without waiting for the response.
+        """
+
+        self.check_open()
+        self._register_stream(cursor.query)
+        self._send_query(Query(P_QUERY.CONTINUE, cursor.query.token))
+
+    def _stop(self, cursor: Cursor) -> None:
+        """
+        Stop the query of the cursor and ignore its remaining responses.
+        """
+
+        self.check_open()
+
+        # pylint: disable=protected-access
+        self._ignore_responses(cursor.query.token, cursor._outstanding_requests + 1)
+        self._send_query(Query(P_QUERY.STOP, cursor.query.token))
+
+    def is_open(self) -> bool:
+        """
+        Return whether the connection is open.
+        """
+
+        return self._socket is not None
+
+    def reconnect(
+        self, noreply_wait: bool = True, timeout: Optional[float] = None
+    ) -> "Connection":
+        """
+        Close the connection if it is open and establish a new one.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        self.close(noreply_wait)
+
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+
+        self._socket = self.__connect_socket(timeout)
+        self._tokens = itertools.count()
+
+        try:
+            self.__perform_handshake(deadline)
+        except (ReqlAuthError, ReqlTimeoutError):
+            self.__close_socket()
+            raise
+        except ReqlDriverError as exc:
+            self.__close_socket()
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc.message}"
+            ) from exc
+        except ValueError as exc:
+            self.__close_socket()
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc}"
+            ) from exc
+
+        # The timeout bounds the connection only; the reads wait for their own
+        # deadlines, or without a time limit
+        self._socket.settimeout(None)
+
+        return self
+
+    def close(self, noreply_wait: bool = True) -> None:
+        """
+        Close the connection. If `noreply_wait` is set, wait for the queries started
+        with `noreply` to be processed by the server before closing.
+        """
+
+        if not self.is_open():
+            return
+
+        try:
+            if noreply_wait:
+                self.noreply_wait()
+        finally:
+            self.__close_socket()
+            self.__buffer.clear()
+
+            with self.__read_condition:
+                self.__responses.clear()
+                self.__ignored_responses.clear()
+                self.__streams.clear()
+                self.__streamed_frame = None
+
+    def noreply_wait(self) -> None:
+        """
+        Wait for the queries started with `noreply` to be processed by the server.
+        """
+
+        self.check_open()
+        self._run_query(Query(P_QUERY.NOREPLY_WAIT, self._new_token()))
+
+    def server(self) -> Dict[str, Any]:
+        """
+        Return information about the server the connection is established to.
+        """
+
+        self.check_open()
+        return self._run_query(Query(P_QUERY.SERVER_INFO, self._new_token()))
+
+
+# pylint: disable=too-many-arguments
+def connect(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    db: Optional[str] = None,  # pylint: disable=invalid-name
+    user: str = DEFAULT_USER,
+    password: str = "",
+    timeout: float = DEFAULT_TIMEOUT,
+    ssl: Optional[Dict[str, Any]] = None,  # pylint: disable=redefined-outer-name
+    **kwargs: Any,
+) -> Connection:
+    """
+    Create a new connection to the database server.
+
+    :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+    """
+
+    connection = Connection(host, port, db, user, password, timeout, ssl, **kwargs)
+    return connection.reconnect(timeout=timeout)
@@ -0,0 +1,582 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This file incorporates work covered by the following copyright:
+# Copyright 2010-2016 RethinkDB, all rights reserved.
+
+"""
+The net_asyncio module contains the asyncio based connection and cursor implementation.
+
+A single reader task per connection reads the response frames from the socket and
+resolves the future of the query identified by the token of the frame, so any number
+of tasks can run queries concurrently over the same socket.
+"""
+
+__all__ = ["AsyncioConnection", "AsyncioCursor", "connect"]
+
+import asyncio
+import itertools
+import socket
+import ssl
+from typing import Any, Dict, Optional, Type
+
+from rethinkdb.ast import RqlQuery
+from rethinkdb.cache import MISSING, BaseSingleFlight, ResultCache
+from rethinkdb.errors import (
+    ReqlAuthError,
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlTimeoutError,
+)
+from rethinkdb.net import (
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    DEFAULT_TIMEOUT,
+    DEFAULT_USER,
+    FRAME_HEADER,
+    P_QUERY,
+    READ_CHUNK_SIZE,
+    BaseConnection,
+    BaseCursor,
+    Query,
+    Response,
+    is_final_result,
+    stream_event,
+    stream_result,
+    wait_to_timeout,
+)
+from rethinkdb.streaming import ResponseStream
+
+
+class AsyncioCursor(BaseCursor):
+    """
+    Cursor of the asyncio connection, supporting `async for`.
+    """
+
+    async def __aenter__(self) -> "AsyncioCursor":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def __aiter__(self) -> "AsyncioCursor":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self.next()
+        except ReqlCursorEmpty as exc:
+            raise StopAsyncIteration from exc
+
+    async def next(self, wait: Any = True) -> Any:
+        """
+        Return the next result of the cursor. If `wait` is `False` or a number, a
+        `ReqlTimeoutError` is raised when no result arrived in time.
+
+        :raises: ReqlCursorEmpty | ReqlTimeoutError | ReqlError
+        """
+
+        timeout = wait_to_timeout(wait)
+
+        while not self.items:
+            self._observe_drained()
+            self._raise_if_exhausted()
+            self._maybe_fetch_batch()
+
+            # pylint: disable=protected-access
+            self._receive(await self.connection._read_response(self.query, timeout))
+
+        item = self.items.popleft()
+        self._maybe_prefetch()
+        return item
+
+    async def close(self) -> None:
+        """
+        Stop the query on the server and drop the remaining results.
+        """
+
+        if self._mark_closed():
+            self.connection._stop(self)  # pylint: disable=protected-access
+
+
+# pylint: disable=too-many-instance-attributes
+class AsyncioConnection(BaseConnection):
+    """
+    Asyncio connection to a RethinkDB server.
+
+    Queries are written to the socket as soon as they are started. The responses are
+    read by one reader task, which hands them over to the futures waiting for the
+    tokens of the responses.
+    """
+
+    cursor_class: Type[BaseCursor] = AsyncioCursor
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+        self.__reader_task: Optional["asyncio.Task[None]"] = None
+        self.__drain_lock: Optional[asyncio.Lock] = None
+        self.__waiters: Dict[int, "asyncio.Future[Any]"] = {}
+        self.__responses: Dict[int, Any] = {}
+        self.__ignored_responses: Dict[int, int] = {}
+        self.__streams: Dict[int, ResponseStream] = {}
+
+    async def __aenter__(self) -> "AsyncioConnection":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close(noreply_wait=False)
+
+    async def __open_streams(self) -> None:
+        """
+        Open the TCP connection, and wrap it with TLS if requested.
+
+        :raises: ReqlDriverError
+        """
+
+        try:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self._make_ssl_context()
+            )
+        except ssl.SSLError as exc:
+            raise ReqlDriverError(
+                f"SSL handshake failed (see server log for more information): {exc}"
+            ) from exc
+        except OSError as exc:
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc}"
+            ) from exc
+
+        sock = self._writer.get_extra_info("socket")
+
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    async def __perform_handshake(self) -> None:
+        """
+        Drive the handshake until the server accepts the authentication.
+        """
+
+        self.handshake.reset()
+        message = self.handshake.next_message(None)
+
+        while not self.handshake.is_completed:
+            if message is not None:
+                self._writer.write(message)
+
+            try:
+                response = await self._reader.readuntil(b"\0")
+            except asyncio.IncompleteReadError as exc:
+                raise ReqlDriverError("Connection is closed.") from exc
+
+            message = self.handshake.next_message(response[:-1])
+
+    async def __read_loop(self) -> None:
+        """
+        Read the response frames until the connection is closed, and hand them over
+        to the waiting futures.
+        """
+
+        reader = self._reader
+
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                token, length = FRAME_HEADER.unpack(header)
+                stream = self.__streams.pop(token, None)
+
+                if stream is None:
+                    self.__dispatch(token, await reader.readexactly(length))
+                else:
+                    await self.__read_streamed_frame(reader, token, length, stream)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            self.__close_streams()
+
+    async def __read_streamed_frame(
+        self,
+        reader: asyncio.StreamReader,
+        token: int,
+        length: int,
+        stream: ResponseStream,
+    ) -> None:
+        """
+        Feed the frame to its stream as it arrives, waking up the waiting task
+        whenever new results are available.
+        """
+
+        remaining = length
+
+        while remaining:
+            data = await reader.read(min(remaining, READ_CHUNK_SIZE))
+
+            if not data:
+                raise asyncio.IncompleteReadError(data, remaining)
+
+            remaining -= len(data)
+            event = stream_event(token, stream, data)
+
+            if event is not None and remaining:
+                self.__dispatch(token, event)
+
+        self.__dispatch(token, stream_result(token, stream))
+
+    def __dispatch(self, token: int, item: Any) -> None:
+        """
+        Resolve the future waiting for the response, or store the response until
+        somebody waits for it, unless nobody is interested in the response anymore.
+        """
+
+        ignored = self.__ignored_responses.get(token)
+
+        if not is_final_result(item):
+            if ignored is None:
+                self.__notify(token, item)
+
+            return
+
+        if ignored is not None:
+            if ignored > 1:
+                self.__ignored_responses[token] = ignored - 1
+            else:
+                del self.__ignored_responses[token]
+
+            return
+
+        waiter = self.__waiters.pop(token, None)
+
+        if waiter is not None and not waiter.done():
+            waiter.set_result(item)
+        else:
+            self.__responses[token] = item
+
+    def __notify(self, token: int, event: Response) -> None:
+        """
+        Wake up the task waiting for the results of a streamed response.
+        """
+
+        waiter = self.__waiters.pop(token, None)
+
+        if waiter is not None and not waiter.done():
+            waiter.set_result(event)
+        else:
+            self.__responses.setdefault(token, event)
+
+    def __close_streams(self) -> None:
+        """
+        Close the streams and fail every future waiting for a response.
+        """
+
+        writer, self._writer = self._writer, None
+        self._reader = None
+
+        if writer is not None:
+            writer.close()
+
+        waiters, self.__waiters = self.__waiters, {}
+
+        for waiter in waiters.values():
+            if not waiter.done():
+                waiter.set_exception(ReqlDriverError("Connection is closed."))
+
+        self.__responses.clear()
+        self.__ignored_responses.clear()
+        self.__streams.clear()
+
+    def _send_query(self, query: Query) -> None:
+        """
+        Serialize the query and write it to the socket without waiting for the
+        buffer to be flushed.
+
+        :raises: ReqlDriverError
+        """
+
+        self.check_open()
+        self._writer.write(query.serialize(self._encoder))
+
+    async def _drain(self) -> None:
+        """
+        Wait until the write buffer of the socket is flushed.
+
+        :raises: ReqlDriverError
+        """
+
+        try:
+            async with self.__drain_lock:
+                await self._writer.drain()
+        except (AttributeError, OSError) as exc:
+            raise ReqlDriverError("Connection is closed.") from exc
+
+    async def _read_response(
+        self, query: Query, timeout: Optional[float] = None
+    ) -> Response:
+        """
+        Wait for the next response of the query.
+
+        :raises: ReqlTimeoutError | ReqlDriverError
+        """
+
+        item = self.__responses.pop(query.token, None)
+
+        if item is None:
+            self.check_open()
+
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters[query.token] = waiter
+
+            try:
+                item = await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError as exc:
+                raise ReqlTimeoutError() from exc
+            finally:
+                if self.__waiters.get(query.token) is waiter:
+                    del self.__waiters[query.token]
+
+        return self._make_response(query, item)
+
+    def _ignore_responses(self, token: int, count: int) -> None:
+        """
+        Drop the given number of upcoming responses of the token.
+        """
+
+        self.__streams.pop(token, None)
+
+        if is_final_result(self.__responses.pop(token, None)):
+            count -= 1
+
+        if count > 0:
+            self.__ignored_responses[token] = count
+
+    async def _run_query(self, query: Query, noreply: bool = False) -> Any:
+        """
+        Send the query to the server and return its result.
+        """
+
+        self._send_query(query)
+        await self._drain()
+
+        if noreply:
+            return None
+
+        return self._process_response(query, await self._read_response(query))
+
+    async def _start(self, term: RqlQuery, **global_optargs: Any) -> Any:
+        """
+        Start the query on the server. This is the entrypoint of `RqlQuery.run`.
+        """
+
+        self.check_open()
+
+        result_cache = global_optargs.pop("result_cache", self.result_cache)
+        single_flight = global_optargs.pop("single_flight", self.single_flight)
+        query = self._make_start_query(term, global_optargs)
+        key = self._make_result_key(query, result_cache, single_flight)
+        result = self._lookup_result(query, result_cache, key)
+
+        if result is not MISSING:
+            return result
+
+        if single_flight is None or key is None:
+            return await self.__run_start(query, result_cache, key)
+
+        return await self.__run_coalesced(query, result_cache, single_flight, key)
+
+    async def __run_start(
+        self, query: Query, result_cache: Optional[ResultCache], key: Optional[str]
+    ) -> Any:
+        """
+        Run the START query, and cache its result.
+        """
+
+        self._register_stream(query)
+        noreply = bool(query.global_optargs.get("noreply", False))
+        result = await self._run_query(query, noreply)
+        self._store_result(query, result_cache, key, result)
+        return result
+
+    async def __run_coalesced(
+        self,
+        query: Query,
+        result_cache: Optional[ResultCache],
+        single_flight: BaseSingleFlight,
+        key: str,
+    ) -> Any:
+        """
+        Run the START query as the leader of its flight, or wait for the result of
+        the identical query already in flight.
+        """
+
+        flight, leader = single_flight.join(key)
+
+        if not leader:
+            result = await asyncio.shield(flight)
+
+            if result is MISSING:
+                return await self.__run_start(query, result_cache, key)
+
+            return self._share_result(query, result)
+
+        try:
+            result = await self.__run_start(query, result_cache, key)
+        except Exception as exc:
+            single_flight.land(key, flight, error=exc)
+            raise
+        except BaseException:
+            single_flight.land(key, flight)
+            raise
+
+        single_flight.land(key, flight, self._snapshot_result(query, result))
+        return result
+
+    def _register_stream(self, query: Query) -> None:
+        """
+        Decode the next response of the query incrementally, if the query is streamed.
+        """
+
+        if query.stream is not None:
+            query.stream.reset()
+            self.__streams[query.token] = query.stream
+
+    def _continue(self, cursor: BaseCursor) -> None:
+        """
+        Request the next batch of the cursor without waiting for the response.
+        """
+
+        self._register_stream(cursor.query)
+        self._send_query(Query(P_QUERY.CONTINUE, cursor.query.token))
+
+    def _stop(self, cursor: BaseCursor) -> None:
+        """
+        Stop the query of the cursor and ignore its remaining responses.
+        """
+
+        self.check_open()
+
+        # pylint: disable=protected-access
+        self._ignore_responses(cursor.query.token, cursor._outstanding_requests + 1)
+        self._send_query(Query(P_QUERY.STOP, cursor.query.token))
+
+    def is_open(self) -> bool:
+        """
+        Return whether the connection is open.
+        """
+
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def reconnect(
+        self, noreply_wait: bool = True, timeout: Optional[float] = None
+    ) -> "AsyncioConnection":
+        """
+        Close the connection if it is open and establish a new one.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        await self.close(noreply_wait)
+
+        timeout = timeout or self.timeout
+
+        try:
+            await asyncio.wait_for(self.__open_streams(), timeout)
+            await asyncio.wait_for(self.__perform_handshake(), timeout)
+        except asyncio.TimeoutError as exc:
+            self.__close_streams()
+            raise ReqlTimeoutError(self.host, self.port) from exc
+        except ReqlAuthError:
+            self.__close_streams()
+            raise
+        except ReqlDriverError as exc:
+            self.__close_streams()
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc.message}"
+            ) from exc
+        except ValueError as exc:
+            self.__close_streams()
+            raise ReqlDriverError(
+                f"Could not connect to {self.host}:{self.port}. Error: {exc}"
+            ) from exc
+
+        self._tokens = itertools.count()
+        self.__drain_lock = asyncio.Lock()
+        self.__reader_task = asyncio.get_running_loop().create_task(self.__read_loop())
+
+        return self
+
+    async def close(self, noreply_wait: bool = True) -> None:
+        """
+        Close the connection. If `noreply_wait` is set, wait for the queries started
+        with `noreply` to be processed by the server before closing.
+        """
+
+        if not self.is_open():
+            return
+
+        try:
+            if noreply_wait:
+                await self.noreply_wait()
+        finally:
+            reader_task, self.__reader_task = self.__reader_task, None
+            self.__close_streams()
+
+            if reader_task is not None:
+                reader_task.cancel()
+
+                try:
+                    await reader_task
+                except asyncio.CancelledError:
+                    pass
+
+    async def noreply_wait(self) -> None:
+        """
+        Wait for the queries started with `noreply` to be processed by the server.
+        """
+
+        self.check_open()
+        await self._run_query(Query(P_QUERY.NOREPLY_WAIT, self._new_token()))
+
+    async def server(self) -> Dict[str, Any]:
+        """
+        Return information about the server the connection is established to.
+        """
+
+        self.check_open()
+        return await self._run_query(Query(P_QUERY.SERVER_INFO, self._new_token()))
+
+
+# pylint: disable=too-many-arguments
+async def connect(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    db: Optional[str] = None,  # pylint: disable=invalid-name
+    user: str = DEFAULT_USER,
+    password: str = "",
+    timeout: float = DEFAULT_TIMEOUT,
+    ssl: Optional[Dict[str, Any]] = None,  # pylint: disable=redefined-outer-name
+    **kwargs: Any,
+) -> AsyncioConnection:
+    """
+    Create a new asyncio connection to the database server.
+
+    :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+    """
+
+    connection = AsyncioConnection(
+        host, port, db, user, password, timeout, ssl, **kwargs
+    )
+    return await connection.reconnect(timeout=timeout)
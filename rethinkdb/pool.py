@@ -0,0 +1,572 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This file incorporates work covered by the following copyright:
+# Copyright 2010-2016 RethinkDB, all rights reserved.
+
+"""
+The pool module contains connection pools, which keep authenticated connections to a
+server open and hand them out to the queries, so the handshake is paid only once per
+connection instead of once per query.
+
+The pools can be passed to `RqlQuery.run` in place of a connection. The connection
+running a query is checked out of the pool until the query is answered, or until its
+cursor is completed or closed.
+"""
+
+__all__ = ["AsyncioConnectionPool", "ConnectionPool"]
+
+import asyncio
+from collections import deque
+import contextlib
+import select
+import socket
+import ssl
+import threading
+import time
+from typing import Any, AsyncIterator, Deque, Iterator, List, Optional, Tuple, Type
+
+from rethinkdb.ast import RqlQuery
+from rethinkdb.errors import ReqlDriverError, ReqlTimeoutError
+from rethinkdb.net import BaseConnection, BaseCursor, Connection, Cursor
+from rethinkdb.net_asyncio import AsyncioConnection, AsyncioCursor
+
+DEFAULT_MIN_SIZE: int = 0
+DEFAULT_MAX_SIZE: int = 10
+DEFAULT_MAX_IDLE_TIME: float = 300
+
+
+def unwrap_cursor(result: Any) -> Optional[BaseCursor]:
+    """
+    Return the cursor of a query result, which may be wrapped together with the
+    profile of the query.
+    """
+
+    if isinstance(result, dict) and "profile" in result:
+        result = result.get("value")
+
+    return result if isinstance(result, BaseCursor) else None
+
+
+class PooledCursor(Cursor):
+    """
+    Cursor which returns its connection to the pool once it is completed or closed.
+    """
+
+    pool: Optional["ConnectionPool"] = None
+
+    def _release(self) -> None:
+        pool, self.pool = self.pool, None
+
+        if pool is not None:
+            pool.release(self.connection)
+
+    def next(self, wait: Any = True) -> Any:
+        try:
+            return super().next(wait)
+        finally:
+            if self.is_completed:
+                self._release()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._release()
+
+
+class PooledAsyncioCursor(AsyncioCursor):
+    """
+    Asyncio cursor which returns its connection to the pool once it is completed or
+    closed.
+    """
+
+    pool: Optional["AsyncioConnectionPool"] = None
+
+    async def _release(self) -> None:
+        pool, self.pool = self.pool, None
+
+        if pool is not None:
+            await pool.release(self.connection)
+
+    async def next(self, wait: Any = True) -> Any:
+        try:
+            return await super().next(wait)
+        finally:
+            if self.is_completed:
+                await self._release()
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            await self._release()
+
+
+class BasePool:
+    """
+    Common configuration and bookkeeping of the connection pools.
+    """
+
+    connection_class: Type[BaseConnection] = BaseConnection
+    cursor_class: Type[BaseCursor] = BaseCursor
+
+    def __init__(
+        self,
+        min_size: int = DEFAULT_MIN_SIZE,
+        max_size: int = DEFAULT_MAX_SIZE,
+        checkout_timeout: Optional[float] = None,
+        max_idle_time: Optional[float] = DEFAULT_MAX_IDLE_TIME,
+        **connection_kwargs: Any,
+    ) -> None:
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ReqlDriverError(
+                f"Invalid pool size: min_size={min_size}, max_size={max_size}"
+            )
+
+        self.min_size: int = min_size
+        self.max_size: int = max_size
+        self.checkout_timeout: Optional[float] = checkout_timeout
+        self.max_idle_time: Optional[float] = max_idle_time
+        self.connection_kwargs = connection_kwargs
+
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._size: int = 0
+        self._closed: bool = False
+
+    @property
+    def size(self) -> int:
+        """
+        Return the number of open connections, including the checked out ones.
+        """
+
+        return self._size
+
+    @property
+    def idle_size(self) -> int:
+        """
+        Return the number of connections waiting in the pool.
+        """
+
+        return len(self._idle)
+
+    def _new_connection(self) -> Any:
+        """
+        Return a new, not yet connected connection handing out pooled cursors.
+        """
+
+        connection = self.connection_class(**self.connection_kwargs)
+        connection.cursor_class = self.cursor_class
+        return connection
+
+    def _pop_expired(self) -> Iterator[Any]:
+        """
+        Remove and yield the connections which were idle for too long, keeping at
+        least `min_size` connections open. The least recently used connections are
+        at the left of the idle queue.
+        """
+
+        if self.max_idle_time is None:
+            return
+
+        expiry = time.monotonic() - self.max_idle_time
+
+        while self._idle and self._size > self.min_size and self._idle[0][1] < expiry:
+            connection, _ = self._idle.popleft()
+            self._size -= 1
+            yield connection
+
+    def _push_idle(self, connection: Any) -> bool:
+        """
+        Put the connection back to the idle queue, and return whether it was accepted.
+        """
+
+        if self._closed or not connection.is_open():
+            self._size -= 1
+            return False
+
+        self._idle.append((connection, time.monotonic()))
+        return True
+
+    def _is_alive(self, connection: Any) -> bool:
+        """
+        Return whether the idle connection can still be used.
+        """
+
+        return bool(connection.is_open())
+
+    def _pop_idle(self, stale: List[Any]) -> Optional[Any]:
+        """
+        Remove and return the most recently used idle connection which is still
+        alive. The dead connections found on the way are added to `stale`.
+        """
+
+        while self._idle:
+            connection, _ = self._idle.pop()
+
+            if self._is_alive(connection):
+                return connection
+
+            self._size -= 1
+            stale.append(connection)
+
+        return None
+
+
+def is_alive(connection: Connection) -> bool:
+    """
+    Check without blocking whether the server closed the socket of the connection.
+    Idle connections have no queries in flight, so a readable socket returning no data
+    means the peer is gone.
+    """
+
+    sock = connection._socket  # pylint: disable=protected-access
+
+    if sock is None:
+        return False
+
+    # Peeking is not supported on TLS sockets, where a closed socket is detected on
+    # the first read instead.
+    if isinstance(sock, ssl.SSLSocket):
+        return True
+
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+
+        if readable and not sock.recv(1, socket.MSG_PEEK):
+            return False
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+class ConnectionPool(BasePool):
+    """
+    Thread-safe pool of synchronous connections.
+    """
+
+    connection_class: Type[BaseConnection] = Connection
+    cursor_class: Type[BaseCursor] = PooledCursor
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        self.__condition: threading.Condition = threading.Condition()
+
+    def _is_alive(self, connection: Any) -> bool:
+        return is_alive(connection)
+
+    def __enter__(self) -> "ConnectionPool":
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def open(self) -> "ConnectionPool":
+        """
+        Open connections until the pool has at least `min_size` of them.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        connections = [self.acquire() for _ in range(self.min_size - self._size)]
+
+        for connection in connections:
+            self.release(connection)
+
+        return self
+
+    def acquire(self, timeout: Optional[float] = None) -> Connection:
+        """
+        Check out an open connection, connecting a new one if all connections are in
+        use and the pool is not full. If the pool is full, wait at most `timeout`
+        seconds for a connection to be released.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        expired: List[Any] = []
+
+        with self.__condition:
+            while True:
+                if self._closed:
+                    raise ReqlDriverError("Connection pool is closed.")
+
+                expired.extend(self._pop_expired())
+                connection = self._pop_idle(expired)
+
+                if connection is not None or self._size < self.max_size:
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    raise ReqlTimeoutError()
+
+                self.__condition.wait(remaining)
+
+            if connection is None:
+                self._size += 1
+
+        for stale in expired:
+            stale.close(noreply_wait=False)
+
+        if connection is not None:
+            return connection
+
+        try:
+            connection = self._new_connection()
+            return connection.reconnect()
+        except BaseException:
+            with self.__condition:
+                self._size -= 1
+                self.__condition.notify()
+
+            raise
+
+    def release(self, connection: Connection) -> None:
+        """
+        Return a checked out connection to the pool.
+        """
+
+        with self.__condition:
+            accepted = self._push_idle(connection)
+            self.__condition.notify()
+
+        if not accepted:
+            connection.close(noreply_wait=False)
+
+    @contextlib.contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Connection]:
+        """
+        Check out a connection for the duration of the `with` block.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        connection = self.acquire(timeout)
+
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """
+        Close the idle connections and refuse further checkouts. The checked out
+        connections are closed when they are released.
+        """
+
+        with self.__condition:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self.__condition.notify_all()
+
+        for connection, _ in idle:
+            connection.close(noreply_wait=False)
+
+    def _start(self, term: RqlQuery, **global_optargs: Any) -> Any:
+        """
+        Run the query on a checked out connection. This is the entrypoint of
+        `RqlQuery.run`.
+        """
+
+        connection = self.acquire(self.checkout_timeout)
+
+        try:
+            # pylint: disable=protected-access
+            result = connection._start(term, **global_optargs)
+        except BaseException:
+            self.release(connection)
+            raise
+
+        cursor = unwrap_cursor(result)
+
+        if cursor is not None and not cursor.is_completed:
+            cursor.pool = self
+        else:
+            self.release(connection)
+
+        return result
+
+
+class AsyncioConnectionPool(BasePool):
+    """
+    Pool of asyncio connections. The pool must be used from one event loop.
+    """
+
+    connection_class: Type[BaseConnection] = AsyncioConnection
+    cursor_class: Type[BaseCursor] = PooledAsyncioCursor
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        # Created on first use, so the condition is bound to the running event loop
+        self.__condition: Optional[asyncio.Condition] = None
+
+    async def __aenter__(self) -> "AsyncioConnectionPool":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+
+        return self.__condition
+
+    async def open(self) -> "AsyncioConnectionPool":
+        """
+        Open connections until the pool has at least `min_size` of them.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        connections = [await self.acquire() for _ in range(self.min_size - self._size)]
+
+        for connection in connections:
+            await self.release(connection)
+
+        return self
+
+    async def __wait_for_connection(
+        self,
+    ) -> Tuple[Optional[AsyncioConnection], List[Any]]:
+        """
+        Wait until an idle connection is available or a new one may be opened.
+        """
+
+        expired: List[Any] = []
+
+        async with self._condition:
+            while True:
+                if self._closed:
+                    raise ReqlDriverError("Connection pool is closed.")
+
+                expired.extend(self._pop_expired())
+                connection = self._pop_idle(expired)
+
+                if connection is not None:
+                    return connection, expired
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, expired
+
+                await self._condition.wait()
+
+    async def acquire(self, timeout: Optional[float] = None) -> AsyncioConnection:
+        """
+        Check out an open connection, connecting a new one if all connections are in
+        use and the pool is not full. If the pool is full, wait at most `timeout`
+        seconds for a connection to be released.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        try:
+            connection, expired = await asyncio.wait_for(
+                self.__wait_for_connection(), timeout
+            )
+        except asyncio.TimeoutError as exc:
+            raise ReqlTimeoutError() from exc
+
+        for stale in expired:
+            await stale.close(noreply_wait=False)
+
+        if connection is not None:
+            return connection
+
+        try:
+            connection = self._new_connection()
+            return await connection.reconnect()
+        except BaseException:
+            async with self._condition:
+                self._size -= 1
+                self._condition.notify()
+
+            raise
+
+    async def release(self, connection: AsyncioConnection) -> None:
+        """
+        Return a checked out connection to the pool.
+        """
+
+        async with self._condition:
+            accepted = self._push_idle(connection)
+            self._condition.notify()
+
+        if not accepted:
+            await connection.close(noreply_wait=False)
+
+    @contextlib.asynccontextmanager
+    async def connection(
+        self, timeout: Optional[float] = None
+    ) -> AsyncIterator[AsyncioConnection]:
+        """
+        Check out a connection for the duration of the `async with` block.
+
+        :raises: ReqlAuthError | ReqlTimeoutError | ReqlDriverError
+        """
+
+        connection = await self.acquire(timeout)
+
+        try:
+            yield connection
+        finally:
+            await self.release(connection)
+
+    async def close(self) -> None:
+        """
+        Close the idle connections and refuse further checkouts. The checked out
+        connections are closed when they are released.
+        """
+
+        async with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for connection, _ in idle:
+            await connection.close(noreply_wait=False)
+
+    async def _start(self, term: RqlQuery, **global_optargs: Any) -> Any:
+        """
+        Run the query on a checked out connection. This is the entrypoint of
+        `RqlQuery.run`.
+        """
+
+        connection = await self.acquire(self.checkout_timeout)
+
+        try:
+            # pylint: disable=protected-access
+            result = await connection._start(term, **global_optargs)
+        except BaseException:
+            await self.release(connection)
+            raise
+
+        cursor = unwrap_cursor(result)
+
+        if cursor is not None and not cursor.is_completed:
+            cursor.pool = self
+        else:
+            await self.release(connection)
+
+        return result
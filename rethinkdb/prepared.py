@@ -0,0 +1,315 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This file incorporates work covered by the following copyright:
+# Copyright 2010-2016 RethinkDB, all rights reserved.
+
+"""
+The prepared module contains the query templates, which are built and serialized once
+with placeholders in place of the values which change between executions.
+
+Running a prepared query splices the JSON of the bound values into the serialized
+template, so neither the query tree is built nor its JSON is encoded again.
+"""
+
+__all__ = ["BoundQuery", "Parameters", "Placeholder", "PreparedQuery"]
+
+import hashlib
+import re
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+import uuid
+
+from rethinkdb.ast import RqlQuery, expr, iter_hashed_terms
+from rethinkdb.errors import ReqlDriverCompileError, ReqlDriverError
+
+# The values encoded without building a term first
+SCALAR_TYPES = (str, int, float, type(None))
+
+# The prefix of the placeholders of the template hashed for the fingerprints, which
+# is the same in every process unlike the prefix of the serialized placeholders
+FINGERPRINT_PREFIX = "$reql_placeholder$"
+
+# The serialized template, which is the JSON split at the placeholders, and the name
+# of the placeholder following every part of the JSON
+Template = Tuple[List[bytes], List[str]]
+
+# The digest of the template, and the names of the parameters hashed as names rather
+# than as literal values
+TemplateDigest = Tuple[bytes, FrozenSet[str]]
+
+
+class Placeholder(RqlQuery):
+    """
+    Term standing for a value bound when the prepared query is run. The placeholder
+    is serialized as a marker string, which is unique to the prepared query.
+    """
+
+    __slots__ = ("name", "marker")
+
+    def __init__(self, name: str, marker: str) -> None:
+        super().__init__()
+        self.name: str = name
+        self.marker: str = marker
+
+    def build(self) -> str:
+        return self.marker
+
+    def compose(self, args, kwargs):  # pylint: disable=unused-argument
+        return "p." + self.name
+
+
+class Parameters:
+    """
+    The parameters of a prepared query, returning the placeholder of a parameter for
+    attribute and item access.
+    """
+
+    def __init__(self, prefix: str) -> None:
+        self.__prefix: str = prefix
+        self.__placeholders: Dict[str, Placeholder] = {}
+
+    @property
+    def placeholders(self) -> Dict[str, Placeholder]:
+        """
+        Return the placeholders by their name.
+        """
+
+        return self.__placeholders
+
+    def __getattr__(self, name: str) -> Placeholder:
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        return self[name]
+
+    def __getitem__(self, name: str) -> Placeholder:
+        try:
+            return self.__placeholders[name]
+        except KeyError:
+            if not name.isidentifier():
+                raise ReqlDriverCompileError(  # pylint: disable=raise-missing-from
+                    f'Invalid parameter name "{name}".'
+                )
+
+            placeholder = Placeholder(name, f"{self.__prefix}{name}")
+
+        self.__placeholders[name] = placeholder
+        return placeholder
+
+
+class Values:
+    """
+    The values of a bound query, returned for attribute and item access to build the
+    query tree of the bound query.
+    """
+
+    def __init__(self, values: Dict[str, Any]) -> None:
+        self.__values: Dict[str, Any] = values
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        return self[name]
+
+    def __getitem__(self, name: str) -> Any:
+        return self.__values[name]
+
+
+class PreparedQuery:
+    """
+    Query template built once from a function, which receives the `Parameters` and
+    returns the query. The template is serialized once per encoder class, and hashed
+    once per fingerprint mode.
+
+    The values of the parameters are bound with `bind`, or by calling the prepared
+    query, which returns a query that can be run as usual.
+    """
+
+    def __init__(self, function: Callable[[Parameters], Any]) -> None:
+        self.function: Callable[[Parameters], Any] = function
+
+        self.__prefix: str = f"$reql_placeholder${uuid.uuid4().hex}$"
+        self.__marker = re.compile(
+            rb'"' + re.escape(self.__prefix.encode("utf-8")) + rb'([^"]+)"'
+        )
+
+        parameters = Parameters(self.__prefix)
+        self.term: RqlQuery = expr(function(parameters))
+        self.names: Tuple[str, ...] = tuple(parameters.placeholders)
+        self.__templates: Dict[type, Template] = {}
+        self.__digests: Dict[bool, TemplateDigest] = {}
+
+    def __call__(self, **values: Any) -> "BoundQuery":
+        return self.bind(**values)
+
+    def bind(self, **values: Any) -> "BoundQuery":
+        """
+        Return the query with the values bound to the parameters.
+
+        :raises: ReqlDriverError
+        """
+
+        missing = set(self.names).difference(values)
+        unknown = set(values).difference(self.names)
+
+        if missing or unknown:
+            raise ReqlDriverError(
+                "Prepared query bound with missing parameters "
+                f"{sorted(missing)} or unknown parameters {sorted(unknown)}."
+            )
+
+        return BoundQuery(self, values)
+
+    def __get_template(self, encoder: Any) -> Template:
+        """
+        Return the template serialized by the encoder.
+        """
+
+        template = self.__templates.get(type(encoder))
+
+        if template is None:
+            parts = self.__marker.split(encoder.encode_term(self.term))
+            template = (parts[::2], [name.decode("utf-8") for name in parts[1::2]])
+            self.__templates[type(encoder)] = template
+
+        return template
+
+    def __get_digest(self, normalize_literals: bool) -> TemplateDigest:
+        """
+        Return the digest of the template, built again with placeholders which are
+        the same in every process, and the names of the parameters which are hashed
+        as names, like the fields of `pluck`.
+        """
+
+        digest = self.__digests.get(normalize_literals)
+
+        if digest is None:
+            term = expr(self.function(Parameters(FINGERPRINT_PREFIX)))
+            names = frozenset(
+                current.name
+                for current, current_normalize_literals in iter_hashed_terms(
+                    term, normalize_literals
+                )
+                if isinstance(current, Placeholder) and not current_normalize_literals
+            )
+            digest = (bytes.fromhex(term.fingerprint(normalize_literals)), names)
+            self.__digests[normalize_literals] = digest
+
+        return digest
+
+    def fingerprint(
+        self, values: Dict[str, Any], normalize_literals: bool = False
+    ) -> str:
+        """
+        Return the fingerprint of the query with the bound values, combining the
+        digest of the template with the digests of the values, so the query tree is
+        not built. The values are normalized with `normalize_literals` unless they
+        are hashed as names.
+        """
+
+        digest, names = self.__get_digest(normalize_literals)
+        hashed = hashlib.blake2b(b"prepared:" + digest, digest_size=16)
+
+        for name in self.names:
+            value = expr(values[name])
+            value_normalize_literals = normalize_literals and name not in names
+            hashed.update(bytes.fromhex(value.fingerprint(value_normalize_literals)))
+
+        return hashed.hexdigest()
+
+    def encode(self, encoder: Any, values: Dict[str, Any]) -> bytes:
+        """
+        Return the UTF-8 encoded JSON of the query with the bound values, splicing
+        the JSON of the values into the serialized template.
+
+        :raises: TypeError | ValueError
+        """
+
+        parts, names = self.__get_template(encoder)
+        encoded = {name: encode_value(encoder, values[name]) for name in self.names}
+        chunks: List[bytes] = [parts[0]]
+
+        for name, part in zip(names, parts[1:]):
+            chunks.append(encoded[name])
+            chunks.append(part)
+
+        return b"".join(chunks)
+
+
+class BoundQuery(RqlQuery):
+    """
+    Prepared query with values bound to its parameters. The query is serialized and
+    fingerprinted from the template of the prepared query, while the query tree is
+    built only when it is needed, like for printing the query of an error.
+    """
+
+    __slots__ = ("prepared", "values", "__query")
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self, prepared: PreparedQuery, values: Dict[str, Any]
+    ) -> None:
+        self.prepared: PreparedQuery = prepared
+        self.values: Dict[str, Any] = values
+        self.__query: Optional[RqlQuery] = None
+
+    @property
+    def query(self) -> RqlQuery:
+        """
+        Return the query tree with the values in place of the placeholders.
+        """
+
+        if self.__query is None:
+            self.__query = expr(self.prepared.function(Values(self.values)))
+
+        return self.__query
+
+    @property
+    def _args(self) -> List[Any]:  # type: ignore
+        return self.query._args  # pylint: disable=protected-access
+
+    @property
+    def kwargs(self) -> Dict[str, Any]:  # type: ignore
+        return self.query.kwargs
+
+    def build(self) -> Any:
+        return self.query.build()
+
+    def compose(self, args, kwargs):
+        return self.query.compose(args, kwargs)
+
+    def fingerprint(self, normalize_literals: bool = False) -> str:
+        return self.prepared.fingerprint(self.values, normalize_literals)
+
+    def encode(self, encoder: Any) -> bytes:
+        """
+        Return the UTF-8 encoded JSON of the query.
+
+        :raises: TypeError | ValueError
+        """
+
+        return self.prepared.encode(encoder, self.values)
+
+
+def encode_value(encoder: Any, value: Any) -> bytes:
+    """
+    Return the UTF-8 encoded JSON of a bound value.
+
+    :raises: TypeError | ValueError
+    """
+
+    if isinstance(value, SCALAR_TYPES):
+        return encoder.encode_bytes(value)
+
+    return encoder.encode_term(expr(value))
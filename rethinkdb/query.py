@@ -33,6 +33,7 @@ __all__ = [
     "branch",
     "ceil",
     "circle",
+    "connect",
     "contains",
     "count",
     "db",
@@ -88,6 +89,7 @@ __all__ = [
     "or_",
     "point",
     "polygon",
+    "prepare",
     "random",
     "range",
     "reduce",
@@ -112,7 +114,7 @@ __all__ = [
     "js",
 ]
 
-from rethinkdb import ast, ql2_pb2
+from rethinkdb import ast, net, prepared, ql2_pb2
 
 
 class RqlConstant(ast.RqlQuery):
@@ -133,6 +135,24 @@ class RqlConstant(ast.RqlQuery):
         return "r." + self.statement
 
 
+def connect(*arguments, **kwargs):
+    """
+    Create a new connection to the database server. The returned connection can be
+    passed to `run` to execute queries.
+    """
+    return net.connect(*arguments, **kwargs)
+
+
+def prepare(function):
+    """
+    Build and serialize the query returned by the function once, and return it as a
+    prepared query. The function receives the parameters of the query, and the
+    parameters used as `p.name` are bound when the query is run, like
+    `query.bind(name=value).run(conn)`.
+    """
+    return prepared.PreparedQuery(function)
+
+
 def json(*arguments):
     """
     Transform *arguments parameters into JSON.
@@ -0,0 +1,556 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This file incorporates work covered by the following copyright:
+# Copyright 2010-2016 RethinkDB, all rights reserved.
+
+"""
+The streaming module contains the incremental decoder of the response envelope, which
+makes the rows of a batch available while the rest of the batch is still received.
+
+The server responds with a JSON object like ``{"t":3,"r":[...],"n":[]}``. Instead of
+waiting for the whole object, the decoder scans the received bytes for the boundaries
+of the rows of the ``r`` array and decodes every row as soon as its last byte arrives.
+
+The module contains the pass-through decoder of the ``raw`` response format too, which
+returns the ``r`` array of a response as a slice of the received bytes instead of
+decoding it, and the helpers to forward those slices as one JSON array.
+"""
+
+__all__ = ["RawResponseDecoder", "ResponseStream", "aiter_raw_json", "iter_raw_json"]
+
+from collections import deque
+import json
+import re
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from rethinkdb import ql2_pb2
+from rethinkdb.encoder import ReQLDecoder
+from rethinkdb.errors import ReqlDriverError
+
+P_RESPONSE = ql2_pb2.Response.ResponseType  # pylint: disable=invalid-name
+
+# The rows of these responses are results, which can be handed out before the whole
+# response is received. The rows of any other response, like errors, are kept until
+# the response is complete.
+STREAMED_RESPONSE_TYPES = (P_RESPONSE.SUCCESS_PARTIAL, P_RESPONSE.SUCCESS_SEQUENCE)
+
+# The responses of which the raw decoder returns the rows without decoding them
+RAW_RESPONSE_TYPES = (
+    P_RESPONSE.SUCCESS_ATOM,
+    P_RESPONSE.SUCCESS_PARTIAL,
+    P_RESPONSE.SUCCESS_SEQUENCE,
+)
+
+# The server writes the response type first and the rows right after it, optionally
+# followed by the notes, which are a list of integers.
+RAW_HEAD = re.compile(rb'\{\s*"t"\s*:\s*(\d+)\s*,\s*"r"\s*:\s*\[')
+RAW_TAIL = re.compile(rb"\]\s*\}\s*")
+RAW_NOTES_TAIL = re.compile(rb'\]\s*,\s*"n"\s*:\s*(\[[\d,\s]*\])\s*\}\s*')
+
+STRUCTURAL_CHARACTERS = re.compile(rb'["\[\]{}]')
+SCALAR_END = re.compile(rb"[,\]}\s]")
+WHITESPACE = b" \t\r\n"
+
+# Scanner states
+EXPECT_OBJECT = 0
+EXPECT_KEY = 1
+EXPECT_COLON = 2
+EXPECT_VALUE = 3
+EXPECT_ARRAY = 4
+EXPECT_ROW = 5
+DONE = 6
+
+
+class ResponseStream:
+    """
+    Incremental decoder of a response. The bytes of the response are passed to
+    `feed` as they are received, and the decoded rows are appended to `rows` as soon
+    as they are complete and the response type allows handing them out. The rest of
+    the response is returned by `finish` once every byte was fed.
+
+    The decoder can be reused for the next response with `reset`, while `rows` is kept
+    so the consumer sees the rows of consecutive responses in one queue.
+    """
+
+    def __init__(self, decoder: ReQLDecoder) -> None:
+        self.decoder: ReQLDecoder = decoder
+        self.rows: Deque[Any] = deque()
+        self.closed: bool = False
+
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Prepare the decoder for the next response.
+        """
+
+        self._buffer: bytearray = bytearray()
+        self._state: int = EXPECT_OBJECT
+        self._key: Optional[str] = None
+        self._document: Dict[str, Any] = {}
+        self._pending_rows: List[Any] = []
+        self._error: Optional[Exception] = None
+
+        # The bytes received and the rows handed out for the response
+        self.size: int = 0
+        self.handed_out: int = 0
+
+        # The progress of scanning a value which is not fully received yet
+        self._scan_position: int = 0
+        self._depth: int = 0
+        self._in_string: bool = False
+
+    def close(self) -> None:
+        """
+        Drop the received rows and the rows received later.
+        """
+
+        self.closed = True
+        self.rows.clear()
+
+    @property
+    def response_type(self) -> Optional[int]:
+        """
+        Return the type of the response if it is received already.
+        """
+
+        return self._document.get("t")
+
+    @property
+    def is_streaming(self) -> bool:
+        """
+        Return whether the rows of the response are handed out as they arrive.
+        """
+
+        return self.response_type in STREAMED_RESPONSE_TYPES
+
+    def __find_string_end(self, position: int) -> int:
+        """
+        Return the position after the closing quote of the string, or -1 if the
+        closing quote is not received yet.
+        """
+
+        buffer = self._buffer
+
+        while True:
+            quote = buffer.find(b'"', position)
+
+            if quote < 0:
+                return -1
+
+            backslashes = 0
+
+            while buffer[quote - 1 - backslashes] == 0x5C:  # backslash
+                backslashes += 1
+
+            if backslashes % 2 == 0:
+                return quote + 1
+
+            position = quote + 1
+
+    def __find_value_end(self, start: int) -> int:
+        """
+        Return the position after the JSON value starting at `start`, or -1 if the
+        value is not fully received yet. The progress is kept, so the bytes of a
+        partially received value are scanned only once.
+        """
+
+        buffer = self._buffer
+
+        if self._scan_position == 0:
+            first = buffer[start]
+
+            if first == 0x22:  # quote
+                self._in_string = True
+                self._scan_position = start + 1
+            elif first in (0x5B, 0x7B):  # opening bracket or brace
+                self._depth = 1
+                self._scan_position = start + 1
+            else:
+                match = SCALAR_END.search(buffer, start)
+                return -1 if match is None else match.start()
+
+        position = self._scan_position
+
+        while True:
+            if self._in_string:
+                end = self.__find_string_end(position)
+
+                if end < 0:
+                    self._scan_position = len(buffer)
+                    return -1
+
+                self._in_string = False
+                position = end
+
+                if self._depth == 0:
+                    return self.__value_found(position)
+
+            match = STRUCTURAL_CHARACTERS.search(buffer, position)
+
+            if match is None:
+                self._scan_position = len(buffer)
+                return -1
+
+            character = buffer[match.start()]
+            position = match.end()
+
+            if character == 0x22:
+                self._in_string = True
+            elif character in (0x5B, 0x7B):
+                self._depth += 1
+            else:
+                self._depth -= 1
+
+                if self._depth == 0:
+                    return self.__value_found(position)
+
+    def __value_found(self, end: int) -> int:
+        self._scan_position = 0
+        return end
+
+    def __skip_whitespace(self, position: int) -> int:
+        buffer = self._buffer
+
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+
+        return position
+
+    def __add_row(self, row: Any) -> int:
+        """
+        Hand out the row if the response type allows, or keep it until the response
+        is complete. Return the number of rows handed out.
+        """
+
+        if not self.is_streaming:
+            self._pending_rows.append(row)
+            return 0
+
+        if self.closed:
+            return 0
+
+        self.rows.append(row)
+        return 1
+
+    def __flush_pending_rows(self) -> int:
+        if not self._pending_rows or not self.is_streaming:
+            return 0
+
+        rows, self._pending_rows = self._pending_rows, []
+
+        if self.closed:
+            return 0
+
+        self.rows.extend(rows)
+        return len(rows)
+
+    # pylint: disable=too-many-branches
+    def __scan(self) -> int:
+        """
+        Process the received bytes as far as possible, and return the number of rows
+        handed out.
+        """
+
+        buffer = self._buffer
+        position = 0
+        added = 0
+
+        while position < len(buffer) and self._state != DONE:
+            position = self.__skip_whitespace(position)
+
+            if position >= len(buffer):
+                break
+
+            character = buffer[position]
+
+            if self._state == EXPECT_OBJECT:
+                if character != 0x7B:
+                    raise ReqlDriverError("Invalid response: expected an object.")
+
+                self._state = EXPECT_KEY
+                position += 1
+
+            elif self._state == EXPECT_KEY:
+                if character == 0x2C:  # comma
+                    position += 1
+                elif character == 0x7D:  # closing brace
+                    self._state = DONE
+                    position += 1
+                else:
+                    end = self.__find_value_end(position)
+
+                    if end < 0:
+                        break
+
+                    self._key = self.decoder.decode_bytes(bytes(buffer[position:end]))
+                    self._state = EXPECT_COLON
+                    position = end
+
+            elif self._state == EXPECT_COLON:
+                if character != 0x3A:
+                    raise ReqlDriverError("Invalid response: expected a colon.")
+
+                self._state = EXPECT_ARRAY if self._key == "r" else EXPECT_VALUE
+                position += 1
+
+            elif self._state == EXPECT_ARRAY:
+                if character != 0x5B:
+                    raise ReqlDriverError("Invalid response: expected an array.")
+
+                self._state = EXPECT_ROW
+                position += 1
+
+            elif self._state == EXPECT_VALUE:
+                end = self.__find_value_end(position)
+
+                if end < 0:
+                    break
+
+                value = self.decoder.decode_bytes(bytes(buffer[position:end]))
+                self._document[self._key] = value
+                self._state = EXPECT_KEY
+                position = end
+
+                if self._key == "t":
+                    added += self.__flush_pending_rows()
+
+            elif self._state == EXPECT_ROW:
+                if character == 0x2C:
+                    position += 1
+                elif character == 0x5D:  # closing bracket
+                    self._state = EXPECT_KEY
+                    position += 1
+                else:
+                    end = self.__find_value_end(position)
+
+                    if end < 0:
+                        break
+
+                    row = self.decoder.decode_bytes(bytes(buffer[position:end]))
+                    added += self.__add_row(row)
+                    position = end
+
+        if position:
+            del buffer[:position]
+
+            if self._scan_position:
+                self._scan_position -= position
+
+        return added
+
+    def feed(self, data: bytes) -> int:
+        """
+        Process the next received bytes of the response, and return the number of
+        rows handed out. Decoding errors are raised by `finish`.
+        """
+
+        self.size += len(data)
+
+        if self._error is not None:
+            return 0
+
+        self._buffer.extend(data)
+
+        try:
+            added = self.__scan()
+        except (ReqlDriverError, ValueError) as exc:
+            self._error = exc
+            return 0
+
+        self.handed_out += added
+        return added
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        Return the response without the rows handed out already.
+
+        :raises: ReqlDriverError | ValueError
+        """
+
+        if self._error is not None:
+            raise self._error
+
+        if self._state != DONE:
+            raise ReqlDriverError("Invalid response: the response is incomplete.")
+
+        document = dict(self._document)
+        document["r"] = self._pending_rows
+        return document
+
+
+class RawResponseDecoder(ReQLDecoder):
+    """
+    Decoder of the ``raw`` response format. The ``r`` array of the results is not
+    decoded: the response contains one `memoryview` slice of the received bytes, which
+    is the JSON array of the batch for sequences and the JSON value for atoms. Every
+    other response, like errors, is decoded as usual.
+
+    Only the response type and the notes are parsed when the response has the layout
+    written by the server. Any other layout is decoded and the rows are encoded again,
+    and so are the responses of profiled queries, as the end of the rows cannot be
+    told apart from the end of the profile without decoding it.
+    """
+
+    def __init__(self, profile: bool = False, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.profile: bool = profile
+
+    def decode_bytes(self, data: bytes) -> Any:
+        """
+        Return the response with the rows as a slice of the received bytes.
+
+        :raises: ValueError
+        """
+
+        head = RAW_HEAD.match(data)
+
+        if (
+            head is not None
+            and not self.profile
+            and int(head.group(1)) in RAW_RESPONSE_TYPES
+        ):
+            layout = self.__parse_layout(data, head.end())
+
+            if layout is not None:
+                rows_end, notes = layout
+                response_type = int(head.group(1))
+                rows = self.__make_rows(
+                    response_type, memoryview(data)[head.end() - 1 : rows_end + 1]
+                )
+
+                return {"t": response_type, "r": rows, "n": notes}
+
+        return self.__decode_document(data)
+
+    @staticmethod
+    def __parse_layout(data: bytes, rows_start: int) -> Optional[Tuple[int, List[int]]]:
+        """
+        Return the position of the closing bracket of the rows and the notes, or None
+        if the response has a different layout.
+        """
+
+        close = data.rfind(b"]", rows_start)
+
+        if close < 0:
+            return None
+
+        opening = data.rfind(b"[", rows_start, close)
+        rows_end = data.rfind(b"]", rows_start, opening) if opening >= 0 else -1
+
+        if rows_end >= 0:
+            notes_tail = RAW_NOTES_TAIL.fullmatch(data, rows_end)
+
+            if notes_tail is not None:
+                return rows_end, json.loads(notes_tail.group(1))
+
+        if RAW_TAIL.fullmatch(data, close):
+            return close, []
+
+        return None
+
+    @staticmethod
+    def __make_rows(response_type: int, rows: memoryview) -> List[memoryview]:
+        """
+        Return the rows of the response, which are the JSON array of the batch, the
+        JSON value of the atom, or nothing for empty batches.
+        """
+
+        start = 1
+        end = len(rows) - 1
+
+        while start < end and rows[start] in WHITESPACE:
+            start += 1
+
+        while end > start and rows[end - 1] in WHITESPACE:
+            end -= 1
+
+        if start == end:
+            return []
+
+        if response_type == P_RESPONSE.SUCCESS_ATOM:
+            return [rows[start:end]]
+
+        return [rows]
+
+    def __decode_document(self, data: bytes) -> Dict[str, Any]:
+        document = json.loads(data)
+
+        if document.get("t") in RAW_RESPONSE_TYPES:
+            rows = document.get("r", [])
+
+            if document["t"] == P_RESPONSE.SUCCESS_ATOM:
+                document["r"] = [self.__encode_value(rows[0])] if rows else []
+            else:
+                document["r"] = [self.__encode_value(rows)] if rows else []
+
+        return document
+
+    @staticmethod
+    def __encode_value(value: Any) -> memoryview:
+        return memoryview(
+            json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+
+
+def iter_raw_json(batches: Iterable[Any]) -> Iterator[Any]:
+    """
+    Return the chunks of one JSON array containing the rows of the raw batches, which
+    are usually returned by a cursor of the ``raw`` response format. The batches are
+    not copied, so the chunks are bytes-like objects which can be written to a socket
+    or a streamed HTTP response as they are.
+    """
+
+    yield b"["
+    separator = b""
+
+    for batch in batches:
+        if separator:
+            yield separator
+
+        yield batch[1:-1]
+        separator = b","
+
+    yield b"]"
+
+
+async def aiter_raw_json(batches: AsyncIterable[Any]) -> AsyncIterator[Any]:
+    """
+    Return the chunks of one JSON array containing the rows of the raw batches of an
+    asyncio cursor, like `iter_raw_json` does.
+    """
+
+    yield b"["
+    separator = b""
+
+    async for batch in batches:
+        if separator:
+            yield separator
+
+        yield batch[1:-1]
+        separator = b","
+
+    yield b"]"
@@ -0,0 +1,232 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The tuning module contains the adaptive batch sizing of the cursors, which measures
+the batches received by the cursors of every query shape, and tunes the batch size
+global optional arguments of the next runs of the same shape.
+
+The server reads the batch sizes when the query is started, so the measurements of
+a run are applied from the next run of a query with the same fingerprint.
+"""
+
+__all__ = ["AdaptiveBatchSizer", "BatchObserver"]
+
+from collections import OrderedDict, deque
+import math
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from rethinkdb.ast import RqlQuery
+from rethinkdb.errors import ReqlDriverError
+
+DEFAULT_MAX_BATCH_BYTES: int = 4 * 1024 * 1024
+DEFAULT_TARGET_BATCH_SECONDS: float = 0.1
+DEFAULT_MIN_BATCH_ROWS: int = 16
+DEFAULT_MAX_BATCH_ROWS: int = 100000
+DEFAULT_SMOOTHING: float = 0.25
+DEFAULT_MAX_SIZE: int = 1024
+
+
+class BatchStats:
+    """
+    Exponentially weighted averages of the batches received for a query shape.
+    """
+
+    __slots__ = ("row_bytes", "row_seconds")
+
+    def __init__(self, row_bytes: float, row_seconds: float) -> None:
+        self.row_bytes: float = row_bytes
+        self.row_seconds: float = row_seconds
+
+
+class AdaptiveBatchSizer:
+    """
+    Tune the `max_batch_rows` and `max_batch_bytes` global optional arguments of the
+    cursor queries from the batches received by the earlier runs of the same query
+    shape, passed to the connections or pools as `batch_sizer` or to `run` as a
+    client-only option.
+
+    For every shape, the sizer averages the bytes of a row, and the seconds spent
+    decoding a row and waiting for the caller to consume it. A batch holds as many
+    rows as the caller consumes in `target_batch_seconds`, within `max_batch_bytes`
+    and between `min_batch_rows` and `max_batch_rows` rows. Scans of small rows
+    consumed quickly get large batches, and scans of huge documents or slow callers
+    get small ones.
+
+    The options passed to `run` are never overridden, and the queries returning raw
+    JSON or streaming their rows are not measured.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+        target_batch_seconds: float = DEFAULT_TARGET_BATCH_SECONDS,
+        min_batch_rows: int = DEFAULT_MIN_BATCH_ROWS,
+        max_batch_rows: int = DEFAULT_MAX_BATCH_ROWS,
+        smoothing: float = DEFAULT_SMOOTHING,
+        max_size: int = DEFAULT_MAX_SIZE,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        if (
+            max_batch_bytes < 1
+            or target_batch_seconds <= 0
+            or not 1 <= min_batch_rows <= max_batch_rows
+            or not 0 < smoothing <= 1
+            or max_size < 1
+        ):
+            raise ReqlDriverError("Invalid adaptive batch sizer configuration.")
+
+        self.max_batch_bytes: int = max_batch_bytes
+        self.target_batch_seconds: float = target_batch_seconds
+        self.min_batch_rows: int = min_batch_rows
+        self.max_batch_rows: int = max_batch_rows
+        self.smoothing: float = smoothing
+        self.max_size: int = max_size
+        self.clock: Callable[[], float] = clock
+
+        self.__lock = threading.Lock()
+        self.__stats: "OrderedDict[str, BatchStats]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__stats)
+
+    @staticmethod
+    def make_key(term: RqlQuery) -> str:
+        """
+        Return the key of the query shape, ignoring the literal values of the query.
+        """
+
+        return term.fingerprint(normalize_literals=True)
+
+    def observe(
+        self,
+        key: str,
+        rows: int,
+        size: int,
+        decode_seconds: float,
+        drain_seconds: float,
+    ) -> None:
+        """
+        Record a batch of the query shape: its number of rows and bytes, the seconds
+        spent decoding it, and the seconds the caller took to consume its rows.
+        """
+
+        if rows < 1:
+            return
+
+        row_bytes = size / rows
+        row_seconds = (decode_seconds + drain_seconds) / rows
+
+        with self.__lock:
+            stats = self.__stats.get(key)
+
+            if stats is None:
+                self.__stats[key] = BatchStats(row_bytes, row_seconds)
+
+                if len(self.__stats) > self.max_size:
+                    self.__stats.popitem(last=False)
+
+                return
+
+            self.__stats.move_to_end(key)
+            stats.row_bytes += self.smoothing * (row_bytes - stats.row_bytes)
+            stats.row_seconds += self.smoothing * (row_seconds - stats.row_seconds)
+
+    def batch_optargs(self, key: str) -> Dict[str, int]:
+        """
+        Return the batch size global optional arguments of the query shape, or an
+        empty dictionary if none of its batches was measured yet.
+        """
+
+        with self.__lock:
+            stats = self.__stats.get(key)
+
+            if stats is None:
+                return {}
+
+            row_bytes = max(stats.row_bytes, 1.0)
+            row_seconds = stats.row_seconds
+
+        rows = self.max_batch_bytes / row_bytes
+
+        if row_seconds > 0:
+            rows = min(rows, self.target_batch_seconds / row_seconds)
+
+        rows = min(max(int(rows), self.min_batch_rows), self.max_batch_rows)
+
+        return {
+            "max_batch_rows": rows,
+            "max_batch_bytes": min(
+                max(math.ceil(rows * row_bytes), 1), self.max_batch_bytes
+            ),
+        }
+
+    def apply(self, term: RqlQuery, global_optargs: Dict[str, Any]) -> "BatchObserver":
+        """
+        Add the tuned batch sizes of the query shape to the global optional arguments
+        which are not set yet, and return the observer of the batches of the query.
+        """
+
+        key = self.make_key(term)
+
+        for name, value in self.batch_optargs(key).items():
+            global_optargs.setdefault(name, value)
+
+        return BatchObserver(self, key)
+
+
+class BatchObserver:
+    """
+    Measure the batches received by the cursor of a query, and report them to the
+    sizer once the caller consumed them.
+    """
+
+    __slots__ = ("sizer", "key", "pending")
+
+    def __init__(self, sizer: AdaptiveBatchSizer, key: str) -> None:
+        self.sizer: AdaptiveBatchSizer = sizer
+        self.key: str = key
+
+        # The rows, bytes, decoding seconds and receive time of the batches which are
+        # not consumed yet, as the batches prefetched are received before the caller
+        # consumed the earlier ones
+        self.pending: Deque[Tuple[int, int, float, float]] = deque()
+
+    def received(self, rows: int, size: int, decode_seconds: float) -> None:
+        """
+        Record a batch, received and decoded now.
+        """
+
+        self.pending.append((rows, size, decode_seconds, self.sizer.clock()))
+
+    def drained(self) -> None:
+        """
+        Report the received batches, whose rows were all consumed by the caller. The
+        time since the oldest batch was received is split between the batches in
+        proportion to their rows, as the caller consumed them one after the other.
+        """
+
+        if not self.pending:
+            return
+
+        elapsed = self.sizer.clock() - self.pending[0][3]
+        total_rows = sum(batch[0] for batch in self.pending)
+
+        while self.pending:
+            rows, size, decode_seconds, _ = self.pending.popleft()
+            drain_seconds = elapsed * rows / total_rows if total_rows else elapsed
+            self.sizer.observe(self.key, rows, size, decode_seconds, drain_seconds)
@@ -0,0 +1,236 @@
+# Copyright 2020 RethinkDB
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the time and memory of building and serializing the query of a bulk insert.
+
+The terms of the documents are built once from the slotted term classes and once
+from subclasses storing their attributes in an instance dictionary, which compares
+the terms themselves, per term. The bulk insert is then built by converting the
+documents with `expr`, which creates a term for every field of every document, and
+by `insert`, which sends them as a single datum, which compares the queries per
+document, as their term counts differ.
+
+Usage, from the root of the repository:
+
+    python -m scripts.benchmark_ast [--documents N] [--repeat N]
+"""
+
+import argparse
+import functools
+import gc
+import time
+import tracemalloc
+import types
+
+from rethinkdb import ast
+from rethinkdb import query as r
+from rethinkdb.encoder import DEFAULT_JSON_ENCODER
+
+# The attributes are assigned around the `__setattr__` of the terms, like their
+# constructors do
+set_attribute = object.__setattr__
+
+
+def make_documents(count):
+    return [
+        {"id": i, "name": f"user-{i}", "tags": ["a", "b"], "score": i * 0.5}
+        for i in range(count)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def unslotted(cls):
+    """
+    Return a subclass of the term class storing the attributes declared in the
+    `__slots__` of the term classes in an instance dictionary, by shadowing their
+    slot descriptors.
+    """
+
+    shadowed = {
+        name: None
+        for base in cls.__mro__
+        for name in getattr(base, "__slots__", ())
+        if isinstance(getattr(cls, name), types.MemberDescriptorType)
+    }
+
+    return type(cls.__name__, (cls,), shadowed)
+
+
+def make_terms(value, classes):
+    """
+    Return the terms of a value made of dictionaries, lists and datums, created from
+    the given `Datum`, `MakeArray` and `MakeObj` classes like `expr` creates them.
+    """
+
+    datum, make_array, make_obj = classes
+
+    if isinstance(value, dict):
+        term = make_obj.__new__(make_obj)
+        set_attribute(term, "_args", [])
+        set_attribute(
+            term, "kwargs", {k: make_terms(v, classes) for k, v in value.items()}
+        )
+    elif isinstance(value, list):
+        term = make_array.__new__(make_array)
+        set_attribute(term, "_args", [make_terms(v, classes) for v in value])
+        set_attribute(term, "kwargs", {})
+    else:
+        term = datum.__new__(datum)
+        set_attribute(term, "data", value)
+
+    return term
+
+
+def count_terms(term):
+    """
+    Return the number of terms of the query tree.
+    """
+
+    count = 0
+    pending = [term]
+
+    while pending:
+        current = pending.pop()
+        count += 1
+        # pylint: disable=protected-access
+        pending.extend(current._args)
+        pending.extend(current.kwargs.values())
+
+    return count
+
+
+def measure_build(build, documents, repeat):
+    best = float("inf")
+
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        build(documents)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def measure_memory(build, documents):
+    gc.collect()
+    tracemalloc.start()
+    query = build(documents)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return query, size
+
+
+def measure_encode(query, repeat):
+    encoder = DEFAULT_JSON_ENCODER()
+    best = float("inf")
+
+    for _ in range(repeat):
+        # Drop the JSON memoized by the previous run
+        query.invalidate_fragment()
+        start = time.perf_counter()
+        encoder.encode(query)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def measure(builders, documents, repeat):
+    """
+    Return the build time, the memory, the number of terms and the encode time of
+    the query built by each builder.
+    """
+
+    results = {}
+
+    for name, build in builders.items():
+        build_time = measure_build(build, documents, repeat)
+        query, size = measure_memory(build, documents)
+        results[name] = {
+            "build": build_time,
+            "memory": size,
+            "terms": count_terms(query),
+            "encode": measure_encode(query, repeat),
+        }
+
+    return results
+
+
+def print_table(title, results, rows):
+    print(f"\n{title:<20}" + "".join(f"{name:>14}" for name in results))
+
+    for label, unit, value in rows:
+        cells = "".join(
+            f"{value(result):>10.1f} {unit:<3}" for result in results.values()
+        )
+        print(f"{label:<20}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    documents = make_documents(options.documents)
+    count = options.documents
+    slotted = (ast.Datum, ast.MakeArray, ast.MakeObj)
+    term_builders = {
+        "slotted": lambda documents: make_terms(documents, slotted),
+        "unslotted": lambda documents: make_terms(
+            documents, tuple(map(unslotted, slotted))
+        ),
+    }
+    query_builders = {
+        "expr": lambda documents: r.table("benchmark").insert(ast.expr(documents)),
+        "insert": lambda documents: r.table("benchmark").insert(documents),
+    }
+
+    print(f"documents: {count}")
+
+    results = measure(term_builders, documents, options.repeat)
+    print(f"terms:     {results['slotted']['terms']}")
+    print_table(
+        "terms",
+        results,
+        [
+            ("build time", "ms", lambda result: result["build"] * 1e3),
+            (
+                "build time / term",
+                "ns",
+                lambda result: result["build"] / result["terms"] * 1e9,
+            ),
+            ("memory", "MiB", lambda result: result["memory"] / 2**20),
+            ("memory / term", "B", lambda result: result["memory"] / result["terms"]),
+            ("encode time", "ms", lambda result: result["encode"] * 1e3),
+        ],
+    )
+
+    # The queries have different numbers of terms, so they are compared per document
+    print_table(
+        "insert query",
+        measure(query_builders, documents, options.repeat),
+        [
+            ("build time", "ms", lambda result: result["build"] * 1e3),
+            ("build time / doc", "us", lambda result: result["build"] / count * 1e6),
+            ("memory", "MiB", lambda result: result["memory"] / 2**20),
+            ("memory / doc", "B", lambda result: result["memory"] / count),
+            ("encode time", "ms", lambda result: result["encode"] * 1e3),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
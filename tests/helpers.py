@@ -0,0 +1,198 @@
+"""
+Helpers shared by the test modules which need a server to talk to.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import socket
+import struct
+import threading
+
+from rethinkdb.ql2_pb2 import Query, Response
+
+FRAME_HEADER = struct.Struct("<QL")
+
+
+class FakeServer:
+    """
+    Minimal RethinkDB server accepting clients on localhost. It speaks the V1_0
+    handshake and hands every received query to the `handler` callable, which can
+    reply with `send` to the client the query was received from.
+    """
+
+    def __init__(self, handler=None, password=b"", salt=b"salt", iterations=1):
+        self.handler = handler or (lambda server, token, message: None)
+        self.password = password
+        self.salt = salt
+        self.iterations = iterations
+        self.queries = []
+        self.clients = []
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(8)
+        self._local = threading.local()
+        self._send_lock = threading.Lock()
+
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stop accepting clients and drop the connected ones.
+        """
+
+        self._listener.close()
+
+        for client in self.clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            client.close()
+
+    def _fill(self):
+        chunk = self._local.client.recv(65536)
+
+        if not chunk:
+            raise EOFError()
+
+        self._local.buffer += chunk
+
+    def _recv(self, length):
+        while len(self._local.buffer) < length:
+            self._fill()
+
+        data = self._local.buffer[:length]
+        self._local.buffer = self._local.buffer[length:]
+        return data
+
+    def _recv_until_null(self):
+        while b"\0" not in self._local.buffer:
+            self._fill()
+
+        message, self._local.buffer = self._local.buffer.split(b"\0", 1)
+        return message
+
+    def _send_message(self, message):
+        self._local.client.sendall(json.dumps(message).encode("utf-8") + b"\0")
+
+    def _handshake(self):
+        self._recv(4)
+        client_first = json.loads(self._recv_until_null())["authentication"]
+        client_first_bare = client_first[len("n,,") :]
+        nonce = dict(part.split("=", 1) for part in client_first_bare.split(","))["r"]
+
+        self._send_message(
+            {"success": True, "min_protocol_version": 0, "max_protocol_version": 0}
+        )
+
+        server_first = "r={},s={},i={}".format(
+            nonce, base64.b64encode(self.salt).decode("ascii"), self.iterations
+        )
+        self._send_message({"success": True, "authentication": server_first})
+
+        client_final = json.loads(self._recv_until_null())["authentication"]
+        without_proof, proof = client_final.rsplit(",p=", 1)
+
+        salted_password = hashlib.pbkdf2_hmac(
+            "sha256", self.password, self.salt, self.iterations
+        )
+        auth_message = ",".join((client_first_bare, server_first, without_proof))
+        client_key = hmac.new(salted_password, b"Client Key", hashlib.sha256).digest()
+        client_signature = hmac.new(
+            hashlib.sha256(client_key).digest(),
+            auth_message.encode("ascii"),
+            hashlib.sha256,
+        ).digest()
+        expected_proof = bytes(a ^ b for a, b in zip(client_key, client_signature))
+
+        if base64.b64decode(proof) != expected_proof:
+            self._send_message(
+                {"success": False, "error_code": 12, "error": "Wrong password"}
+            )
+            return False
+
+        server_key = hmac.new(salted_password, b"Server Key", hashlib.sha256).digest()
+        signature = hmac.new(
+            server_key, auth_message.encode("ascii"), hashlib.sha256
+        ).digest()
+        self._send_message(
+            {
+                "success": True,
+                "authentication": "v=" + base64.b64encode(signature).decode("ascii"),
+            }
+        )
+        return True
+
+    def _serve(self):
+        try:
+            while True:
+                client, _ = self._listener.accept()
+                self.clients.append(client)
+                threading.Thread(
+                    target=self._serve_client, args=(client,), daemon=True
+                ).start()
+        except OSError:
+            pass
+
+    def _serve_client(self, client):
+        self._local.client = client
+        self._local.buffer = b""
+
+        try:
+            if not self._handshake():
+                return
+
+            while True:
+                token, length = FRAME_HEADER.unpack(self._recv(FRAME_HEADER.size))
+                message = json.loads(self._recv(length))
+                self.queries.append((token, message))
+                self.handler(self, token, message)
+        except (EOFError, OSError):
+            pass
+
+    def send(self, token, response):
+        """
+        Send a response frame for the token.
+        """
+
+        self.send_raw(frame(token, response))
+
+    def send_raw(self, data):
+        """
+        Send raw bytes, like a part of a response frame.
+        """
+
+        with self._send_lock:
+            self._local.client.sendall(data)
+
+
+def frame(token, response):
+    """
+    Return the wire representation of the response for the token.
+    """
+
+    payload = json.dumps(response).encode("utf-8")
+    return FRAME_HEADER.pack(token, len(payload)) + payload
+
+
+def atom_handler(server, token, message):
+    """
+    Reply to every started query with the term itself as an atom.
+    """
+
+    if message[0] == Query.QueryType.START:
+        server.send(token, {"t": Response.ResponseType.SUCCESS_ATOM, "r": [message[1]]})
+    elif message[0] == Query.QueryType.NOREPLY_WAIT:
+        server.send(token, {"t": Response.ResponseType.WAIT_COMPLETE, "r": []})
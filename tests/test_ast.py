@@ -0,0 +1,400 @@
+from collections import abc
+import datetime
+import inspect
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb.encoder import ReQLEncoder
+from rethinkdb.errors import ReqlDriverCompileError
+
+
+def test_terms_have_no_instance_dictionary():
+    """
+    Test every term class declares its attributes in `__slots__`.
+    """
+
+    term_classes = [
+        value
+        for value in vars(ast).values()
+        if inspect.isclass(value) and issubclass(value, ast.RqlQuery)
+    ]
+
+    assert len(term_classes) > 100
+    assert [cls.__name__ for cls in term_classes if cls.__dictoffset__] == []
+
+
+def test_term_attributes():
+    """
+    Test the attributes of the slotted terms are set.
+    """
+
+    term = ast.expr({"a": 1}).merge(ast.expr([1, 2]))
+
+    assert term.term_type == ast.P_TERM.MERGE
+    assert term._args[1]._args[0].data == 1  # pylint: disable=protected-access
+    assert ast.Or(True, False).infix is False
+
+
+def test_insert_json_documents():
+    """
+    Test inserting JSON documents creates a single datum with the same JSON as the
+    terms created by `expr`.
+    """
+
+    documents = [{"id": 1, "tags": ["a", {"b": (1, 2)}], "none": None, "ok": True}]
+    table = ast.DB("db").table("table")
+    query = table.insert(documents, conflict="replace")
+    encoder = ReQLEncoder()
+
+    assert isinstance(query._args[1], ast.JsonDatum)  # pylint: disable=protected-access
+    assert encoder.encode(query) == encoder.encode(
+        ast.Insert(table, ast.expr(documents), conflict="replace")
+    )
+
+
+def test_insert_json_documents_snapshot():
+    """
+    Test the inserted documents are snapshotted, so mutating them afterwards changes
+    neither the query nor its fingerprint, whether it was serialized already or not.
+    """
+
+    encoder = ReQLEncoder()
+    table = ast.DB("db").table("table")
+
+    for serialize_first in (False, True):
+        documents = [{"id": 1, "tags": ["a"], "nested": {"b": 1}}]
+        query = table.insert(documents)
+        expected = encoder.encode(table.insert(documents))
+        fingerprint = query.fingerprint()
+
+        if serialize_first:
+            encoder.encode_term(query)
+
+        documents[0]["id"] = 2
+        documents[0]["tags"].append("c")
+        documents[0]["nested"]["b"] = 3
+        documents.append({"id": 4})
+
+        assert encoder.encode(query) == expected
+        assert query.fingerprint() == fingerprint
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        {"query": ast.expr(1)},
+        {"at": datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)},
+        {"blob": b"bytes"},
+        {"function": lambda doc: doc},
+        {"nested": [{"set": {1}}]},
+    ],
+)
+def test_insert_fallback(document):
+    """
+    Test the documents containing any other value are converted by `expr`.
+    """
+
+    query = ast.DB("db").table("table").insert(document)
+
+    assert isinstance(query._args[1], ast.MakeObj)  # pylint: disable=protected-access
+
+
+def test_insert_invalid_key():
+    """
+    Test the documents with keys which are not strings are rejected like by `expr`.
+    """
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.DB("db").table("table").insert({1: "integer key"})
+
+
+def test_insert_nesting_depth_limit():
+    """
+    Test the nesting depth of the inserted documents is limited like by `expr`.
+    """
+
+    document = {"leaf": 1}
+
+    for _ in range(19):
+        document = {"nested": document}
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.DB("db").table("table").insert(document)
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.expr(document)
+
+
+def test_expr_datetime():
+    """
+    Test the datetimes with a timezone are converted, and the others are rejected.
+    """
+
+    moment = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+    assert isinstance(ast.expr(moment), ast.ISO8601)
+    assert isinstance(ast.expr({"at": moment}).kwargs["at"], ast.ISO8601)
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.expr(datetime.datetime(2020, 1, 1))
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.expr(datetime.date(2020, 1, 1))
+
+    with pytest.raises(ReqlDriverCompileError):
+        ast.expr([{"at": datetime.datetime(2020, 1, 1)}])
+
+
+def test_expr_wide_array():
+    """
+    Test converting an array of a million values.
+    """
+
+    term = ast.expr(list(range(1000000)))
+
+    assert isinstance(term, ast.MakeArray)
+    assert len(term._args) == 1000000  # pylint: disable=protected-access
+    assert term._args[-1].data == 999999  # pylint: disable=protected-access
+
+
+def test_expr_nested_values():
+    """
+    Test the nested values are converted to the same terms as before.
+    """
+
+    class Document(abc.Mapping):
+        def __getitem__(self, key):
+            return {"id": 1}[key]
+
+        def __iter__(self):
+            return iter(["id"])
+
+        def __len__(self):
+            return 1
+
+    term = ast.expr({"list": [1, (2, "b")], "generator": (i for i in range(2))})
+    encoder = ReQLEncoder()
+
+    assert encoder.encode(term) == (
+        '{"list":[2,[1,[2,[2,"b"]]]],"generator":[2,[0,1]]}'
+    )
+    assert encoder.encode(ast.expr([Document(), b"a"])) == (
+        '[2,[{"id":1},{"$reql_type$":"BINARY","data":"YQ=="}]]'
+    )
+    assert isinstance(ast.expr([lambda doc: doc])._args[0], ast.Func)
+
+
+def test_expr_nesting_depth():
+    """
+    Test the nesting depth limit of `expr`.
+    """
+
+    assert isinstance(ast.expr([[[]]], 3), ast.MakeArray)
+    assert isinstance(ast.expr([[1]], 3)._args[0], ast.MakeArray)
+
+    with pytest.raises(ReqlDriverCompileError, match="Nesting depth limit exceeded."):
+        ast.expr([[1]], 2)
+
+    with pytest.raises(ReqlDriverCompileError, match="must be a number"):
+        ast.expr([], "1")
+
+
+def test_expr_primitive_containers():
+    """
+    Test the lists and the objects of primitive values are converted like the others,
+    within the same nesting depth limit.
+    """
+
+    encoder = ReQLEncoder()
+    term = ast.expr([{"a": 1, "b": None}, (1.5, "c", True), [{"d": [2]}]])
+
+    assert encoder.encode(term) == (
+        '[2,[{"a":1,"b":null},[2,[1.5,"c",true]],[2,[{"d":[2,[2]]}]]]]'
+    )
+    # pylint: disable=protected-access
+    assert term._args[0].kwargs["a"].data == 1
+    assert ast.expr({"a": 1}).kwargs["a"]._args == ()
+
+    with pytest.raises(ReqlDriverCompileError, match="Nesting depth limit exceeded."):
+        ast.expr([1], 1)
+
+    with pytest.raises(ReqlDriverCompileError, match="Nesting depth limit exceeded."):
+        ast.expr({"a": [1]}, 2)
+
+    with pytest.raises(ReqlDriverCompileError, match="Object keys must be strings."):
+        ast.expr([{1: 2}])
+
+
+def test_expr_invalid_key():
+    """
+    Test the keys of the nested objects must be strings.
+    """
+
+    with pytest.raises(ReqlDriverCompileError, match="Object keys must be strings."):
+        ast.expr([{"a": {1: 2}}])
+
+
+def test_func_identical_lambdas_serialized_identically():
+    """
+    Test the variable IDs depend only on the function, so identical functions are
+    serialized identically.
+    """
+
+    encoder = ReQLEncoder()
+    first = ast.expr(lambda doc: doc["score"] > 1)
+    second = ast.expr(lambda row: row["score"] > 1)
+
+    assert encoder.encode(first) == encoder.encode(second)
+    assert encoder.encode(first) == '[69,[[2,[1]],[21,[[170,[[10,[1]],"score"]],1]]]]'
+
+
+def test_func_nested_variable_ids():
+    """
+    Test the variables of nested functions are numbered after the variables of the
+    functions in their body, so the IDs of nested scopes never collide.
+    """
+
+    func = ast.expr(
+        lambda left, right: ast.expr([1]).map(
+            lambda item: ast.expr([2]).map(lambda other: [left, right, item, other])
+        )
+    )
+
+    assert func.build()[1][0] == [ast.P_TERM.MAKE_ARRAY, [3, 4]]
+    assert func.max_var_id == 4
+    assert str(func) == (
+        "lambda var_3, var_4: r.expr([1]).map(lambda var_2: "
+        "r.expr([2]).map(lambda var_1: [var_3, var_4, var_2, var_1]))"
+    )
+    assert not hasattr(ast.Func, "lock")
+
+
+def test_fingerprint():
+    """
+    Test the fingerprint is a stable hash of the query tree.
+    """
+
+    query = ast.Table("users").get_all(1, index="email")
+
+    assert query.fingerprint() == "77f0049c3faad51894276885d7686741"
+    assert (
+        query.fingerprint()
+        == ast.Table("users").get_all(1, index="email").fingerprint()
+    )
+    assert (
+        query.fingerprint()
+        != ast.Table("users").get_all(2, index="email").fingerprint()
+    )
+    assert (
+        query.fingerprint() != ast.Table("users").get_all(1, index="name").fingerprint()
+    )
+    assert ast.expr("1").fingerprint() != ast.expr(1).fingerprint()
+    assert ast.expr(1).fingerprint() != ast.expr(1.0).fingerprint()
+    assert (
+        ast.expr({"a": 1, "b": [2]}).fingerprint()
+        == ast.expr({"b": [2], "a": 1}).fingerprint()
+    )
+    assert (
+        ast.expr(lambda doc: doc["a"]).fingerprint()
+        == ast.expr(lambda row: row["a"]).fingerprint()
+    )
+
+
+def test_fingerprint_normalize_literals():
+    """
+    Test the literal values are normalized, while the names, the variables and the
+    optional arguments are kept.
+    """
+
+    def fingerprint(query):
+        return query.fingerprint(normalize_literals=True)
+
+    query = ast.Table("users").get_all(1, index="email").filter({"age": 30})
+
+    assert fingerprint(query) == fingerprint(
+        ast.Table("users").get_all("a", index="email").filter({"age": 31})
+    )
+    assert fingerprint(query) != fingerprint(
+        ast.Table("orders").get_all(1, index="email").filter({"age": 30})
+    )
+    assert fingerprint(query) != fingerprint(
+        ast.Table("users").get_all(1, index="name").filter({"age": 30})
+    )
+    assert fingerprint(query) != fingerprint(
+        ast.Table("users").get_all(1, index="email").filter({"name": 30})
+    )
+    assert fingerprint(query) != query.fingerprint()
+    assert fingerprint(ast.expr(lambda left, right: left)) != fingerprint(
+        ast.expr(lambda left, right: right)
+    )
+
+    users = ast.Table("users")
+
+    for make_query in (
+        lambda field: users.pluck(field),
+        lambda field: users.pluck([field, "id"]),
+        lambda field: users.without(field),
+        lambda field: users.has_fields(field),
+        lambda field: users.get(1).get_field(field),
+        lambda field: users.get(1)[field],
+        lambda field: users.order_by(field),
+        lambda field: users.order_by(ast.Desc(field)),
+        lambda field: users.order_by(index=field),
+    ):
+        assert fingerprint(make_query("a")) != fingerprint(make_query("b"))
+
+    assert fingerprint(users.get(1).pluck("a")) == fingerprint(users.get(2).pluck("a"))
+
+
+def test_fingerprint_memoized():
+    """
+    Test the fingerprint is memoized, and mutating a term drops it.
+    """
+
+    query = ast.Add(1, 2)
+    fingerprint = query.fingerprint()
+
+    query._args.append(ast.expr(3))  # pylint: disable=protected-access
+
+    assert query.fingerprint() == fingerprint
+
+    query.invalidate_fragment()
+
+    assert query.fingerprint() != fingerprint
+    assert query.fingerprint() == ast.Add(1, 2, 3).fingerprint()
+
+
+def test_fingerprint_keeps_fragment():
+    """
+    Test the fingerprint and the JSON of a term are memoized together, without one
+    dropping the other.
+    """
+
+    query = ast.Table("users").get(1)
+    encoder = ReQLEncoder()
+    fragment = encoder.encode_term(query)
+    fingerprint = query.fingerprint()
+
+    assert query.get_fragment() is fragment
+    assert query.fingerprint(normalize_literals=True) != fingerprint
+
+    query = ast.Table("users").get(2)
+    fingerprint = query.fingerprint()
+    fragment = encoder.encode_term(query)
+
+    # pylint: disable=protected-access
+    assert query._fragment[1:3] == (fragment, bytes.fromhex(fingerprint))
+
+
+def test_fingerprint_deep_query():
+    """
+    Test the fingerprint of queries deeper than the recursion limit.
+    """
+
+    query = ast.expr(0)
+
+    for _ in range(5000):
+        query = query + 1
+
+    assert len(query.fingerprint()) == 32
@@ -0,0 +1,473 @@
+import asyncio
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb import query as r
+from rethinkdb.batching import AsyncioGetBatcher, AsyncioInsertBuffer
+from rethinkdb.cache import ResultCache
+from rethinkdb.errors import (
+    ReqlDriverError,
+    ReqlOpFailedError,
+    ReqlQueryLogicError,
+)
+from rethinkdb.net_asyncio import connect
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from rethinkdb.tuning import AdaptiveBatchSizer
+from tests.helpers import FakeServer, atom_handler
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+P_TERM = ast.P_TERM
+
+
+def get_all_handler(server, token, message):
+    """
+    Reply to the `get_all` queries of the batcher with a document for every key,
+    except the key 404, to the `get` queries with the document of the key, and to
+    the other queries with the term itself. The key `null` is rejected.
+    """
+
+    if message[0] != P_QUERY.START:
+        return
+
+    term = message[1]
+
+    if term[0] == P_TERM.GET:
+        table, key = term[1]
+        keys = [key]
+    elif term[0] == P_TERM.COERCE_TO and term[1][0][0] == P_TERM.GET_ALL:
+        table, *keys = term[1][0][1]
+    else:
+        atom_handler(server, token, message)
+        return
+
+    if None in keys:
+        error = PResponse.ErrorType.QUERY_LOGIC
+        response = {"t": P_RESPONSE.RUNTIME_ERROR, "e": error, "r": ["Invalid key."]}
+        server.send(token, {**response, "b": []})
+        return
+
+    if table == [P_TERM.TABLE, ["broken"]]:
+        error = PResponse.ErrorType.OP_FAILED
+        response = {"t": P_RESPONSE.RUNTIME_ERROR, "e": error, "r": ["Missing."]}
+        server.send(token, {**response, "b": []})
+        return
+
+    documents = [
+        {"id": key[1] if isinstance(key, list) else key, "table": table[1][0]}
+        for key in keys
+        if key != 404
+    ]
+    if term[0] == P_TERM.GET:
+        documents = documents[0] if documents else None
+
+    server.send(token, {"t": P_RESPONSE.SUCCESS_ATOM, "r": [documents]})
+
+
+def insert_handler(server, token, message):
+    """
+    Reply to the `insert` queries like the server, generating the missing primary
+    keys and failing the documents with the primary key "dup". The changes are
+    returned in reverse order.
+    """
+
+    if message[0] != P_QUERY.START:
+        return
+
+    _, (_, (_, documents)), *options = message[1]
+    return_changes = (options or [{}])[0].get("return_changes", False)
+    result = {"inserted": 0, "errors": 0, "generated_keys": [], "changes": []}
+
+    for index, document in enumerate(documents):
+        if "id" not in document:
+            document = {**document, "id": f"generated-{index}"}
+            result["generated_keys"].append(document["id"])
+
+        if document["id"] == "dup":
+            error = "Duplicate primary key `id`."
+            result["errors"] += 1
+            result["first_error"] = error
+            change = {"old_val": {"id": "dup"}, "new_val": {"id": "dup"}}
+
+            if return_changes == "always":
+                result["changes"].insert(0, {**change, "error": error})
+        else:
+            result["inserted"] += 1
+
+            if return_changes:
+                result["changes"].insert(0, {"old_val": None, "new_val": document})
+
+    if not return_changes:
+        del result["changes"]
+
+    server.send(token, {"t": P_RESPONSE.SUCCESS_ATOM, "r": [result]})
+
+
+def run(scenario, batcher=AsyncioGetBatcher, handler=get_all_handler, **kwargs):
+    """
+    Run the scenario with a batcher of a connection to a server replying with the
+    handler, and return the scenario's result and the received queries.
+    """
+
+    async def main(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            return await scenario(batcher(conn, **kwargs))
+
+    with FakeServer(handler) as server:
+        result = asyncio.run(main(server.port))
+
+    return result, [message for _, message in server.queries]
+
+
+def test_load_batched():
+    """
+    Test the point reads of the tasks are sent as one `get_all` query, and every
+    task receives its own document.
+    """
+
+    async def scenario(batcher):
+        users = r.table("users")
+        keys = [1, 2, 1, 404, [3, "a"]]
+
+        return await asyncio.gather(*(batcher.load(users.get(key)) for key in keys))
+
+    results, queries = run(scenario)
+
+    assert results == [
+        {"id": 1, "table": "users"},
+        {"id": 2, "table": "users"},
+        {"id": 1, "table": "users"},
+        None,
+        {"id": [3, "a"], "table": "users"},
+    ]
+    assert results[0] is not results[2]
+    assert len(queries) == 1
+    assert queries[0][1][1][0][1][1:] == [1, 2, 404, [P_TERM.MAKE_ARRAY, [3, "a"]]]
+
+
+def test_load_batched_by_table_and_optargs():
+    """
+    Test the point reads are batched by table and global optional arguments.
+    """
+
+    async def scenario(batcher):
+        return await asyncio.gather(
+            batcher.load(r.table("users").get(1)),
+            batcher.load(r.table("users").get(2), read_mode="outdated"),
+            batcher.load(r.table("groups").get(3)),
+            batcher.load(r.table("users").get(4)),
+        )
+
+    results, queries = run(scenario)
+
+    assert [result["table"] for result in results] == [
+        "users",
+        "users",
+        "groups",
+        "users",
+    ]
+    assert sorted(len(query[1][1][0][1]) - 1 for query in queries) == [1, 1, 2]
+    assert [query[2] for query in queries].count({"read_mode": "outdated"}) == 1
+
+
+def test_load_max_batch_size():
+    """
+    Test a batch is sent as soon as it has `max_batch_size` keys.
+    """
+
+    async def scenario(batcher):
+        users = r.table("users")
+        return await asyncio.gather(*(batcher.load(users.get(key)) for key in range(5)))
+
+    results, queries = run(scenario, max_batch_size=2, max_delay=10)
+
+    assert [result["id"] for result in results] == [0, 1, 2, 3, 4]
+    assert len(queries) == 3
+
+
+def test_load_flush():
+    """
+    Test flushing sends the collected point reads before the end of the window.
+    """
+
+    async def scenario(batcher):
+        task = asyncio.ensure_future(batcher.load(r.table("users").get(1)))
+        await asyncio.sleep(0)
+        await batcher.flush()
+
+        return task.result()
+
+    result, _ = run(scenario, max_delay=10)
+
+    assert result == {"id": 1, "table": "users"}
+
+
+def test_load_not_batched():
+    """
+    Test the other queries, and the point reads with a key evaluated by the server,
+    are run as usual.
+    """
+
+    async def scenario(batcher):
+        return await asyncio.gather(
+            batcher.load(ast.expr("foo")),
+            batcher.load(r.table("users").get(r.table("keys").nth(0))),
+        )
+
+    results, queries = run(scenario)
+
+    assert results[0] == "foo"
+    assert sorted(query[1] for query in queries if isinstance(query[1], str)) == ["foo"]
+    assert [query[1][0] for query in queries if isinstance(query[1], list)] == [
+        P_TERM.GET
+    ]
+
+
+def test_load_error():
+    """
+    Test the error of a batch is raised in every task of the batch.
+    """
+
+    async def scenario(batcher):
+        broken = r.table("broken")
+        return await asyncio.gather(
+            batcher.load(broken.get(1)),
+            batcher.load(broken.get(2)),
+            return_exceptions=True,
+        )
+
+    results, queries = run(scenario)
+
+    assert [type(result) for result in results] == [ReqlOpFailedError] * 2
+    assert len(queries) == 1
+
+
+def test_load_invalid_key():
+    """
+    Test an invalid key raises its error only in the tasks which read it, as the
+    keys of the failed batch are read one by one.
+    """
+
+    async def scenario(batcher):
+        users = r.table("users")
+        return await asyncio.gather(
+            *(batcher.load(users.get(key)) for key in (1, None, 2)),
+            return_exceptions=True,
+        )
+
+    results, queries = run(scenario)
+
+    assert results[0] == {"id": 1, "table": "users"}
+    assert isinstance(results[1], ReqlQueryLogicError)
+    assert results[2] == {"id": 2, "table": "users"}
+    assert [query[1][0] for query in queries] == [P_TERM.COERCE_TO] + [P_TERM.GET] * 3
+
+
+def test_load_client_optargs():
+    """
+    Test the client-only options are passed to the batched run, and are not sent to
+    the server.
+    """
+
+    cache = ResultCache()
+    sizer = AdaptiveBatchSizer()
+
+    async def scenario(batcher):
+        users = r.table("users")
+        return await asyncio.gather(
+            *(
+                batcher.load(users.get(key), result_cache=cache, batch_sizer=sizer)
+                for key in (1, 2)
+            ),
+            batcher.load(users.get(3), prefetch=True),
+        )
+
+    results, queries = run(scenario)
+
+    assert [result["id"] for result in results] == [1, 2, 3]
+    assert sorted(len(query[1][1][0][1]) - 1 for query in queries) == [1, 2]
+    assert [query[2] for query in queries] == [{}, {}]
+    assert len(cache) == 1
+
+
+@pytest.mark.parametrize("kwargs", [{"max_batch_size": 0}, {"max_delay": -1}])
+@pytest.mark.parametrize("batcher", [AsyncioGetBatcher, AsyncioInsertBuffer])
+def test_invalid_window(batcher, kwargs):
+    """
+    Test the batch window must be positive.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        batcher(None, **kwargs)
+
+
+def insert_all(buffer, *documents, table="events"):
+    """
+    Insert the documents concurrently, and return their write results.
+    """
+
+    return asyncio.gather(
+        *(buffer.insert(r.table(table), document) for document in documents),
+        return_exceptions=True,
+    )
+
+
+def test_insert_buffered():
+    """
+    Test the documents of the tasks are written by one `insert` query per table,
+    and every task receives the write result of its document.
+    """
+
+    async def scenario(buffer):
+        return await asyncio.gather(
+            insert_all(buffer, {"id": 1}, {"value": "a"}, {"value": "b"}),
+            insert_all(buffer, {"id": 2}, table="metrics"),
+        )
+
+    (events, metrics), queries = run(
+        scenario, AsyncioInsertBuffer, insert_handler, durability="soft"
+    )
+
+    assert [result["inserted"] for result in events + metrics] == [1, 1, 1, 1]
+    assert [result.get("generated_keys") for result in events] == [
+        None,
+        ["generated-1"],
+        ["generated-2"],
+    ]
+    assert sorted(len(query[1][1][1][1]) for query in queries) == [1, 3]
+    assert [query[1][2] for query in queries] == [{"durability": "soft"}] * 2
+
+
+def test_insert_return_changes():
+    """
+    Test the changes and the errors are handed to the documents by primary key.
+    """
+
+    async def scenario(buffer):
+        return await insert_all(buffer, {"id": 1}, {"id": "dup"}, {"value": "a"})
+
+    results, _ = run(
+        scenario, AsyncioInsertBuffer, insert_handler, return_changes="always"
+    )
+
+    assert [result["changes"][0]["new_val"]["id"] for result in results] == [
+        1,
+        "dup",
+        "generated-2",
+    ]
+    assert [(result["inserted"], result["errors"]) for result in results] == [
+        (1, 0),
+        (0, 1),
+        (1, 0),
+    ]
+    assert results[1]["first_error"] == "Duplicate primary key `id`."
+
+
+def test_insert_unattributed_errors():
+    """
+    Test every task receives the write result of the batch when the server reports
+    errors without telling which documents failed.
+    """
+
+    async def scenario(buffer):
+        return await insert_all(buffer, {"id": 1}, {"id": "dup"})
+
+    results, _ = run(scenario, AsyncioInsertBuffer, insert_handler)
+
+    assert results[0] == results[1]
+    assert (results[0]["inserted"], results[0]["errors"]) == (1, 1)
+    assert results[0] is not results[1]
+
+
+def test_insert_max_batch_size():
+    """
+    Test a batch is written as soon as it has `max_batch_size` documents.
+    """
+
+    async def scenario(buffer):
+        return await insert_all(buffer, *({"id": key} for key in range(5)))
+
+    results, queries = run(
+        scenario, AsyncioInsertBuffer, insert_handler, max_batch_size=2, max_delay=10
+    )
+
+    assert [result["inserted"] for result in results] == [1] * 5
+    assert [len(query[1][1][1][1]) for query in queries] == [2, 2, 1]
+
+
+def test_insert_error():
+    """
+    Test the error of a batch is raised in every task of the batch.
+    """
+
+    async def scenario(buffer):
+        return await insert_all(buffer, {"id": 1}, {"id": 2}, table="broken")
+
+    def handler(server, token, message):
+        error = PResponse.ErrorType.OP_FAILED
+        response = {"t": P_RESPONSE.RUNTIME_ERROR, "e": error, "r": ["Failed."]}
+        server.send(token, {**response, "b": []})
+
+    results, queries = run(scenario, AsyncioInsertBuffer, handler)
+
+    assert [type(result) for result in results] == [ReqlOpFailedError] * 2
+    assert len(queries) == 1
+
+
+class GatedConnection:
+    """
+    Connection answering the inserts once the test opens the gate, recording the
+    documents of every query.
+    """
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.batches = []
+
+    async def _start(self, term, **global_optargs):
+        # pylint: disable=protected-access
+        documents = term._args[1].data
+        self.batches.append(len(documents))
+        await self.gate.wait()
+
+        return {"inserted": len(documents), "errors": 0}
+
+
+def test_insert_backpressure():
+    """
+    Test `insert` waits once `max_pending` documents are buffered or being written.
+    """
+
+    async def main():
+        connection = GatedConnection()
+        buffer = AsyncioInsertBuffer(
+            connection, max_batch_size=2, max_delay=0, max_pending=2
+        )
+        tasks = [
+            asyncio.ensure_future(buffer.insert(r.table("events"), {"id": key}))
+            for key in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        blocked = list(connection.batches)
+
+        connection.gate.set()
+        await asyncio.gather(*tasks)
+        await buffer.flush()
+
+        return blocked, connection.batches
+
+    blocked, batches = asyncio.run(main())
+
+    assert blocked == [2]
+    assert batches == [2, 1]
+
+
+def test_invalid_buffer_size():
+    """
+    Test the buffer must hold at least one batch.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        AsyncioInsertBuffer(None, max_batch_size=10, max_pending=5)
@@ -0,0 +1,580 @@
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb import query as r
+from rethinkdb.cache import (
+    MISSING,
+    UNCACHEABLE_TERM_TYPES,
+    AsyncioSingleFlight,
+    AsyncioTableCache,
+    ResultCache,
+    SingleFlight,
+    TableCache,
+    is_cacheable,
+)
+from rethinkdb.errors import ReqlDriverError, ReqlNonExistenceError, ReqlTimeoutError
+from rethinkdb.net import connect
+from rethinkdb.net_asyncio import connect as connect_asyncio
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from tests.helpers import FakeServer, atom_handler
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+
+
+class FakeClock:
+    """
+    Clock advanced by the tests.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_and_put():
+    """
+    Test the cached results are returned and counted.
+    """
+
+    cache = ResultCache()
+
+    assert cache.get("a") is None
+    assert cache.get("a", MISSING) is MISSING
+
+    cache.put("a", None)
+
+    assert cache.get("a", MISSING) is None
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 1)
+
+    cache.invalidate("a")
+
+    assert cache.get("a", MISSING) is MISSING
+
+
+def test_lru_eviction():
+    """
+    Test the least recently used result is evicted once the cache is full.
+    """
+
+    cache = ResultCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b", MISSING) is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_ttl_expiry():
+    """
+    Test the results expire once their time to live passed.
+    """
+
+    clock = FakeClock()
+    cache = ResultCache(ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 9.9
+
+    assert cache.get("a") == 1
+
+    clock.now = 10
+
+    assert cache.get("a", MISSING) is MISSING
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize("kwargs", [{"max_size": 0}, {"ttl": 0}])
+def test_invalid_configuration(kwargs):
+    """
+    Test the size and the time to live of the cache must be positive.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ResultCache(**kwargs)
+
+
+UNCACHEABLE_TERMS = [
+    r.table("users").insert({"id": 1}),
+    r.table("users").get(1).update({"a": 1}),
+    r.table("users").get(1).replace({"id": 1}),
+    r.table("users").get(1).delete(),
+    r.table("users").for_each(lambda doc: r.table("logs").insert(doc)),
+    r.table("users").sync(),
+    r.db_create("app"),
+    r.db_drop("app"),
+    r.table_create("users"),
+    r.table_drop("users"),
+    r.table("users").index_create("email"),
+    r.table("users").index_drop("email"),
+    r.table("users").index_rename("email", "mail"),
+    r.table("users").index_wait(),
+    r.table("users").reconfigure(shards=2, replicas=1),
+    r.table("users").rebalance(),
+    r.table("users").wait(),
+    r.grant("alice", {"read": True}),
+    r.table("users").set_write_hook(None),
+    r.random(),
+    r.table("users").sample(2),
+    r.table("users").filter(lambda doc: doc["created"] < r.now()),
+    r.table("users").map(lambda doc: r.uuid()),
+    r.http("http://example.com"),
+    r.js("1"),
+    r.table("users").changes(),
+    r.prepare(lambda p: r.table("users").insert(p.doc)).bind(doc={}),
+]
+
+
+@pytest.mark.parametrize("term", UNCACHEABLE_TERMS)
+def test_uncacheable_terms(term):
+    """
+    Test the writes and the non-deterministic queries are not cached.
+    """
+
+    assert is_cacheable(term) is False
+    assert ResultCache.make_key(term) is None
+
+
+def test_uncacheable_terms_covered():
+    """
+    Test every uncacheable term type is tested.
+    """
+
+    term_types = set()
+
+    for term in UNCACHEABLE_TERMS:
+        pending = [getattr(term, "query", term)]
+
+        while pending:
+            current = pending.pop()
+            term_types.add(current.term_type)
+            # pylint: disable=protected-access
+            pending.extend(current._args)
+            pending.extend(current.kwargs.values())
+
+    assert UNCACHEABLE_TERM_TYPES <= term_types
+
+
+def test_make_key():
+    """
+    Test the key depends on the query, its global optional arguments and the
+    response format.
+    """
+
+    term = r.table("users").get(1)
+    key = ResultCache.make_key(term)
+
+    assert is_cacheable(r.table("users").get_all(1, 2, index="email")) is True
+    assert key == ResultCache.make_key(r.table("users").get(1), {})
+    assert key != ResultCache.make_key(r.table("users").get(2))
+    assert key != ResultCache.make_key(term, {"read_mode": "outdated"})
+    assert key != ResultCache.make_key(term, response_format="lazy")
+    assert ResultCache.make_key(term, {"noreply": True}) is None
+    assert ResultCache.make_key(term, {"profile": True}) is None
+    assert ResultCache.make_key(term, response_format="raw") is None
+
+
+def test_run_cached():
+    """
+    Test the repeated read queries are answered by the cache, with a copy of the
+    cached result.
+    """
+
+    cache = ResultCache()
+
+    with FakeServer(atom_handler) as server:
+        conn = connect(
+            host="127.0.0.1", port=server.port, timeout=5, result_cache=cache
+        )
+
+        first = ast.expr({"a": {"b": 1}}).run(conn)
+        first["a"]["c"] = 2
+        second = ast.expr({"a": {"b": 1}}).run(conn)
+
+        assert second == {"a": {"b": 1}}
+        assert ast.expr({"a": {"b": 1}}).run(conn, result_cache=None) == second
+        assert r.random().run(conn) == [ast.P_TERM.RANDOM, []]
+        assert r.random().run(conn) == [ast.P_TERM.RANDOM, []]
+
+        conn.use("other")
+        ast.expr({"a": {"b": 1}}).run(conn)
+        conn.close(noreply_wait=False)
+
+    assert len(server.queries) == 5
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def sequence_handler(server, token, message):
+    """
+    Reply to the `get_all` queries with a complete sequence, and to the other
+    queries with a sequence of two batches.
+    """
+
+    if message[0] == P_QUERY.START and message[1][0] == ast.P_TERM.GET_ALL:
+        server.send(
+            token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": [{"id": 1}, {"id": 2}]}
+        )
+    elif message[0] == P_QUERY.START:
+        server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": [1]})
+    elif message[0] == P_QUERY.CONTINUE:
+        server.send(token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": [2]})
+
+
+def test_run_cached_sequence():
+    """
+    Test the sequences completed by their first response are cached, and every
+    caller receives its own cursor over a copy of the rows, while the sequences of
+    several batches are not cached.
+    """
+
+    cache = ResultCache()
+
+    with FakeServer(sequence_handler) as server:
+        conn = connect(
+            host="127.0.0.1", port=server.port, timeout=5, result_cache=cache
+        )
+
+        first = list(r.table("users").get_all(1, 2).run(conn))
+        first[0]["id"] = 3
+        second = r.table("users").get_all(1, 2).run(conn)
+
+        assert list(second) == [{"id": 1}, {"id": 2}]
+        assert list(r.table("users").get_all(1, 2).run(conn)) == [{"id": 1}, {"id": 2}]
+
+        for _ in range(2):
+            assert list(r.table("users").run(conn)) == [1, 2]
+
+        conn.close(noreply_wait=False)
+
+    assert len(server.queries) == 5
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert len(cache) == 1
+
+
+def test_run_cached_asyncio():
+    """
+    Test the asyncio connections use the cache passed as a run option.
+    """
+
+    cache = ResultCache()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5
+        ) as conn:
+            for _ in range(3):
+                assert await ast.expr("foo").run(conn, result_cache=cache) == "foo"
+
+    with FakeServer(atom_handler) as server:
+        asyncio.run(scenario(server.port))
+
+    assert len(server.queries) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def changefeed_handler(initial, responses):
+    """
+    Return a handler answering START with the initial documents of a changefeed,
+    and CONTINUE with the next response put in the `responses` queue. A `None`
+    response leaves the CONTINUE unanswered.
+    """
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            changes = [{"new_val": document} for document in initial]
+            batch = [{"state": "initializing"}, *changes, {"state": "ready"}]
+            server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": batch})
+        elif message[0] == P_QUERY.CONTINUE:
+            try:
+                response = responses.get(timeout=5)
+            except queue.Empty:
+                return
+
+            if response is not None:
+                server.send(token, response)
+        elif message[0] == P_QUERY.STOP:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": []})
+
+    return handler
+
+
+def partial(*changes):
+    """
+    Return a response of the changefeed with the changes.
+    """
+
+    return {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": list(changes)}
+
+
+def wait_until(predicate):
+    """
+    Wait until the predicate is true.
+    """
+
+    deadline = time.monotonic() + 5
+
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_table_cache():
+    """
+    Test the documents are loaded once and kept fresh by the changefeed.
+    """
+
+    responses = queue.Queue()
+    initial = [{"id": 1, "enabled": True}, {"id": [2, "a"], "enabled": True}]
+
+    with FakeServer(changefeed_handler(initial, responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+
+        with TableCache(r.table("flags"), conn, poll_interval=0.01) as cache:
+            assert cache.is_ready is True
+            assert len(cache) == 2
+            assert cache.get([2, "a"]) == {"id": [2, "a"], "enabled": True}
+
+            cache.get(1)["enabled"] = False
+
+            assert cache.get(1) == {"id": 1, "enabled": True}
+
+            responses.put(
+                partial(
+                    {"old_val": initial[0], "new_val": {"id": 1, "enabled": False}},
+                    {"old_val": initial[1], "new_val": None},
+                    {"new_val": {"id": 3, "enabled": True}},
+                )
+            )
+            wait_until(lambda: 3 in cache)
+
+            assert [document["id"] for document in cache.values()] == [1, 3]
+            assert cache.get(1) == {"id": 1, "enabled": False}
+            assert cache.get([2, "a"], MISSING) is MISSING
+
+            responses.put(None)
+
+        with pytest.raises(ReqlDriverError, match="not loaded"):
+            cache.get(1)
+
+        conn.close(noreply_wait=False)
+
+    _, message = server.queries[0]
+    assert message[1][2] == {"include_initial": True, "include_states": True}
+    assert [query[0] for _, query in server.queries].count(P_QUERY.START) == 1
+
+
+def test_table_cache_feed_error():
+    """
+    Test the documents are not read anymore once the changefeed failed.
+    """
+
+    responses = queue.Queue()
+    responses.put(
+        {"t": P_RESPONSE.RUNTIME_ERROR, "e": 3000000, "r": ["Table dropped."], "b": []}
+    )
+
+    with FakeServer(changefeed_handler([{"id": 1}], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cache = TableCache(r.table("flags"), conn, poll_interval=0.01).start()
+
+        wait_until(lambda: cache.error is not None)
+
+        assert cache.is_ready is False
+
+        with pytest.raises(ReqlDriverError, match="Table dropped."):
+            cache.get(1)
+
+        cache.close()
+        conn.close(noreply_wait=False)
+
+
+def test_table_cache_start_timeout():
+    """
+    Test waiting for the documents to be loaded can time out.
+    """
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            batch = [{"state": "initializing"}]
+            server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": batch})
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+
+        with pytest.raises(ReqlTimeoutError):
+            TableCache(r.table("flags"), conn).start(timeout=0.05)
+
+        conn.close(noreply_wait=False)
+
+
+def test_asyncio_table_cache():
+    """
+    Test the asyncio table cache follows the changefeed in a task.
+    """
+
+    responses = queue.Queue()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5
+        ) as conn:
+            selection = r.table("users").get_all("admin", index="role")
+
+            async with AsyncioTableCache(selection, conn) as cache:
+                assert cache.get(1) == {"id": 1}
+
+                responses.put(partial({"new_val": {"id": 2}}))
+
+                while 2 not in cache:
+                    await asyncio.sleep(0.01)
+
+                responses.put(None)
+
+            assert cache.is_ready is False
+
+    with FakeServer(changefeed_handler([{"id": 1}], responses)) as server:
+        asyncio.run(scenario(server.port))
+
+
+def delayed_handler(response_type=P_RESPONSE.SUCCESS_ATOM, delay=0.05):
+    """
+    Return a handler replying to START with the term after a delay, so the
+    identical queries started meanwhile are coalesced.
+    """
+
+    def handler(server, token, message):
+        if message[0] != P_QUERY.START:
+            return
+
+        time.sleep(delay)
+
+        if response_type == P_RESPONSE.RUNTIME_ERROR:
+            error = PResponse.ErrorType.NON_EXISTENCE
+            response = {"t": response_type, "e": error, "r": ["Not found."], "b": []}
+        else:
+            response = {"t": response_type, "r": [message[1]]}
+
+        server.send(token, response)
+
+    return handler
+
+
+def test_run_coalesced():
+    """
+    Test the identical queries of many threads share one round trip, and each
+    thread receives its own copy of the result.
+    """
+
+    single_flight = SingleFlight()
+    released = threading.Event()
+    results = []
+
+    def handler(server, token, message):
+        released.wait(5)
+        atom_handler(server, token, message)
+
+    with FakeServer(handler) as server:
+        conn = connect(
+            host="127.0.0.1", port=server.port, timeout=5, single_flight=single_flight
+        )
+
+        def run():
+            results.append(ast.expr({"id": 1}).run(conn))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        wait_until(lambda: single_flight.coalesced == 3)
+        released.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        conn.close(noreply_wait=False)
+
+    assert len(server.queries) == 1
+    assert results == [{"id": 1}] * 4
+    assert len({id(result) for result in results}) == 4
+    assert len(single_flight) == 0
+
+
+def test_run_coalesced_asyncio():
+    """
+    Test the identical queries of many tasks share one round trip, while the other
+    queries are run as usual.
+    """
+
+    single_flight = AsyncioSingleFlight()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5, single_flight=single_flight
+        ) as conn:
+            return await asyncio.gather(
+                *(ast.expr(value).run(conn) for value in ["a", "a", "a", "b"])
+            )
+
+    with FakeServer(delayed_handler()) as server:
+        assert asyncio.run(scenario(server.port)) == ["a", "a", "a", "b"]
+
+    assert len(server.queries) == 2
+    assert single_flight.coalesced == 2
+
+
+def test_run_coalesced_error():
+    """
+    Test the error of the leader is raised by the coalesced queries too.
+    """
+
+    single_flight = AsyncioSingleFlight()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5
+        ) as conn:
+            return await asyncio.gather(
+                *(ast.expr(1).run(conn, single_flight=single_flight) for _ in range(3)),
+                return_exceptions=True,
+            )
+
+    with FakeServer(delayed_handler(P_RESPONSE.RUNTIME_ERROR)) as server:
+        results = asyncio.run(scenario(server.port))
+
+    assert [type(result) for result in results] == [ReqlNonExistenceError] * 3
+    assert len(server.queries) == 1
+
+
+def test_run_coalesced_cursor():
+    """
+    Test the coalesced queries share a sequence completed by the first response of
+    the leader, each with its own cursor.
+    """
+
+    single_flight = AsyncioSingleFlight()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5, single_flight=single_flight
+        ) as conn:
+            cursors = await asyncio.gather(*(ast.expr(1).run(conn) for _ in range(3)))
+
+            assert len({id(cursor) for cursor in cursors}) == 3
+            return [[item async for item in cursor] for cursor in cursors]
+
+    with FakeServer(delayed_handler(P_RESPONSE.SUCCESS_SEQUENCE)) as server:
+        assert asyncio.run(scenario(server.port)) == [[1]] * 3
+
+    assert len(server.queries) == 1
+    assert single_flight.coalesced == 2
@@ -0,0 +1,583 @@
+import asyncio
+import queue
+import socket
+
+import pytest
+
+from rethinkdb import query as r
+from rethinkdb.changefeeds import (
+    AsyncioChangefeedHub,
+    AsyncioResumableFeed,
+    ChangefeedHub,
+    ResumableFeed,
+)
+from rethinkdb.errors import (
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlNonExistenceError,
+    ReqlOpFailedError,
+    ReqlTimeoutError,
+)
+from rethinkdb.net import connect
+from rethinkdb.net_asyncio import connect as connect_asyncio
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from rethinkdb.tuning import AdaptiveBatchSizer
+from tests.helpers import FakeServer
+from tests.test_cache import changefeed_handler, partial, wait_until
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+
+INITIALIZING = {"state": "initializing"}
+READY = {"state": "ready"}
+
+
+def query_types(server):
+    """
+    Return the types of the queries received by the server.
+    """
+
+    return [message[0] for _, message in server.queries]
+
+
+def next_change(subscription):
+    """
+    Return the next change of the subscription which is not a state, as a late
+    subscriber may not receive the states.
+    """
+
+    while True:
+        change = subscription.next(wait=1)
+
+        if "state" not in change:
+            return change
+
+
+async def anext_change(subscription):
+    """
+    Return the next change of the asyncio subscription which is not a state.
+    """
+
+    while True:
+        change = await subscription.next(wait=1)
+
+        if "state" not in change:
+            return change
+
+
+def test_subscribe_shared():
+    """
+    Test the subscribers of a query share one changefeed, which is stopped once the
+    last subscriber is closed. The subscribers with `copy_changes` receive their own
+    copy of the changes.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        hub = ChangefeedHub(conn)
+        first = hub.subscribe(r.table("flags").changes())
+        second = hub.subscribe(r.table("flags").changes(), copy_changes=True)
+
+        assert len(hub) == 1
+        assert [first.next(wait=1), first.next(wait=1)] == [INITIALIZING, READY]
+
+        responses.put(partial({"new_val": {"id": 1}}))
+
+        change = first.next(wait=1)
+        assert change == {"new_val": {"id": 1}}
+
+        change["new_val"]["id"] = 2
+
+        assert next_change(second) == {"new_val": {"id": 1}}
+
+        first.close()
+
+        with pytest.raises(ReqlCursorEmpty):
+            first.next()
+
+        assert len(hub) == 1
+
+        responses.put(None)
+        second.close()
+
+        assert len(hub) == 0
+        wait_until(lambda: P_QUERY.STOP in query_types(server))
+
+        conn.close(noreply_wait=False)
+
+    assert query_types(server).count(P_QUERY.START) == 1
+
+
+def test_subscribe_by_query():
+    """
+    Test the queries and global optional arguments differing start their own
+    changefeeds, while the client-only options do not.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+
+        hub = ChangefeedHub(conn)
+
+        # Leave the CONTINUE queries unanswered without holding back the next START
+        for _ in range(3):
+            responses.put(None)
+
+        hub.subscribe(r.table("flags").changes())
+        hub.subscribe(r.table("flags").changes(), read_mode="outdated")
+        hub.subscribe(r.table("users").changes())
+        hub.subscribe(
+            r.table("flags").changes(),
+            batch_sizer=AdaptiveBatchSizer(),
+            prefetch=True,
+        )
+
+        assert len(hub) == 3
+
+        hub.close()
+
+        assert len(hub) == 0
+
+        conn.close(noreply_wait=False)
+
+    assert query_types(server).count(P_QUERY.START) == 3
+
+
+@pytest.mark.parametrize(
+    "overflow, queued",
+    [("drop_oldest", [2, 3]), ("drop_newest", [INITIALIZING, READY])],
+)
+def test_subscribe_overflow_drop(overflow, queued):
+    """
+    Test the changes of a full queue are dropped as the overflow policy says.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        hub = ChangefeedHub(conn)
+        subscription = hub.subscribe(
+            r.table("flags").changes(), max_queued=2, overflow=overflow
+        )
+
+        responses.put(partial(1, 2, 3))
+        wait_until(lambda: subscription.dropped == 3)
+
+        assert [subscription.next(wait=1) for _ in range(2)] == queued
+
+        with pytest.raises(ReqlTimeoutError):
+            subscription.next(wait=0.05)
+
+        responses.put(None)
+        hub.close()
+        conn.close(noreply_wait=False)
+
+
+def test_subscribe_overflow_block():
+    """
+    Test the changefeed waits for a subscriber whose queue is full with the "block"
+    policy, so no change is dropped.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        hub = ChangefeedHub(conn)
+        subscription = hub.subscribe(r.table("flags").changes(), max_queued=1)
+
+        responses.put(partial(1, 2, 3))
+        wait_until(lambda: len(subscription) == 1)
+
+        assert [subscription.next(wait=1) for _ in range(5)] == [
+            INITIALIZING,
+            READY,
+            1,
+            2,
+            3,
+        ]
+        assert subscription.dropped == 0
+
+        responses.put(None)
+        hub.close()
+        conn.close(noreply_wait=False)
+
+
+def test_subscribe_feed_error():
+    """
+    Test the error of the changefeed is raised by the subscribers once their queued
+    changes are consumed, and the next subscriber starts a new changefeed.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        hub = ChangefeedHub(conn)
+        subscription = hub.subscribe(r.table("flags").changes())
+
+        error = PResponse.ErrorType.NON_EXISTENCE
+        responses.put({"t": P_RESPONSE.RUNTIME_ERROR, "e": error, "r": ["Gone."]})
+
+        assert subscription.next(wait=1) == INITIALIZING
+        assert subscription.next(wait=1) == READY
+
+        with pytest.raises(ReqlNonExistenceError):
+            subscription.next(wait=1)
+
+        hub.subscribe(r.table("flags").changes())
+
+        assert query_types(server).count(P_QUERY.START) == 2
+
+        responses.put(None)
+        hub.close()
+        conn.close(noreply_wait=False)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"max_queued": 0}, {"overflow": "drop"}, {"overflow": None}]
+)
+def test_invalid_subscription(kwargs):
+    """
+    Test the subscriptions reject invalid queues.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ChangefeedHub(None).subscribe(r.table("flags").changes(), **kwargs)
+
+
+def test_asyncio_subscribe_shared():
+    """
+    Test the subscribers of the asyncio hub share one changefeed, which is stopped
+    once the last subscriber is closed, and the changes with one another unless they
+    set `copy_changes`.
+    """
+
+    responses = queue.Queue()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5
+        ) as conn:
+            hub = AsyncioChangefeedHub(conn)
+            first, second, third = await asyncio.gather(
+                hub.subscribe(r.table("flags").changes()),
+                hub.subscribe(
+                    r.table("flags").changes(),
+                    overflow="drop_oldest",
+                    copy_changes=True,
+                ),
+                hub.subscribe(r.table("flags").changes(), prefetch=True),
+            )
+
+            assert len(hub) == 1
+
+            responses.put(partial({"new_val": {"id": 1}}))
+
+            async with first:
+                changes = [await first.next(wait=1) for _ in range(3)]
+
+            assert changes == [INITIALIZING, READY, {"new_val": {"id": 1}}]
+
+            changes[2]["new_val"]["id"] = 2
+
+            assert len(hub) == 1
+            assert await anext_change(second) == {"new_val": {"id": 1}}
+            assert await anext_change(third) is changes[2]
+
+            await third.close()
+
+            responses.put(None)
+            await second.close()
+
+            assert len(hub) == 0
+
+            with pytest.raises(ReqlCursorEmpty):
+                await second.next()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        asyncio.run(scenario(server.port))
+
+    assert query_types(server).count(P_QUERY.START) == 1
+    assert P_QUERY.STOP in query_types(server)
+
+
+def drop_clients(server):
+    """
+    Break the connections of the server's clients.
+    """
+
+    for client in server.clients:
+        client.shutdown(socket.SHUT_RDWR)
+
+
+def test_resumable_reconnect():
+    """
+    Test the resumable changefeed reconnects once the connection broke, and receives
+    the differences between the last known documents and the restarted changefeed.
+    """
+
+    initial = [{"id": 1, "v": 1}, {"id": 2, "v": 1}]
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler(initial, responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        feed = ResumableFeed(r.table("flags"), conn, min_backoff=0.01)
+
+        assert [feed.next(wait=1), feed.next(wait=1)] == [
+            {"old_val": None, "new_val": {"id": 1, "v": 1}},
+            {"old_val": None, "new_val": {"id": 2, "v": 1}},
+        ]
+        assert feed.is_ready
+
+        update = {"old_val": {"id": 1, "v": 1}, "new_val": {"id": 1, "v": 2}}
+        responses.put(partial(update))
+
+        assert feed.next(wait=1) == update
+
+        initial[:] = [{"id": 1, "v": 2}, {"id": 3, "v": 1}]
+        responses.put(None)
+        drop_clients(server)
+
+        assert [feed.next(wait=1), feed.next(wait=1)] == [
+            {"old_val": None, "new_val": {"id": 3, "v": 1}},
+            {"old_val": {"id": 2, "v": 1}, "new_val": None},
+        ]
+        assert feed.restarts == 1
+        assert conn.is_open()
+
+        responses.put(None)
+        feed.close()
+
+        with pytest.raises(ReqlCursorEmpty):
+            feed.next()
+
+        conn.close(noreply_wait=False)
+
+    assert query_types(server).count(P_QUERY.START) == 2
+
+
+def test_resumable_error_item():
+    """
+    Test the resumable changefeed is restarted on the same connection when the
+    server reports lost changes.
+    """
+
+    initial = [{"id": 1}]
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler(initial, responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+
+        with ResumableFeed(r.table("flags"), conn) as feed:
+            assert feed.next(wait=1) == {"old_val": None, "new_val": {"id": 1}}
+
+            initial.append({"id": 2})
+            responses.put(partial({"error": "Changefeed cache over array size limit"}))
+
+            assert feed.next(wait=1) == {"old_val": None, "new_val": {"id": 2}}
+            assert feed.restarts == 1
+
+            responses.put(None)
+
+        conn.close(noreply_wait=False)
+
+    assert query_types(server).count(P_QUERY.START) == 2
+    assert len(server.clients) == 1
+
+
+def test_resumable_squash():
+    """
+    Test the changes of a document received within the squash window are coalesced.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        feed = ResumableFeed(r.table("flags"), conn, squash=0.1)
+
+        responses.put(
+            partial(
+                {"new_val": {"id": 1, "v": 1}},
+                {"old_val": {"id": 1, "v": 1}, "new_val": {"id": 1, "v": 2}},
+                {"new_val": {"id": 2}},
+                {"old_val": {"id": 2}},
+                {"new_val": {"id": 3}},
+                {"old_val": {"id": 4, "v": 1}, "new_val": {"id": 4, "v": 2}},
+                {"old_val": {"id": 4, "v": 2}, "new_val": {"id": 4, "v": 1}},
+            )
+        )
+
+        assert [feed.next(wait=1), feed.next(wait=1)] == [
+            {"old_val": None, "new_val": {"id": 1, "v": 2}},
+            {"old_val": None, "new_val": {"id": 3}},
+        ]
+
+        with pytest.raises(ReqlTimeoutError):
+            feed.next(wait=0.2)
+
+        responses.put(None)
+        feed.close()
+        conn.close(noreply_wait=False)
+
+
+def test_resumable_retries():
+    """
+    Test the resumable changefeed fails on the errors it cannot recover from, and
+    once the attempts to restart it are exhausted.
+    """
+
+    responses = queue.Queue()
+
+    with FakeServer(changefeed_handler([{"id": 1}], responses)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        feed = ResumableFeed(r.table("flags"), conn)
+
+        assert feed.next(wait=1) == {"old_val": None, "new_val": {"id": 1}}
+
+        error = PResponse.ErrorType.NON_EXISTENCE
+        responses.put({"t": P_RESPONSE.RUNTIME_ERROR, "e": error, "r": ["Gone."]})
+
+        with pytest.raises(ReqlNonExistenceError):
+            feed.next(wait=1)
+
+        with pytest.raises(ReqlNonExistenceError):
+            feed.next(wait=1)
+
+        conn.close(noreply_wait=False)
+
+    assert feed.restarts == 0
+
+    unavailable = {
+        "t": P_RESPONSE.RUNTIME_ERROR,
+        "e": PResponse.ErrorType.OP_FAILED,
+        "r": ["Table unavailable."],
+    }
+    feed_handler = changefeed_handler([{"id": 1}], responses)
+    started = []
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            started.append(token)
+
+            if len(started) > 1:
+                server.send(token, unavailable)
+                return
+
+        feed_handler(server, token, message)
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        feed = ResumableFeed(r.table("flags"), conn, min_backoff=0.01, max_retries=2)
+
+        assert feed.next(wait=1) == {"old_val": None, "new_val": {"id": 1}}
+
+        responses.put(None)
+        drop_clients(server)
+
+        with pytest.raises(ReqlOpFailedError):
+            feed.next(wait=5)
+
+        with pytest.raises(ReqlOpFailedError):
+            feed.next(wait=5)
+
+        assert feed.restarts == 1
+        conn.close(noreply_wait=False)
+
+    assert query_types(server).count(P_QUERY.START) == 4
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"squash": -1},
+        {"min_backoff": 0},
+        {"min_backoff": 2, "max_backoff": 1},
+        {"max_retries": -1},
+    ],
+)
+def test_invalid_resumable_feed(kwargs):
+    """
+    Test the resumable changefeeds reject invalid settings.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ResumableFeed(r.table("flags"), None, **kwargs)
+
+
+def test_asyncio_resumable_reconnect():
+    """
+    Test the asyncio resumable changefeed reconnects once the connection broke, and
+    receives the differences with the restarted changefeed.
+    """
+
+    initial = [{"id": 1}, {"id": 2}]
+    responses = queue.Queue()
+
+    async def scenario(server):
+        conn = await connect_asyncio(host="127.0.0.1", port=server.port, timeout=5)
+
+        async with AsyncioResumableFeed(
+            r.table("flags"), conn, min_backoff=0.01
+        ) as feed:
+            assert [await feed.next(wait=1), await feed.next(wait=1)] == [
+                {"old_val": None, "new_val": {"id": 1}},
+                {"old_val": None, "new_val": {"id": 2}},
+            ]
+
+            initial[:] = [{"id": 1, "v": 2}]
+            responses.put(None)
+            drop_clients(server)
+
+            assert [await feed.next(wait=1), await feed.next(wait=1)] == [
+                {"old_val": {"id": 1}, "new_val": {"id": 1, "v": 2}},
+                {"old_val": {"id": 2}, "new_val": None},
+            ]
+            assert feed.restarts == 1
+
+            responses.put(None)
+
+        await conn.close(noreply_wait=False)
+
+    with FakeServer(changefeed_handler(initial, responses)) as server:
+        asyncio.run(scenario(server))
+
+    assert query_types(server).count(P_QUERY.START) == 2
+
+
+def test_asyncio_subscribe_feed_error():
+    """
+    Test the asyncio changefeed failing is stopped, and its error is raised by the
+    subscribers.
+    """
+
+    responses = queue.Queue()
+
+    async def scenario(port):
+        async with await connect_asyncio(
+            host="127.0.0.1", port=port, timeout=5
+        ) as conn:
+            hub = AsyncioChangefeedHub(conn)
+            subscription = await hub.subscribe(r.table("flags").changes())
+
+            responses.put(partial({"new_val": {"$reql_type$": "UNKNOWN"}}))
+
+            assert await subscription.next(wait=1) == INITIALIZING
+            assert await subscription.next(wait=1) == READY
+
+            with pytest.raises(ReqlDriverError):
+                await subscription.next(wait=1)
+
+            await asyncio.sleep(0.1)
+
+    with FakeServer(changefeed_handler([], responses)) as server:
+        asyncio.run(scenario(server.port))
+
+    assert P_QUERY.STOP in query_types(server)
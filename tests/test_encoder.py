@@ -1,7 +1,21 @@
+import dataclasses
+import datetime
+import enum
+from unittest.mock import Mock
+import uuid
+
 import pytest
 
+from rethinkdb import ast
 from rethinkdb.ast import RqlQuery
-from rethinkdb.encoder import ReQLDecoder, ReQLEncoder
+from rethinkdb.encoder import (
+    LazyDocument,
+    LazyReQLDecoder,
+    OrjsonReQLDecoder,
+    OrjsonReQLEncoder,
+    ReQLDecoder,
+    ReQLEncoder,
+)
 
 
 class UnknownObj:
@@ -80,3 +94,306 @@ def test_decode_unknown_object():
 
     with pytest.raises(TypeError):
         decoder.encode(UnknownObj())
+
+
+def test_decode_time_pseudo_type():
+    """
+    Test decoding TIME pseudo-type objects to datetime objects.
+    """
+
+    string = '{"$reql_type$":"TIME","epoch_time":0,"timezone":"+00:00"}'
+
+    result = ReQLDecoder().decode(string)
+
+    assert result.timestamp() == 0
+    assert result.tzinfo.tzname(None) == "+00:00"
+
+
+def test_decode_raw_pseudo_type():
+    """
+    Test pseudo-type objects are left untouched with the raw format.
+    """
+
+    string = '{"$reql_type$":"BINARY","data":"Zm9v"}'
+
+    result = ReQLDecoder(reql_format_opts={"binary_format": "raw"}).decode(string)
+
+    assert result == {"$reql_type$": "BINARY", "data": "Zm9v"}
+
+
+def test_orjson_encode_matches_stdlib():
+    """
+    Test the orjson encoder produces the same JSON as the standard library.
+    """
+
+    query = ast.expr({"key": [1, "two", None, True, 1.5], "nested": {"a": "ü"}})
+
+    assert OrjsonReQLEncoder().encode_bytes(query) == ReQLEncoder().encode_bytes(query)
+
+
+def test_orjson_encode_fallback():
+    """
+    Test objects orjson cannot serialize are serialized by the standard library.
+    """
+
+    result = OrjsonReQLEncoder().encode({"big": 2**70, 1: "int key"})
+
+    assert result == '{"big":1180591620717411303424,"1":"int key"}'
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+class Level(enum.IntEnum):
+    HIGH = 1
+
+
+def encode_outcome(encoder, value):
+    """
+    Return the JSON of the value, or the type and message of the error raised.
+    """
+
+    try:
+        return encoder.encode_bytes(value)
+    except (TypeError, ValueError) as exc:
+        return type(exc), str(exc)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        float("nan"),
+        float("inf"),
+        {"a": float("-inf")},
+        [1, [2, float("nan")]],
+        {"a": [1.5, None, True, "ü"]},
+        datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+        datetime.date(2020, 1, 1),
+        uuid.UUID(int=1),
+        {"id": uuid.UUID(int=1)},
+        Point(1, 2),
+        Color.RED,
+        {"level": Level.HIGH},
+        2**70,
+        {1: "int key"},
+        ("a", 1),
+    ],
+)
+def test_orjson_encode_parity(value):
+    """
+    Test the orjson encoder produces the same JSON and raises the same errors as the
+    standard library.
+    """
+
+    assert encode_outcome(OrjsonReQLEncoder(), value) == encode_outcome(
+        ReQLEncoder(), value
+    )
+    assert encode_outcome(OrjsonReQLEncoder(), ast.Datum(value)) == encode_outcome(
+        ReQLEncoder(), ast.Datum(value)
+    )
+
+
+@pytest.mark.parametrize("encoder_class", [ReQLEncoder, OrjsonReQLEncoder])
+def test_encode_term_non_finite_float(encoder_class):
+    """
+    Test the non-finite floats are rejected, including in the inserted documents.
+    """
+
+    encoder = encoder_class()
+
+    with pytest.raises(ValueError):
+        encoder.encode_term(ast.expr({"a": float("nan")}))
+
+    with pytest.raises(ValueError):
+        encoder.encode_term(ast.Table("t").insert([{"a": 1.0}, {"a": float("inf")}]))
+
+    query = ast.Table("t").insert([{"a": 1.5}])
+
+    assert encoder.encode_term(query) == b'[56,[[15,["t"]],[2,[{"a":1.5}]]]]'
+
+
+def test_orjson_encode_unknown_object():
+    """
+    Test encoding objects which are unknown by the encoder.
+    """
+
+    with pytest.raises(TypeError):
+        OrjsonReQLEncoder().encode(UnknownObj())
+
+
+def test_orjson_decode_nested_pseudo_types():
+    """
+    Test nested pseudo-type objects are converted, the innermost first.
+    """
+
+    data = (
+        b'{"t":1,"r":[{"at":{"$reql_type$":"TIME","epoch_time":0,'
+        b'"timezone":"+00:00"},"blobs":[{"$reql_type$":"BINARY","data":"Zm9v"}]}]}'
+    )
+
+    result = OrjsonReQLDecoder().decode_bytes(data)
+    document = result["r"][0]
+
+    assert document["at"] == datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    assert document["blobs"] == [b"foo"]
+    assert result == ReQLDecoder().decode_bytes(data)
+
+
+def test_orjson_decode_grouped_data():
+    """
+    Test grouped data containing other pseudo-types is converted.
+    """
+
+    data = (
+        b'{"$reql_type$":"GROUPED_DATA","data":[[[1,2],'
+        b'{"$reql_type$":"BINARY","data":"Zm9v"}]]}'
+    )
+
+    assert OrjsonReQLDecoder().decode_bytes(data) == {(1, 2): b"foo"}
+
+
+def test_orjson_decode_raw_pseudo_type():
+    """
+    Test the format options are respected by the orjson decoder.
+    """
+
+    decoder = OrjsonReQLDecoder(reql_format_opts={"binary_format": "raw"})
+    result = decoder.decode('{"$reql_type$":"BINARY","data":"Zm9v"}')
+
+    assert result == {"$reql_type$": "BINARY", "data": "Zm9v"}
+
+
+def test_orjson_decode_custom_hook():
+    """
+    Test the standard library is used when a custom hook is given.
+    """
+
+    decoder = OrjsonReQLDecoder(object_hook=lambda obj: sorted(obj))
+
+    assert decoder.decode_bytes(b'{"b":1,"a":2}') == ["a", "b"]
+
+
+def test_lazy_decode_converts_on_access():
+    """
+    Test the pseudo-types of lazy documents are converted only when accessed.
+    """
+
+    data = b'{"id":1,"blob":{"$reql_type$":"BINARY","data":"Zm9v"}}'
+
+    decoder = LazyReQLDecoder()
+    decoder.convert_binary = Mock(wraps=decoder.convert_binary)
+    document = decoder.decode_bytes(data)
+
+    assert isinstance(document, LazyDocument)
+    assert document["id"] == 1
+    assert decoder.convert_binary.called is False
+
+    assert document["blob"] == b"foo"
+    assert document["blob"] is document["blob"]
+    assert decoder.convert_binary.call_count == 1
+
+
+def test_lazy_decode_nested():
+    """
+    Test nested objects and arrays are lazy views equal to the eager result.
+    """
+
+    data = (
+        b'{"items":[{"at":{"$reql_type$":"TIME","epoch_time":0,'
+        b'"timezone":"+00:00"}}],"name":"foo"}'
+    )
+
+    document = LazyReQLDecoder().decode_bytes(data)
+
+    assert isinstance(document["items"][0], LazyDocument)
+    assert document["items"][-1]["at"].timestamp() == 0
+    assert document == ReQLDecoder().decode_bytes(data)
+    assert document.to_dict() == ReQLDecoder().decode_bytes(data)
+
+
+@pytest.mark.parametrize("encoder_class", [ReQLEncoder, OrjsonReQLEncoder])
+def test_encode_term_matches_encode(encoder_class):
+    """
+    Test the spliced JSON of a term is the same as the JSON of the built term.
+    """
+
+    query = ast.expr({"a": [1, "b", None], "c": ast.expr(1) + 2}).filter(
+        lambda doc: doc["a"].count() > 1, default=ast.expr([])
+    )
+    encoder = encoder_class()
+
+    assert encoder.encode_term(query) == encoder.encode(query).encode("utf-8")
+
+
+def test_encode_term_reuses_subtrees():
+    """
+    Test the JSON of a subtree is memoized and spliced into the JSON of other terms.
+    """
+
+    table = ast.DB("db").table("table")
+    encoder = ReQLEncoder()
+    fragment = encoder.encode_term(table)
+
+    assert encoder.encode_term(table) is fragment
+    assert encoder.encode_term(table.get(1)) == b"[16,[" + fragment + b",1]]"
+
+
+def test_encode_term_mutation_invalidates():
+    """
+    Test mutating a serialized term invalidates the memoized JSON of its parents.
+    """
+
+    inner = ast.expr(1)
+    outer = ast.MakeArray(inner)
+    encoder = ReQLEncoder()
+
+    assert encoder.encode_term(outer) == b"[2,[1]]"
+
+    inner.data = 2
+
+    assert outer.get_fragment() is None
+    assert encoder.encode_term(outer) == b"[2,[2]]"
+
+
+def test_encode_term_assignment_invalidates():
+    """
+    Test assigning the arguments of a serialized term invalidates its memoized JSON
+    and fingerprint.
+    """
+
+    query = ast.expr({"a": 1})
+    encoder = ReQLEncoder()
+    fingerprint = query.fingerprint()
+
+    assert encoder.encode_term(query) == b'{"a":1}'
+
+    query.kwargs = {"b": ast.expr(2)}
+
+    assert query.get_fragment() is None
+    assert query.fingerprint() != fingerprint
+    assert encoder.encode_term(query) == b'{"b":2}'
+
+    query = ast.MakeArray(1)
+    encoder.encode_term(query)
+    query._args = [ast.expr(2)]  # pylint: disable=protected-access
+
+    assert encoder.encode_term(query) == b"[2,[2]]"
+
+
+def test_encode_term_set_infix_invalidates():
+    """
+    Test setting the infix flag of a serialized term invalidates its memoized JSON.
+    """
+
+    query = ast.Or(True, False)
+    ReQLEncoder().encode_term(query)
+    query.set_infix()
+
+    assert query.get_fragment() is None
@@ -55,10 +55,10 @@ def test_reql_error_terms_and_frames_are_set():
     Test both term and frames are set.
     """
 
-    inner_term = Mock(_args=[], optargs={})
+    inner_term = Mock(_args=[], kwargs={})
     inner_term.compose.return_value = ["^"]
 
-    expected_term = Mock(_name="term", _args=[], optargs={1: inner_term, 2: inner_term})
+    expected_term = Mock(_name="term", _args=[], kwargs={1: inner_term, 2: inner_term})
     expected_term.compose.return_value = ["composed"]
 
     expected_message = "reql error"
@@ -8,7 +8,13 @@ from unittest.mock import Mock, patch
 import pytest
 
 from rethinkdb.errors import InvalidHandshakeStateError, ReqlAuthError, ReqlDriverError
-from rethinkdb.handshake import BaseHandshake, HandshakeState, HandshakeV1_0
+from rethinkdb.handshake import (
+    BaseHandshake,
+    HandshakeState,
+    HandshakeV1_0,
+    ScramKeyCache,
+    derive_scram_keys,
+)
 from rethinkdb.ql2_pb2 import VersionDummy
 from rethinkdb.utilities import chain_to_bytes
 
@@ -69,6 +75,10 @@ def test_handshake_v1_0_stage_stepping(handshake):
     handshake.next_state()
 
     assert handshake.state == HandshakeState.AUTH_RESPONSE
+    handshake.next_state()
+
+    assert handshake.state == HandshakeState.AUTHENTICATED
+    assert handshake.is_completed is True
 
     # No more states, raise an error
     with pytest.raises(InvalidHandshakeStateError):
@@ -321,3 +331,67 @@ def test_read_auth_response_invalid_server_signature(handshake):
         handshake.next_message(bytes(json.dumps(response), "utf-8"))
 
     assert handshake.next_state.called is False
+
+
+def test_next_message_after_completion(handshake):
+    """
+    Test no more messages are handled once the handshake is completed.
+    """
+
+    handshake.state = HandshakeState.AUTHENTICATED
+
+    with pytest.raises(ReqlDriverError):
+        handshake.next_message(b"")
+
+
+def test_scram_key_cache_derives_once():
+    """
+    Test the keys of the same credentials are derived only once.
+    """
+
+    cache = ScramKeyCache()
+
+    with patch(
+        "rethinkdb.handshake.derive_scram_keys", wraps=derive_scram_keys
+    ) as mock_derive:
+        first = cache.get_or_derive(b"admin", b"secret", b"salt", 2)
+        second = cache.get_or_derive(b"admin", b"secret", b"salt", 2)
+
+    assert first == second == derive_scram_keys(b"secret", b"salt", 2)
+    assert mock_derive.call_count == 1
+
+
+def test_scram_key_cache_keyed_by_password():
+    """
+    Test a changed password does not reuse the keys of the old password.
+    """
+
+    cache = ScramKeyCache()
+
+    old_keys = cache.get_or_derive(b"admin", b"old", b"salt", 2)
+    new_keys = cache.get_or_derive(b"admin", b"new", b"salt", 2)
+
+    assert old_keys != new_keys
+    assert len(cache) == 2
+
+
+def test_scram_key_cache_evicts_least_recently_used():
+    """
+    Test the cache is bounded and evicts the least recently used entry.
+    """
+
+    cache = ScramKeyCache(maxsize=2)
+
+    cache.get_or_derive(b"first", b"", b"salt", 1)
+    cache.get_or_derive(b"second", b"", b"salt", 1)
+    cache.get_or_derive(b"first", b"", b"salt", 1)
+    cache.get_or_derive(b"third", b"", b"salt", 1)
+
+    with patch(
+        "rethinkdb.handshake.derive_scram_keys", wraps=derive_scram_keys
+    ) as mock_derive:
+        cache.get_or_derive(b"first", b"", b"salt", 1)
+        cache.get_or_derive(b"second", b"", b"salt", 1)
+
+    assert len(cache) == 2
+    assert mock_derive.call_count == 1
@@ -0,0 +1,592 @@
+# pylint: disable=redefined-outer-name
+
+import json
+import struct
+import threading
+import time
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb.encoder import LazyDocument, ReQLDecoder, ReQLEncoder
+from rethinkdb.errors import (
+    ReqlAuthError,
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlNonExistenceError,
+    ReqlTimeoutError,
+)
+from rethinkdb.net import Connection, Cursor, Query, Response, connect
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from tests.helpers import FakeServer, atom_handler, frame
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+
+
+def split_batch_handler(released):
+    """
+    Return a handler responding to START with a batch sent in two parts. The second
+    part is sent once the `released` event is set.
+    """
+
+    def handler(server, token, message):
+        if message[0] != P_QUERY.START:
+            return
+
+        rows = [{"id": 1}, {"id": 2}, {"id": 3}]
+        data = frame(token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": rows})
+        split = data.index(b', {"id": 2}')
+
+        server.send_raw(data[:split])
+        released.wait(5)
+        server.send_raw(data[split:])
+
+    return handler
+
+
+def sequence_handler(batches):
+    """
+    Return a handler replying to START and CONTINUE with the given batches.
+    """
+
+    remaining = list(batches)
+
+    def handler(server, token, message):
+        if message[0] in (P_QUERY.START, P_QUERY.CONTINUE):
+            batch = remaining.pop(0)
+            response_type = (
+                P_RESPONSE.SUCCESS_PARTIAL if remaining else P_RESPONSE.SUCCESS_SEQUENCE
+            )
+            server.send(token, {"t": response_type, "r": batch})
+        elif message[0] == P_QUERY.STOP:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": []})
+
+    return handler
+
+
+@pytest.fixture
+def server():
+    """
+    Fixture returning a fake server answering queries with atoms.
+    """
+
+    with FakeServer(atom_handler) as fake_server:
+        yield fake_server
+
+
+@pytest.fixture
+def connection(server):
+    """
+    Fixture returning a connection to the fake server.
+    """
+
+    conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+    yield conn
+    conn.close(noreply_wait=False)
+
+
+def test_query_serialize():
+    """
+    Test queries are framed with the token and the length of the payload.
+    """
+
+    query = Query(P_QUERY.START, 5, ast.expr(1), {"read_mode": "outdated"})
+    result = query.serialize(ReQLEncoder())
+
+    payload = b'[1,1,{"read_mode":"outdated"}]'
+    assert result == struct.pack("<QL", 5, len(payload)) + payload
+
+
+def test_query_serialize_without_term():
+    """
+    Test serializing queries which has no term, like CONTINUE.
+    """
+
+    result = Query(P_QUERY.CONTINUE, 1).serialize(ReQLEncoder())
+
+    assert result == struct.pack("<QL", 1, 3) + b"[2]"
+
+
+def test_response_make_error():
+    """
+    Test the runtime errors are mapped to the matching exception.
+    """
+
+    payload = json.dumps(
+        {
+            "t": P_RESPONSE.RUNTIME_ERROR,
+            "e": PResponse.ErrorType.NON_EXISTENCE,
+            "r": ["No attribute `foo`."],
+            "b": [],
+        }
+    ).encode("utf-8")
+
+    response = Response(1, payload, ReQLDecoder())
+    error = response.make_error(Query(P_QUERY.START, 1))
+
+    assert isinstance(error, ReqlNonExistenceError)
+    assert error.message == "No attribute `foo`."
+
+
+def test_invalid_port():
+    """
+    Test the port must be convertible to an integer.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        Connection(port="invalid")
+
+
+def test_connect(connection):
+    """
+    Test the connection is open after the handshake.
+    """
+
+    assert connection.is_open() is True
+
+
+def test_connect_wrong_password(server):
+    """
+    Test the authentication error of the server is raised.
+    """
+
+    server.password = b"secret"
+
+    with pytest.raises(ReqlAuthError):
+        connect(host="127.0.0.1", port=server.port, password="wrong", timeout=5)
+
+
+def test_run_atom(connection):
+    """
+    Test running a query returning an atom.
+    """
+
+    assert ast.expr("foo").run(connection) == "foo"
+
+
+def test_run_slower_than_connect_timeout():
+    """
+    Test the connect timeout does not bound the queries of the connection.
+    """
+
+    def handler(server, token, message):
+        time.sleep(0.5)
+        atom_handler(server, token, message)
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=0.2)
+
+        assert ast.expr("foo").run(conn) == "foo"
+        assert conn.is_open()
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_with_default_db(server):
+    """
+    Test the default database is sent as a global optional argument.
+    """
+
+    conn = connect(host="127.0.0.1", port=server.port, db="test", timeout=5)
+    ast.expr(1).run(conn)
+    conn.close(noreply_wait=False)
+
+    _, message = server.queries[0]
+    assert message[2] == {"db": [ast.P_TERM.DB, ["test"]]}
+
+
+def test_run_noreply(connection, server):
+    """
+    Test queries run with noreply are not waiting for a response.
+    """
+
+    assert ast.expr(1).run(connection, noreply=True) is None
+    connection.noreply_wait()
+
+    assert [message[0] for _, message in server.queries] == [
+        P_QUERY.START,
+        P_QUERY.NOREPLY_WAIT,
+    ]
+
+
+def test_run_lazy_response_format(server):
+    """
+    Test the client-only response format is not sent to the server.
+    """
+
+    conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+    result = ast.expr({"foo": "bar"}).run(conn, response_format="lazy")
+    conn.close(noreply_wait=False)
+
+    _, message = server.queries[0]
+    assert isinstance(result, LazyDocument)
+    assert dict(result) == {"foo": "bar"}
+    assert message[2] == {}
+
+
+def test_run_unknown_response_format(connection):
+    """
+    Test unknown response formats are rejected.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr(1).run(connection, response_format="unknown")
+
+
+def test_run_raw_response_format():
+    """
+    Test the raw response format returns the batches of a cursor undecoded.
+    """
+
+    with FakeServer(sequence_handler([[{"id": 1}, "x"], [], [2]])) as fake_server:
+        conn = connect(host="127.0.0.1", port=fake_server.port, timeout=5)
+        cursor = ast.expr([]).run(conn, response_format="raw")
+        batches = [bytes(batch) for batch in cursor]
+        conn.close(noreply_wait=False)
+
+    assert [json.loads(batch) for batch in batches] == [[{"id": 1}, "x"], [2]]
+
+
+def test_run_raw_response_format_atom(server):
+    """
+    Test the raw response format returns the JSON of an atom undecoded.
+    """
+
+    conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+    result = ast.expr("foo").run(conn, response_format="raw")
+    conn.close(noreply_wait=False)
+
+    assert isinstance(result, memoryview)
+    assert bytes(result) == b'"foo"'
+
+
+def test_run_raw_response_format_stream_rows(connection):
+    """
+    Test the raw response format cannot be streamed row by row.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr(1).run(connection, response_format="raw", stream_rows=True)
+
+
+def test_run_error():
+    """
+    Test error responses are raised.
+    """
+
+    def handler(server, token, _):
+        server.send(
+            token,
+            {
+                "t": P_RESPONSE.RUNTIME_ERROR,
+                "e": PResponse.ErrorType.NON_EXISTENCE,
+                "r": ["Not found."],
+                "b": [],
+            },
+        )
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+
+        with pytest.raises(ReqlNonExistenceError):
+            ast.expr(1).run(conn)
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor():
+    """
+    Test cursors are fetching the next batches on demand.
+    """
+
+    with FakeServer(sequence_handler([[1, 2], [3], [4]])) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn)
+
+        assert isinstance(cursor, Cursor)
+        assert list(cursor) == [1, 2, 3, 4]
+
+        with pytest.raises(ReqlCursorEmpty):
+            cursor.next()
+
+        assert [message[0] for _, message in server.queries] == [
+            P_QUERY.START,
+            P_QUERY.CONTINUE,
+            P_QUERY.CONTINUE,
+        ]
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor_prefetch():
+    """
+    Test cursors with `prefetch=True` request the next batch as soon as a batch
+    arrives.
+    """
+
+    with FakeServer(sequence_handler([[1, 2], [3], [4]])) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn, prefetch=True)
+
+        # pylint: disable=protected-access
+        assert cursor._outstanding_requests == 1
+        assert list(cursor) == [1, 2, 3, 4]
+        assert cursor._outstanding_requests == 0
+        assert [message[0] for _, message in server.queries] == [
+            P_QUERY.START,
+            P_QUERY.CONTINUE,
+            P_QUERY.CONTINUE,
+        ]
+        assert server.queries[0][1][2] == {}
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor_prefetch_low_water_mark():
+    """
+    Test cursors with a numeric `prefetch` request the next batch once no more than
+    that many results are left unread.
+    """
+
+    with FakeServer(sequence_handler([[1, 2, 3], [4]])) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn, prefetch=1)
+
+        # pylint: disable=protected-access
+        assert cursor.next() == 1
+        assert cursor._outstanding_requests == 0
+        assert cursor.next() == 2
+        assert cursor._outstanding_requests == 1
+        assert list(cursor) == [3, 4]
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor_buffered_bytes():
+    """
+    Test cursors report the received bytes of the results left to return.
+    """
+
+    with FakeServer(sequence_handler([[1, 2, 3, 4], [5]])) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn)
+        size = len(json.dumps({"t": P_RESPONSE.SUCCESS_PARTIAL, "r": [1, 2, 3, 4]}))
+
+        assert cursor.buffered_bytes == size
+        assert cursor.next() == 1
+        assert cursor.buffered_bytes == round(size * 3 / 4)
+        assert list(cursor) == [2, 3, 4, 5]
+        assert cursor.buffered_bytes == 0
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor_max_buffered_bytes():
+    """
+    Test cursors request a batch ahead only once it fits in `max_buffered_bytes`,
+    which bounds the size of the batches too.
+    """
+
+    batches = [[1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    size = len(json.dumps({"t": P_RESPONSE.SUCCESS_PARTIAL, "r": batches[0]}))
+    budget = size + size // 2 + 1
+
+    with FakeServer(sequence_handler(batches)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn, prefetch=True, max_buffered_bytes=budget)
+
+        # pylint: disable=protected-access
+        assert cursor._outstanding_requests == 0
+        assert cursor.next() == 1
+        assert cursor._outstanding_requests == 0
+        assert cursor.next() == 2
+        assert cursor._outstanding_requests == 1
+        assert list(cursor) == [3, 4, 5, 6, 7, 8, 9]
+        assert server.queries[0][1][2] == {"max_batch_bytes": budget}
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_cursor_max_buffered_bytes_stream_rows():
+    """
+    Test the bytes of the streamed batches count towards `max_buffered_bytes`.
+    """
+
+    batches = [[1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    size = len(json.dumps({"t": P_RESPONSE.SUCCESS_PARTIAL, "r": batches[0]}))
+    budget = size + size // 2 + 1
+
+    with FakeServer(sequence_handler(batches)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(
+            conn, prefetch=True, max_buffered_bytes=budget, stream_rows=True
+        )
+
+        # pylint: disable=protected-access
+        assert cursor.next(wait=1) == 1
+        assert cursor._outstanding_requests == 0
+        assert cursor.buffered_bytes == round(size * 3 / 4)
+        assert cursor.next() == 2
+        assert cursor._outstanding_requests == 1
+        assert list(cursor) == [3, 4, 5, 6, 7, 8, 9]
+
+        conn.close(noreply_wait=False)
+
+
+@pytest.mark.parametrize("max_buffered_bytes", [0, True, "1MB"])
+def test_run_invalid_max_buffered_bytes(connection, max_buffered_bytes):
+    """
+    Test the budget of the buffered bytes must be a positive integer.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr([]).run(connection, max_buffered_bytes=max_buffered_bytes)
+
+
+@pytest.mark.parametrize("prefetch", [-1, 1.5, "yes"])
+def test_run_invalid_prefetch(connection, prefetch):
+    """
+    Test the low-water mark of the prefetch must be a non-negative integer.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr([]).run(connection, prefetch=prefetch)
+
+
+def test_run_cursor_stream_rows():
+    """
+    Test streamed cursors return the first rows before the batch is complete.
+    """
+
+    released = threading.Event()
+
+    with FakeServer(split_batch_handler(released)) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr([]).run(conn, stream_rows=True)
+
+        assert cursor.next(wait=1) == {"id": 1}
+        released.set()
+        assert list(cursor) == [{"id": 2}, {"id": 3}]
+        assert cursor.is_completed is True
+
+        _, message = server.queries[0]
+        assert message[2] == {}
+
+        conn.close(noreply_wait=False)
+
+
+def test_run_atom_stream_rows(connection):
+    """
+    Test streamed queries returning an atom.
+    """
+
+    assert ast.expr("foo").run(connection, stream_rows=True) == "foo"
+
+
+def test_cursor_close():
+    """
+    Test closing a cursor stops the query and the connection remains usable.
+    """
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START and message[1] == 1:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": [1]})
+        elif message[0] == P_QUERY.STOP:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": []})
+        else:
+            atom_handler(server, token, message)
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr(1).run(conn)
+        cursor.close()
+
+        assert cursor.is_completed is True
+        assert ast.expr(2).run(conn) == 2
+
+        conn.close(noreply_wait=False)
+
+
+def test_cursor_next_timeout():
+    """
+    Test waiting for the next batch of a cursor can time out.
+    """
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": []})
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        cursor = ast.expr(1).run(conn)
+
+        with pytest.raises(ReqlTimeoutError):
+            cursor.next(wait=0.05)
+
+        conn.close(noreply_wait=False)
+
+
+def test_pipelined_queries():
+    """
+    Test queries of many threads are in flight at the same time, and the responses
+    are matched by the token even if the server responds out of order.
+    """
+
+    pending = []
+    lock = threading.Lock()
+
+    def handler(server, token, message):
+        with lock:
+            pending.append((token, message))
+
+            # Wait for every query before responding in reverse order
+            if len(pending) == 4:
+                for pending_token, pending_message in reversed(pending):
+                    atom_handler(server, pending_token, pending_message)
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        results = {}
+
+        def run(value):
+            results[value] = ast.expr(value).run(conn)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join(5)
+
+        assert results == {0: 0, 1: 1, 2: 2, 3: 3}
+
+        conn.close(noreply_wait=False)
+
+
+def test_close(connection):
+    """
+    Test running a query on a closed connection.
+    """
+
+    connection.close()
+
+    assert connection.is_open() is False
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr(1).run(connection)
+
+
+def test_server_closed_connection(connection, server):
+    """
+    Test the connection is closed when the server drops the socket.
+    """
+
+    server.handler = lambda server, token, message: server.close()
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr(1).run(connection)
+
+    assert connection.is_open() is False
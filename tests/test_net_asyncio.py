@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb.errors import (
+    ReqlAuthError,
+    ReqlCursorEmpty,
+    ReqlDriverError,
+    ReqlTimeoutError,
+)
+from rethinkdb.net_asyncio import AsyncioConnection, AsyncioCursor, connect
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from tests.helpers import FakeServer, atom_handler
+from tests.test_net import sequence_handler, split_batch_handler
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+
+
+def run(coroutine):
+    """
+    Run the coroutine on a new event loop.
+    """
+
+    return asyncio.run(coroutine)
+
+
+def test_connect():
+    """
+    Test the connection is open after the handshake.
+    """
+
+    async def scenario(port):
+        conn = await connect(host="127.0.0.1", port=port, timeout=5)
+
+        assert isinstance(conn, AsyncioConnection)
+        assert conn.is_open() is True
+
+        await conn.close(noreply_wait=False)
+
+        assert conn.is_open() is False
+
+    with FakeServer(atom_handler) as server:
+        run(scenario(server.port))
+
+
+def test_connect_wrong_password():
+    """
+    Test the authentication error of the server is raised.
+    """
+
+    async def scenario(port):
+        with pytest.raises(ReqlAuthError):
+            await connect(host="127.0.0.1", port=port, password="wrong", timeout=5)
+
+    with FakeServer(atom_handler, password=b"secret") as server:
+        run(scenario(server.port))
+
+
+def test_run_atom():
+    """
+    Test running a query returning an atom.
+    """
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            assert await ast.expr("foo").run(conn) == "foo"
+            await conn.noreply_wait()
+
+    with FakeServer(atom_handler) as server:
+        run(scenario(server.port))
+
+
+def test_multiplexed_queries():
+    """
+    Test queries of many tasks are in flight at the same time, and the responses are
+    matched by the token even if the server responds out of order.
+    """
+
+    pending = []
+
+    def handler(server, token, message):
+        pending.append((token, message))
+
+        if len(pending) == 10:
+            for pending_token, pending_message in reversed(pending):
+                atom_handler(server, pending_token, pending_message)
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            results = await asyncio.gather(
+                *(ast.expr(value).run(conn) for value in range(10))
+            )
+
+        assert results == list(range(10))
+
+    with FakeServer(handler) as server:
+        run(scenario(server.port))
+
+
+def test_run_cursor():
+    """
+    Test cursors support `async for` and fetch the next batches on demand.
+    """
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            cursor = await ast.expr([]).run(conn)
+
+            assert isinstance(cursor, AsyncioCursor)
+            assert [item async for item in cursor] == [1, 2, 3, 4]
+
+            with pytest.raises(ReqlCursorEmpty):
+                await cursor.next()
+
+    with FakeServer(sequence_handler([[1, 2], [3], [4]])) as server:
+        run(scenario(server.port))
+
+
+def test_run_cursor_prefetch():
+    """
+    Test cursors with `prefetch=True` request the next batch as soon as a batch
+    arrives, and receive it while the results are processed.
+    """
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            cursor = await ast.expr([]).run(conn, prefetch=True)
+
+            # pylint: disable=protected-access
+            assert cursor._outstanding_requests == 1
+            assert [item async for item in cursor] == [1, 2, 3, 4]
+            assert cursor._outstanding_requests == 0
+
+    with FakeServer(sequence_handler([[1, 2], [3], [4]])) as server:
+        run(scenario(server.port))
+
+    assert [message[0] for _, message in server.queries] == [
+        P_QUERY.START,
+        P_QUERY.CONTINUE,
+        P_QUERY.CONTINUE,
+    ]
+
+
+def test_run_cursor_max_buffered_bytes():
+    """
+    Test asyncio cursors request a batch ahead only once it fits in
+    `max_buffered_bytes`.
+    """
+
+    batches = [[1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    size = len(json.dumps({"t": P_RESPONSE.SUCCESS_PARTIAL, "r": batches[0]}))
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            cursor = await ast.expr([]).run(
+                conn, prefetch=True, max_buffered_bytes=size + size // 2 + 1
+            )
+
+            # pylint: disable=protected-access
+            assert cursor.buffered_bytes == size
+            assert await cursor.next() == 1
+            assert cursor._outstanding_requests == 0
+            assert await cursor.next() == 2
+            assert cursor._outstanding_requests == 1
+            assert [item async for item in cursor] == [3, 4, 5, 6, 7, 8, 9]
+            assert cursor.buffered_bytes == 0
+
+    with FakeServer(sequence_handler(batches)) as server:
+        run(scenario(server.port))
+
+
+def test_run_cursor_stream_rows():
+    """
+    Test streamed cursors return the first rows before the batch is complete.
+    """
+
+    released = threading.Event()
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            cursor = await ast.expr([]).run(conn, stream_rows=True)
+
+            assert await cursor.next(wait=1) == {"id": 1}
+            released.set()
+            assert [item async for item in cursor] == [{"id": 2}, {"id": 3}]
+
+    with FakeServer(split_batch_handler(released)) as server:
+        run(scenario(server.port))
+
+
+def test_cursor_next_timeout():
+    """
+    Test waiting for the next batch of a cursor can time out.
+    """
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            server.send(token, {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": []})
+
+    async def scenario(port):
+        async with await connect(host="127.0.0.1", port=port, timeout=5) as conn:
+            cursor = await ast.expr(1).run(conn)
+
+            with pytest.raises(ReqlTimeoutError):
+                await cursor.next(wait=0.05)
+
+    with FakeServer(handler) as server:
+        run(scenario(server.port))
+
+
+def test_server_closed_connection():
+    """
+    Test the waiting queries fail when the server drops the socket.
+    """
+
+    async def scenario(port):
+        conn = await connect(host="127.0.0.1", port=port, timeout=5)
+
+        with pytest.raises(ReqlDriverError):
+            await ast.expr(1).run(conn)
+
+        assert conn.is_open() is False
+
+    with FakeServer(lambda server, token, message: server.close()) as server:
+        run(scenario(server.port))
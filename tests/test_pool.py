@@ -0,0 +1,168 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb.errors import ReqlDriverError, ReqlTimeoutError
+from rethinkdb.pool import AsyncioConnectionPool, ConnectionPool
+from tests.helpers import FakeServer, atom_handler
+from tests.test_net import sequence_handler
+
+
+@pytest.fixture
+def server():
+    """
+    Fixture returning a fake server answering queries with atoms.
+    """
+
+    with FakeServer(atom_handler) as fake_server:
+        yield fake_server
+
+
+def test_invalid_size():
+    """
+    Test the minimum size of the pool cannot exceed the maximum size.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        ConnectionPool(min_size=2, max_size=1)
+
+
+def test_open_min_size(server):
+    """
+    Test opening the pool connects the minimum number of connections.
+    """
+
+    with ConnectionPool(min_size=2, host="127.0.0.1", port=server.port) as pool:
+        assert pool.size == 2
+        assert pool.idle_size == 2
+
+
+def test_run_reuses_connection(server):
+    """
+    Test the queries run on the pool reuse the same authenticated connection.
+    """
+
+    with ConnectionPool(host="127.0.0.1", port=server.port) as pool:
+        assert ast.expr(1).run(pool) == 1
+        assert ast.expr(2).run(pool) == 2
+
+        assert pool.size == 1
+        assert len(server.clients) == 1
+
+
+def test_acquire_timeout(server):
+    """
+    Test checking out a connection of a full pool times out.
+    """
+
+    with ConnectionPool(max_size=1, host="127.0.0.1", port=server.port) as pool:
+        with pool.connection():
+            with pytest.raises(ReqlTimeoutError):
+                pool.acquire(timeout=0.05)
+
+
+def test_acquire_waits_for_release(server):
+    """
+    Test a waiting checkout gets the released connection.
+    """
+
+    with ConnectionPool(max_size=1, host="127.0.0.1", port=server.port) as pool:
+        connection = pool.acquire()
+        threading.Timer(0.05, pool.release, args=(connection,)).start()
+
+        assert pool.acquire(timeout=5) is connection
+
+
+def test_idle_connections_reaped(server):
+    """
+    Test the connections idle for too long are closed on the next checkout.
+    """
+
+    pool = ConnectionPool(max_idle_time=0, host="127.0.0.1", port=server.port)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    replacement = pool.acquire()
+
+    assert replacement is not connection
+    assert connection.is_open() is False
+    assert pool.size == 1
+
+    pool.close()
+
+
+def test_dead_connection_replaced(server):
+    """
+    Test the liveness probe drops the connections closed by the server.
+    """
+
+    with ConnectionPool(host="127.0.0.1", port=server.port) as pool:
+        with pool.connection() as connection:
+            pass
+
+        server.clients[0].shutdown(socket.SHUT_RDWR)
+
+        assert ast.expr(1).run(pool) == 1
+        assert pool.acquire() is not connection
+
+
+def test_cursor_holds_connection():
+    """
+    Test the connection of a cursor returns to the pool once the cursor completed.
+    """
+
+    with FakeServer(sequence_handler([[1], [2]])) as server:
+        with ConnectionPool(host="127.0.0.1", port=server.port) as pool:
+            cursor = ast.expr([]).run(pool)
+
+            assert pool.idle_size == 0
+            assert list(cursor) == [1, 2]
+            assert pool.idle_size == 1
+
+
+def test_closed_pool(server):
+    """
+    Test the closed pool refuses checkouts.
+    """
+
+    pool = ConnectionPool(host="127.0.0.1", port=server.port).open()
+    pool.close()
+
+    with pytest.raises(ReqlDriverError):
+        ast.expr(1).run(pool)
+
+
+def test_asyncio_run(server):
+    """
+    Test the asyncio pool shares its connections between tasks.
+    """
+
+    async def scenario():
+        async with AsyncioConnectionPool(
+            max_size=2, host="127.0.0.1", port=server.port
+        ) as pool:
+            results = await asyncio.gather(*(ast.expr(i).run(pool) for i in range(5)))
+
+            assert results == list(range(5))
+            assert pool.size <= 2
+
+    asyncio.run(scenario())
+
+
+def test_asyncio_acquire_timeout(server):
+    """
+    Test checking out a connection of a full asyncio pool times out.
+    """
+
+    async def scenario():
+        async with AsyncioConnectionPool(
+            max_size=1, host="127.0.0.1", port=server.port
+        ) as pool:
+            async with pool.connection():
+                with pytest.raises(ReqlTimeoutError):
+                    await pool.acquire(timeout=0.05)
+
+    asyncio.run(scenario())
@@ -0,0 +1,158 @@
+import datetime
+
+import pytest
+
+from rethinkdb import ast
+from rethinkdb import query as r
+from rethinkdb.encoder import OrjsonReQLEncoder, ReQLEncoder
+from rethinkdb.errors import ReqlDriverCompileError, ReqlDriverError
+from rethinkdb.net import connect
+from rethinkdb.prepared import BoundQuery, PreparedQuery
+from tests.helpers import FakeServer, atom_handler
+
+
+@pytest.mark.parametrize("encoder_class", [ReQLEncoder, OrjsonReQLEncoder])
+@pytest.mark.parametrize(
+    "value",
+    [
+        5,
+        "text",
+        None,
+        1.5,
+        [1, {"a": 2}],
+        {"nested": [3]},
+        r.now(),
+        b"bytes",
+        datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+    ],
+)
+def test_encode_matches_query(encoder_class, value):
+    """
+    Test the JSON spliced into the template is the JSON of the query tree.
+    """
+
+    prepared = r.prepare(lambda p: r.table("users").get(p.id).merge({"value": p.id}))
+    bound = prepared.bind(id=value)
+    encoder = encoder_class()
+
+    assert encoder.encode_term(bound) == encoder.encode_term(bound.query)
+
+
+def test_template_serialized_once():
+    """
+    Test the template is serialized once, and reused for every execution.
+    """
+
+    class RecordingEncoder(ReQLEncoder):
+        def __init__(self):
+            super().__init__()
+            self.terms = []
+
+        def encode_term(self, term):
+            self.terms.append(term)
+            return super().encode_term(term)
+
+    prepared = r.prepare(lambda p: r.table("users").get(p.id))
+    encoder = RecordingEncoder()
+
+    assert encoder.encode_term(prepared.bind(id=1)) == b'[16,[[15,["users"]],1]]'
+    assert encoder.encode_term(prepared.bind(id=2)) == b'[16,[[15,["users"]],2]]'
+    assert sum(term is prepared.term for term in encoder.terms) == 1
+
+
+def test_bind_missing_or_unknown_parameters():
+    """
+    Test every parameter must be bound, and only the parameters of the query.
+    """
+
+    prepared = r.prepare(lambda p: ast.expr([p.a, p["b"]]))
+
+    assert prepared.names == ("a", "b")
+
+    with pytest.raises(ReqlDriverError):
+        prepared.bind(a=1)
+
+    with pytest.raises(ReqlDriverError):
+        prepared.bind(a=1, b=2, c=3)
+
+
+def test_invalid_parameter_name():
+    """
+    Test the parameter names must be identifiers.
+    """
+
+    with pytest.raises(ReqlDriverCompileError):
+        r.prepare(lambda p: p['a"b'])
+
+
+def test_bound_query_printed():
+    """
+    Test the bound query is printed with its values.
+    """
+
+    prepared = r.prepare(lambda p: r.table("users").get(p.id))
+
+    assert isinstance(prepared, PreparedQuery)
+    assert str(prepared(id=1)) == "r.table('users').get(1)"
+    assert str(prepared.term) == "r.table('users').get(p.id)"
+
+
+def test_run():
+    """
+    Test running a bound query sends the query with the values.
+    """
+
+    prepared = r.prepare(lambda p: ast.expr(p.value))
+
+    with FakeServer(atom_handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5)
+        bound = prepared.bind(value="foo")
+
+        assert isinstance(bound, BoundQuery)
+        assert bound.run(conn) == "foo"
+        assert prepared(value="bar").run(conn) == "bar"
+
+        conn.close(noreply_wait=False)
+
+
+def test_bound_query_fingerprint():
+    """
+    Test the fingerprint of a bound query combines the digest of the template, which
+    is computed once, with the digests of the values, without building the tree.
+    """
+
+    calls = []
+
+    def function(p):
+        calls.append(p)
+        return r.table("users").get(p.id)
+
+    prepared = r.prepare(function)
+    fingerprints = [prepared(id=value).fingerprint() for value in (1, 2, 1, "1")]
+
+    assert fingerprints[0] == fingerprints[2]
+    assert len(set(fingerprints)) == 3
+    assert len(calls) == 2
+    assert fingerprints[0] == r.prepare(function)(id=1).fingerprint()
+    assert fingerprints[0] != (
+        r.prepare(lambda p: r.table("orders").get(p.id))(id=1).fingerprint()
+    )
+    assert prepared(id=1).fingerprint(normalize_literals=True) == (
+        prepared(id=2).fingerprint(normalize_literals=True)
+    )
+    assert prepared(id=1).fingerprint(normalize_literals=True) != fingerprints[0]
+
+
+def test_bound_query_fingerprint_fields():
+    """
+    Test the values bound to the field names are kept by the fingerprints with the
+    literal values normalized.
+    """
+
+    prepared = r.prepare(lambda p: r.table("users").get(p.id).pluck(p.field))
+
+    def fingerprint(**values):
+        return prepared(**values).fingerprint(normalize_literals=True)
+
+    assert fingerprint(id=1, field="a") == fingerprint(id=2, field="a")
+    assert fingerprint(id=1, field="a") != fingerprint(id=1, field="b")
@@ -758,3 +758,13 @@ def test_circle(mock_ast):
     mock_ast.Circle.assert_called_once_with("foo", foo="foo")
 
     assert result == mock_ast.Circle.return_value
+
+
+@patch("rethinkdb.query.net")
+def test_connect(mock_net):
+    mock_net.connect.return_value = Mock()
+
+    result = query.connect(host="localhost", port=28015)
+    mock_net.connect.assert_called_once_with(host="localhost", port=28015)
+
+    assert result == mock_net.connect.return_value
@@ -0,0 +1,227 @@
+import asyncio
+import json
+
+import pytest
+
+from rethinkdb.encoder import ReQLDecoder
+from rethinkdb.errors import ReqlDriverError
+from rethinkdb.ql2_pb2 import Response as PResponse
+from rethinkdb.streaming import (
+    RawResponseDecoder,
+    ResponseStream,
+    aiter_raw_json,
+    iter_raw_json,
+)
+
+P_RESPONSE = PResponse.ResponseType
+
+
+def feed_in_chunks(stream, payload, size):
+    """
+    Feed the payload to the stream in chunks of the given size.
+    """
+
+    for start in range(0, len(payload), size):
+        stream.feed(payload[start : start + size])
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_rows_streamed(size):
+    """
+    Test the rows are decoded regardless of how the response is split.
+    """
+
+    rows = [
+        {"id": 1, "text": 'quoted "]}" and \\ backslash', "nested": [[], {}]},
+        "plain string",
+        12.5,
+        None,
+        {"blob": {"$reql_type$": "BINARY", "data": "Zm9v"}},
+    ]
+    payload = json.dumps({"t": P_RESPONSE.SUCCESS_PARTIAL, "r": rows, "n": []})
+
+    stream = ResponseStream(ReQLDecoder())
+    feed_in_chunks(stream, payload.encode("utf-8"), size)
+
+    assert list(stream.rows) == rows[:4] + [{"blob": b"foo"}]
+    assert stream.finish() == {"t": P_RESPONSE.SUCCESS_PARTIAL, "r": [], "n": []}
+
+
+def test_rows_available_before_response_complete():
+    """
+    Test the complete rows are handed out while the rest is not received yet.
+    """
+
+    stream = ResponseStream(ReQLDecoder())
+
+    assert stream.feed(b'{"t":3,"r":[{"id":1},{"id"') == 1
+    assert list(stream.rows) == [{"id": 1}]
+
+    assert stream.feed(b":2}]}") == 1
+    assert list(stream.rows) == [{"id": 1}, {"id": 2}]
+
+
+def test_error_rows_kept():
+    """
+    Test the rows of error responses are returned by finish only.
+    """
+
+    payload = {"t": P_RESPONSE.RUNTIME_ERROR, "r": ["Error."], "b": [], "e": 1}
+
+    stream = ResponseStream(ReQLDecoder())
+    stream.feed(json.dumps(payload).encode("utf-8"))
+
+    assert not stream.rows
+    assert stream.finish() == payload
+
+
+def test_rows_before_response_type():
+    """
+    Test the rows received before the response type are handed out once the type
+    is known.
+    """
+
+    stream = ResponseStream(ReQLDecoder())
+
+    assert stream.feed(b'{"r":[1,2],') == 0
+    assert stream.feed(b'"t":2}') == 2
+    assert list(stream.rows) == [1, 2]
+
+
+def test_closed_stream_drops_rows():
+    """
+    Test the rows received after closing the stream are dropped.
+    """
+
+    stream = ResponseStream(ReQLDecoder())
+    stream.feed(b'{"t":3,"r":[1,')
+    stream.close()
+    stream.feed(b"2]}")
+
+    assert not stream.rows
+
+
+def test_incomplete_response():
+    """
+    Test finishing an incomplete response raises an error.
+    """
+
+    stream = ResponseStream(ReQLDecoder())
+    stream.feed(b'{"t":3,"r":[1')
+
+    with pytest.raises(ReqlDriverError):
+        stream.finish()
+
+
+def test_invalid_response():
+    """
+    Test the decoding errors are raised by finish.
+    """
+
+    stream = ResponseStream(ReQLDecoder())
+    stream.feed(b'["t",3]')
+
+    with pytest.raises(ReqlDriverError):
+        stream.finish()
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b'{"t":3,"r":[{"n":[1]},"]"],"n":[]}',
+        b'{"t": 3, "r": [{"n":[1]}, "]"], "n": [1, 2]}',
+        b'{"t":3,"r":[{"n":[1]},"]"]}',
+    ],
+)
+def test_raw_rows(payload):
+    """
+    Test the raw decoder returns the rows as a slice of the payload.
+    """
+
+    response = RawResponseDecoder().decode_bytes(payload)
+    (rows,) = response["r"]
+
+    assert response["t"] == P_RESPONSE.SUCCESS_PARTIAL
+    assert isinstance(rows, memoryview)
+    assert rows.obj is payload
+    assert json.loads(bytes(rows)) == [{"n": [1]}, "]"]
+    assert response["n"] == json.loads(payload).get("n", [])
+
+
+def test_raw_atom():
+    """
+    Test the raw decoder returns the value of an atom without the array around it.
+    """
+
+    response = RawResponseDecoder().decode_bytes(b'{"t":1,"r":[ {"a":[]} ]}')
+
+    assert [bytes(value) for value in response["r"]] == [b'{"a":[]}']
+
+
+def test_raw_empty_batch():
+    """
+    Test the raw decoder returns no rows for an empty batch.
+    """
+
+    assert RawResponseDecoder().decode_bytes(b'{"t":2,"r":[],"n":[]}')["r"] == []
+
+
+def test_raw_profile():
+    """
+    Test the responses of profiled queries are decoded and the rows are encoded again.
+    """
+
+    payload = json.dumps(
+        {"t": P_RESPONSE.SUCCESS_SEQUENCE, "r": [1, "a"], "p": [{"d": "x"}]}
+    )
+    response = RawResponseDecoder(profile=True).decode_bytes(payload.encode("utf-8"))
+
+    assert bytes(response["r"][0]) == b'[1,"a"]'
+    assert response["p"] == [{"d": "x"}]
+
+
+def test_raw_error():
+    """
+    Test the raw decoder decodes error responses.
+    """
+
+    payload = {"t": P_RESPONSE.RUNTIME_ERROR, "r": ["Error."], "b": [], "e": 1}
+
+    assert RawResponseDecoder().decode_bytes(json.dumps(payload).encode()) == payload
+
+
+def test_iter_raw_json():
+    """
+    Test the raw batches are forwarded as one JSON array.
+    """
+
+    batches = [memoryview(b"[1,2]"), memoryview(b'[{"a":3}]')]
+
+    assert b"".join(iter_raw_json(batches)) == b'[1,2,{"a":3}]'
+    assert b"".join(iter_raw_json([])) == b"[]"
+
+
+def test_aiter_raw_json():
+    """
+    Test the raw batches of an asynchronous iterable are forwarded as one JSON array.
+    """
+
+    async def batches():
+        yield memoryview(b"[1]")
+        yield memoryview(b"[2]")
+
+    async def collect():
+        return b"".join([chunk async for chunk in aiter_raw_json(batches())])
+
+    assert asyncio.run(collect()) == b"[1,2]"
+
+
+def test_raw_other_layout():
+    """
+    Test the responses with a different layout are decoded and the rows are encoded
+    again.
+    """
+
+    response = RawResponseDecoder().decode_bytes(b'{"n":[],"t":2,"r":[1, 2]}')
+
+    assert bytes(response["r"][0]) == b"[1,2]"
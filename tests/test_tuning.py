@@ -0,0 +1,214 @@
+import pytest
+
+from rethinkdb import query as r
+from rethinkdb.errors import ReqlDriverError
+from rethinkdb.net import connect
+from rethinkdb.ql2_pb2 import Query as PQuery
+from rethinkdb.ql2_pb2 import Response as PResponse
+from rethinkdb.tuning import AdaptiveBatchSizer
+from tests.helpers import FakeServer
+from tests.test_cache import FakeClock
+
+P_QUERY = PQuery.QueryType
+P_RESPONSE = PResponse.ResponseType
+
+
+def test_no_measurement():
+    """
+    Test the query shapes without measured batches keep the server defaults.
+    """
+
+    assert AdaptiveBatchSizer().batch_optargs("shape") == {}
+
+
+def test_small_rows_fast_consumer():
+    """
+    Test the batches of small rows consumed quickly are bounded by `max_batch_rows`.
+    """
+
+    sizer = AdaptiveBatchSizer(max_batch_rows=5000)
+    sizer.observe("shape", rows=100, size=5000, decode_seconds=0, drain_seconds=0)
+
+    assert sizer.batch_optargs("shape") == {
+        "max_batch_rows": 5000,
+        "max_batch_bytes": 250000,
+    }
+
+
+def test_large_rows():
+    """
+    Test the batches of large documents are bounded by `max_batch_bytes`.
+    """
+
+    sizer = AdaptiveBatchSizer(max_batch_bytes=1000000)
+    sizer.observe("shape", rows=10, size=1000000, decode_seconds=0, drain_seconds=0)
+
+    assert sizer.batch_optargs("shape") == {
+        "max_batch_rows": 16,
+        "max_batch_bytes": 1000000,
+    }
+
+    sizer = AdaptiveBatchSizer(max_batch_bytes=1000000, min_batch_rows=1)
+    sizer.observe("shape", rows=10, size=1000000, decode_seconds=0, drain_seconds=0)
+
+    assert sizer.batch_optargs("shape") == {
+        "max_batch_rows": 10,
+        "max_batch_bytes": 1000000,
+    }
+
+
+def test_slow_consumer():
+    """
+    Test the batches hold the rows the caller consumes in `target_batch_seconds`.
+    """
+
+    sizer = AdaptiveBatchSizer(target_batch_seconds=0.1)
+    sizer.observe("shape", rows=100, size=10000, decode_seconds=0.1, drain_seconds=0.9)
+
+    assert sizer.batch_optargs("shape") == {
+        "max_batch_rows": 16,
+        "max_batch_bytes": 1600,
+    }
+
+    sizer = AdaptiveBatchSizer(target_batch_seconds=1)
+    sizer.observe("shape", rows=100, size=10000, decode_seconds=0.1, drain_seconds=0.9)
+
+    assert sizer.batch_optargs("shape")["max_batch_rows"] == 100
+
+
+def test_smoothing():
+    """
+    Test the measurements are averaged over the batches.
+    """
+
+    sizer = AdaptiveBatchSizer(max_batch_bytes=1000, min_batch_rows=1, smoothing=0.5)
+    sizer.observe("shape", rows=1, size=100, decode_seconds=0, drain_seconds=0)
+    sizer.observe("shape", rows=1, size=300, decode_seconds=0, drain_seconds=0)
+
+    assert sizer.batch_optargs("shape")["max_batch_rows"] == 5
+
+
+def test_observer_prefetched_batches():
+    """
+    Test a batch received before the caller consumed the earlier one is reported
+    together with it, and does not replace it.
+    """
+
+    clock = FakeClock()
+    sizer = AdaptiveBatchSizer(
+        max_batch_bytes=1000,
+        target_batch_seconds=10,
+        min_batch_rows=1,
+        smoothing=0.5,
+        clock=clock,
+    )
+    observer = sizer.apply(r.table("users"), {})
+
+    observer.received(rows=1, size=100, decode_seconds=0)
+    clock.now += 0.5
+    observer.received(rows=1, size=300, decode_seconds=0)
+    clock.now += 0.5
+    observer.drained()
+    observer.drained()
+
+    assert sizer.batch_optargs(observer.key) == {
+        "max_batch_rows": 5,
+        "max_batch_bytes": 1000,
+    }
+
+
+def test_max_size():
+    """
+    Test the least recently measured query shapes are evicted.
+    """
+
+    sizer = AdaptiveBatchSizer(max_size=2)
+
+    for key in ("a", "b", "a", "c"):
+        sizer.observe(key, rows=1, size=100, decode_seconds=0, drain_seconds=0)
+
+    assert len(sizer) == 2
+    assert sizer.batch_optargs("b") == {}
+    assert sizer.batch_optargs("a") != {}
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"max_batch_bytes": 0},
+        {"target_batch_seconds": 0},
+        {"min_batch_rows": 0},
+        {"min_batch_rows": 10, "max_batch_rows": 5},
+        {"smoothing": 0},
+        {"max_size": 0},
+    ],
+)
+def test_invalid_configuration(kwargs):
+    """
+    Test the sizer rejects invalid settings.
+    """
+
+    with pytest.raises(ReqlDriverError):
+        AdaptiveBatchSizer(**kwargs)
+
+
+def batches_handler(batches):
+    """
+    Return a handler replying to the START and CONTINUE queries of every token with
+    the given batches.
+    """
+
+    remaining = {}
+
+    def handler(server, token, message):
+        if message[0] == P_QUERY.START:
+            remaining[token] = list(batches)
+
+        if message[0] in (P_QUERY.START, P_QUERY.CONTINUE):
+            batch = remaining[token].pop(0)
+            response_type = (
+                P_RESPONSE.SUCCESS_PARTIAL
+                if remaining[token]
+                else P_RESPONSE.SUCCESS_SEQUENCE
+            )
+            server.send(token, {"t": response_type, "r": batch})
+
+    return handler
+
+
+def test_run_tuned():
+    """
+    Test the batches of a cursor tune the batch sizes of the next runs of the same
+    query shape, without overriding the options passed to `run`.
+    """
+
+    clock = FakeClock()
+    sizer = AdaptiveBatchSizer(min_batch_rows=1, clock=clock)
+    handler = batches_handler([[{"id": 1}, {"id": 2}], [{"id": 3}]])
+
+    with FakeServer(handler) as server:
+        conn = connect(host="127.0.0.1", port=server.port, timeout=5, batch_sizer=sizer)
+
+        for limit in (10, 20):
+            for _ in r.table("users").limit(limit).run(conn):
+                clock.now += 0.01
+
+        cursor = r.table("users").limit(30).run(conn, max_batch_rows=50)
+        assert [row["id"] for row in cursor] == [1, 2, 3]
+
+        cursor = r.table("users").run(conn, stream_rows=True)
+        assert len(list(cursor)) == 3
+
+        conn.close(noreply_wait=False)
+
+    starts = [
+        message[2] for _, message in server.queries if message[0] == P_QUERY.START
+    ]
+
+    assert len(sizer) == 1
+    assert starts[0] == {}
+    # Ten rows are consumed in the target batch time, and a row takes 20-30 bytes
+    assert starts[1]["max_batch_rows"] == 10
+    assert 200 <= starts[1]["max_batch_bytes"] <= 300
+    assert starts[2]["max_batch_rows"] == 50
+    assert starts[3] == {}